@@ -0,0 +1,131 @@
+'''
+Multi-Resolution Active Shape Models' fitting procedure with a latency budget.
+The anytime fitting procedure keeps track of the best constrained shape found so far
+and returns it as soon as the budget is spent. The remaining budget is divided
+over the remaining levels of the gaussian pyramid, so time not spent at a coarse
+level (because the shape converged early) is spent at the finer levels. An iteration
+is only started if its estimated duration (kept over calls) fits in the budget of its
+level, so the start points are returned if the budget does not allow a single iteration.
+The fitting procedure uses the models created by fitting.preprocess.
+@author     Matthias Moulin & Milan Samyn
+@version    1.0
+'''
+
+import numpy as np
+import time
+
+import batch_fitting as bf
+import configuration as c
+import fitting as f
+import fitting_utils as fu
+import gaussian_image_piramid as gip
+
+smoothing = 0.5                 # The weight of the last iteration in the estimated duration of an iteration
+
+_it_time = None                 # The estimated duration of an iteration (kept over calls, so the first iteration of a call can be estimated)
+
+def multi_resolution_search_anytime(img, P, tooth_index, budget, fitting_function=1, stacks=None):
+    '''
+    Fits the tooth corresponding to the given tooth index in the given image
+    within the given latency budget.
+    A constrained shape found at a finer level is always preferred over a constrained
+    shape found at a coarser level. At the same level, the constrained shape with the
+    lowest total profile cost is preferred, unless the fitting procedure converges at
+    the finest level (then the converged shape is returned).
+    @param img:                 the image
+    @param P:                   the start points for the target tooth
+    @param tooth_index:         the index of the the target tooth (used in MS, EWS, pns, pts)
+    @param budget:              the latency budget (in seconds), which includes building the
+                                gaussian pyramid of the image unless the pyramid is given
+    @param fitting_function:    the fitting function used
+                                * 0: fitting function along profile normal through landmark +
+                                     fitting function along profile gradient through landmark
+                                * 1: fitting function along profile normal through landmark
+                                * 2: fitting function along profile gradient through landmark
+    @param stacks:              the stacked gaussian pyramid of the image (see gaussian_image_piramid.get_stacked_gaussian_pyramids)
+                                (default: built from the given image within the budget)
+    @return The best fitted points for the tooth corresponding to the given tooth index
+            (the start points if the deadline passes before the first iteration)
+            and whether the returned points are the points the fitting procedure converged to at the finest level.
+    '''
+    global _it_time
+    deadline = time.time() + budget
+    level = f.max_level
+    if stacks is None:
+        stacks = gip.get_stacked_gaussian_pyramids([img], level)
+    bs = np.zeros(1, dtype=int)
+    tooth_indices = np.array([tooth_index])
+
+    P_start = P
+    # Compute model point positions in image at coarsest level
+    P = np.around(np.divide(P, 2**level))
+    P_best = None
+    level_best = level + 1
+    cost_best = float("inf")
+    it_time = _it_time
+    converged = False
+
+    while (level >= 0 and time.time() < deadline):
+        # Divide the remaining budget over the remaining levels
+        level_deadline = time.time() + (deadline - time.time()) / float(level + 1)
+        nb_it = 0
+        # The first iteration of the first call is only started before the deadline of the level (its duration is not known yet)
+        while (time.time() + (0 if it_time is None else it_time) < level_deadline):
+            start = time.time()
+            nb_it += 1
+            P_found = bf.search_batch(stacks[level], P[np.newaxis,:], bs, tooth_indices, level, fitting_function)
+            P_new = f.validate(None, tooth_index, P_found[0,:], nb_it)
+            nb_close_points = bf.nb_closest_points(P, P_new)
+            P = P_new
+
+            # Repeat unless more than pclose of the points are found close to the current position
+            # or nmax iterations have been applied at this resolution
+            level_converged = (2 * nb_close_points / float(P.shape[0]) >= f.pclose)
+            cost = np.sum(bf.evaluate_batch(stacks[level], P[np.newaxis,:], bs, tooth_indices, level, fitting_function))
+            if (level < level_best or cost < cost_best or (level == 0 and level_converged)):
+                P_best = P
+                level_best = level
+                cost_best = cost
+                converged = (level == 0 and level_converged)
+
+            duration = time.time() - start
+            if it_time is None:
+                it_time = duration
+            else:
+                it_time = smoothing * duration + (1 - smoothing) * it_time
+
+            if (level_converged or nb_it >= f.max_it):
+                break
+
+        level -= 1
+        P = P * 2
+
+    _it_time = it_time
+    if P_best is None:
+        return np.array(P_start, dtype=float), False
+    return P_best * 2**level_best, converged
+
+################################################################################
+# TESTS
+################################################################################
+def test(budget=0.05):
+    import cv2
+    for i in c.get_trainingSamples_range():
+        trainingSamples = c.get_trainingSamples_range()
+        trainingSamples.remove(i)
+        f.preprocess(trainingSamples)
+
+        fname = c.get_fname_vis_pre(i, f.method)
+        img = cv2.imread(fname)
+
+        for j in range(c.get_nb_teeth()):
+            fname = c.get_fname_original_landmark(i, (j+1))
+            P = fu.original_to_cropped(np.fromfile(fname, dtype=float, count=-1, sep=' '))
+            start = time.time()
+            R, converged = multi_resolution_search_anytime(img, P, j, budget)
+            print 'Latency: ' + str(time.time() - start) + 's, Converged: ' + str(converged)
+            fname = str(i) + '-' + str((j+1)) + 'a.png'
+            cv2.imwrite(fname, fu.mark_results(np.copy(img), np.array([P, R])))
+
+if __name__ == "__main__":
+    test()
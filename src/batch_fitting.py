@@ -0,0 +1,300 @@
+'''
+Multi-Resolution Active Shape Models' fitting procedure for a batch of images.
+All images of the batch advance through the resolution schedule in lockstep:
+the profile sampling and the evaluation of the fitting functions at a level are
+done for all images at once. Images that are converged at a level drop out of
+the batch for the remainder of that level.
+The fitting procedure uses the models created by fitting.preprocess.
+@author     Matthias Moulin & Milan Samyn
+@version    1.0
+'''
+
+import numpy as np
+
+import configuration as c
+import fitting as f
+import fitting_function as ff
+import fitting_utils as fu
+import gaussian_image_piramid as gip
+import math_utils as mu
+
+def multi_resolution_search_batch(imgs, PS, tooth_indices, fitting_function=1):
+    '''
+    Fits the teeth corresponding to the given tooth indices in the given images.
+    For each image, the result is the same as the result of
+    fitting.multi_resolution_search for that image.
+    @param imgs:                the images
+    @param PS:                  for each image, the start points for the target tooth
+    @param tooth_indices:       for each image, the index of the target tooth (used in MS, EWS, pns, pts)
+                                or one index of the target tooth for all images
+    @param fitting_function:    the fitting function used
+                                * 0: fitting function along profile normal through landmark +
+                                     fitting function along profile gradient through landmark
+                                * 1: fitting function along profile normal through landmark
+                                * 2: fitting function along profile gradient through landmark
+    @return The fitted points for each image (shape = (nb images, nb dimensions))
+            and for each image, the total number of iterations used.
+    '''
+    stacks = gip.get_stacked_gaussian_pyramids(imgs, f.max_level)
+    return multi_resolution_search_stacked(stacks, range(len(imgs)), PS, tooth_indices, fitting_function)
+
+def multi_resolution_search_stacked(stacks, bs, PS, tooth_indices, fitting_function=1):
+    '''
+    Fits the teeth corresponding to the given tooth indices in the given stacked
+    gaussian pyramids. The stacked pyramids are only read, so they can be shared.
+    @param stacks:              for each level, the stacked images and their shapes
+                                (see gaussian_image_piramid.get_stacked_gaussian_pyramids)
+    @param bs:                  for each target tooth, the index of its image in the stacked images
+    @param PS:                  for each target tooth, the start points
+    @param tooth_indices:       for each target tooth, the index of the target tooth (used in MS, EWS, pns, pts)
+                                or one index of the target tooth for all target teeth
+    @param fitting_function:    the fitting function used
+    @return The fitted points for each target tooth (shape = (nb target teeth, nb dimensions))
+            and for each target tooth, the total number of iterations used.
+    '''
+    bs = np.array(bs, dtype=int)
+    nb_imgs = bs.shape[0]
+    tooth_indices = np.zeros(nb_imgs, dtype=int) + tooth_indices
+    level = f.max_level
+
+    # Compute model point positions in images at coarsest level
+    PS = np.around(np.divide(np.array(PS, dtype=float), 2**level))
+    nb_its = np.zeros(nb_imgs, dtype=int)
+
+    while (level >= 0):
+        active = np.arange(nb_imgs)
+        nb_it = 0
+        while (active.shape[0] > 0):
+            nb_it += 1
+            nb_its[active] += 1
+            P_found = search_batch(stacks[level], PS[active,:], bs[active], tooth_indices[active], level, fitting_function)
+
+            converged = np.zeros(active.shape[0], dtype=bool)
+            for b in range(active.shape[0]):
+                P_new = f.validate(None, tooth_indices[active[b]], P_found[b,:], nb_it)
+                nb_close_points = nb_closest_points(PS[active[b],:], P_new)
+                PS[active[b],:] = P_new
+                converged[b] = (2 * nb_close_points / float(P_new.shape[0]) >= f.pclose)
+
+            print 'Level:' + str(level) + ', Iteration: ' + str(nb_it) + ', Converged: ' + str(np.sum(converged)) + '/' + str(active.shape[0])
+
+            # Repeat for the images for which less than pclose of the points are found close
+            # to the current position unless nmax iterations have been applied at this resolution
+            if (nb_it >= f.max_it):
+                break
+            active = active[~converged]
+
+        if (level > 0):
+            PS = PS * 2
+        level -= 1
+
+    return PS, nb_its
+
+def search_batch(stack, PS, bs, tooth_indices, level, fitting_function=1, models=None, m=None):
+    '''
+    Searches along the profiles of all landmarks for the best new positions
+    for the given points in the given stacked images (one iteration of the
+    fitting procedure without validation).
+    @param stack:               the stacked images and their shapes (at the given level)
+    @param PS:                  for each image, the current points for the target tooth
+    @param bs:                  for each image, the index of the image in the stacked images
+    @param tooth_indices:       for each image, the index of the target tooth
+    @param level:               the current level
+    @param fitting_function:    the fitting function used
+    @param models:              the (mean samples, inverted covariances) for each level, for each tooth, for each landmark,
+                                for the profile normal and the profile gradient (default: fitting.pns and fitting.pts)
+    @param m:                   the number of pixels to sample either side for each of the model points along the profile
+                                (default: fitting.m)
+    @return The best new positions of the points for each image.
+    '''
+    imgs, shapes = stack
+    k = f.k
+    if m is None:
+        m = f.m
+    if (fitting_function==0):
+        rn = rt = range(-(m-k), (m-k)+1)
+    elif (fitting_function==1):
+        rn = range(-(m-k), (m-k)+1)
+        rt = [0]
+    else:
+        rn = [0]
+        rt = range(-(m-k), (m-k)+1)
+    # All candidates (ordered as they are visited by fitting.multi_resolution_search)
+    ns = np.repeat(rn, len(rt)).astype(float)
+    ts = np.tile(rt, len(rn)).astype(float)
+
+    if models is None:
+        models = (f.pns, f.pts)
+    (G_MU_N, C_N), (G_MU_T, C_T) = models
+
+    nb = PS.shape[0]
+    nc = ns.shape[0]
+    pxs = PS[:,0::2].copy()
+    pys = PS[:,1::2].copy()
+    cbs = np.repeat(bs, nc)
+    nb_landmarks = pxs.shape[1]
+    for i in range(nb_landmarks):
+        # Like fitting.multi_resolution_search, the points already moved in this iteration are used
+        dxs = pxs[:,(i+1) % nb_landmarks] - pxs[:,(i-1) % nb_landmarks]
+        dys = pys[:,(i+1) % nb_landmarks] - pys[:,(i-1) % nb_landmarks]
+        sqs = np.sqrt(dxs*dxs + dys*dys)
+        # Profile Tangent to Boundary
+        txs = (dxs / sqs)
+        tys = (dys / sqs)
+        # Profile Normal to Boundary
+        nxs = - tys
+        nys = txs
+
+        xs = mu.round_away(pxs[:,i,np.newaxis] + ns * nxs[:,np.newaxis] + ts * txs[:,np.newaxis])
+        ys = mu.round_away(pys[:,i,np.newaxis] + ns * nys[:,np.newaxis] + ts * tys[:,np.newaxis])
+        xs = xs.ravel()
+        ys = ys.ravel()
+
+        # The profiles are sampled and scored in the floating point type of the profile models
+        GN, valid_n = ff.create_Gis(imgs, shapes, cbs, xs, ys, np.repeat(nxs, nc), np.repeat(nys, nc), k, C_N.dtype)
+        GT, valid_t = ff.create_Gis(imgs, shapes, cbs, xs, ys, np.repeat(txs, nc), np.repeat(tys, nc), k, C_T.dtype)
+
+        fn = ff.evaluate_profile_models(GN.reshape(nb, nc, -1), G_MU_N[level,tooth_indices,i], C_N[level,tooth_indices,i])
+        ft = ff.evaluate_profile_models(GT.reshape(nb, nc, -1), G_MU_T[level,tooth_indices,i], C_T[level,tooth_indices,i])
+        fs = fu.evaluate_fitting(fn=fn, ft=ft, fitting_function=fitting_function)
+        fs[~(valid_n & valid_t).reshape(nb, nc)] = float("inf")
+
+        best = f.best_candidate(fs)
+        found = np.isfinite(fs[np.arange(nb), best])
+        xs = xs.reshape(nb, nc)[np.arange(nb), best]
+        ys = ys.reshape(nb, nc)[np.arange(nb), best]
+        pxs[found,i] = xs[found]
+        pys[found,i] = ys[found]
+
+    P_found = np.zeros(PS.shape)
+    P_found[:,0::2] = pxs
+    P_found[:,1::2] = pys
+    return P_found
+
+def evaluate_batch(stack, PS, bs, tooth_indices, level, fitting_function=1, models=None):
+    '''
+    Evaluates the fitting functions at the given points (without searching along
+    the profiles) in the given stacked images.
+    @param stack:               the stacked images and their shapes (at the given level)
+    @param PS:                  for each image, the points for the target tooth
+    @param bs:                  for each image, the index of the image in the stacked images
+    @param tooth_indices:       for each image, the index of the target tooth
+    @param level:               the current level
+    @param fitting_function:    the fitting function used
+    @param models:              the (mean samples, inverted covariances) for each level, for each tooth, for each landmark,
+                                for the profile normal and the profile gradient (default: fitting.pns and fitting.pts)
+    @return For each image, for each landmark, the evaluated fitting function
+            (infinite if the profile can not be sampled).
+    '''
+    imgs, shapes = stack
+    nb = PS.shape[0]
+    pxs = PS[:,0::2]
+    pys = PS[:,1::2]
+    nb_landmarks = pxs.shape[1]
+    dxs = np.roll(pxs, -1, axis=1) - np.roll(pxs, 1, axis=1)
+    dys = np.roll(pys, -1, axis=1) - np.roll(pys, 1, axis=1)
+    sqs = np.sqrt(dxs*dxs + dys*dys)
+    # Profile Tangent to Boundary
+    txs = (dxs / sqs).ravel()
+    tys = (dys / sqs).ravel()
+    # Profile Normal to Boundary
+    nxs = - tys
+    nys = txs
+
+    xs = mu.round_away(pxs).ravel()
+    ys = mu.round_away(pys).ravel()
+    cbs = np.repeat(bs, nb_landmarks)
+    if models is None:
+        models = (f.pns, f.pts)
+    (G_MU_N, C_N), (G_MU_T, C_T) = models
+
+    GN, valid_n = ff.create_Gis(imgs, shapes, cbs, xs, ys, nxs, nys, f.k, C_N.dtype)
+    GT, valid_t = ff.create_Gis(imgs, shapes, cbs, xs, ys, txs, tys, f.k, C_T.dtype)
+    fn = ff.evaluate_profile_models(GN.reshape(nb, nb_landmarks, 1, -1), G_MU_N[level,tooth_indices], C_N[level,tooth_indices])
+    ft = ff.evaluate_profile_models(GT.reshape(nb, nb_landmarks, 1, -1), G_MU_T[level,tooth_indices], C_T[level,tooth_indices])
+    fs = fu.evaluate_fitting(fn=fn[:,:,0], ft=ft[:,:,0], fitting_function=fitting_function)
+    fs[~(valid_n & valid_t).reshape(nb, nb_landmarks)] = float("inf")
+    return fs
+
+def nb_closest_points(P, P_new):
+    '''
+    Returns the number of points of P_new that are close to the corresponding
+    points of P (see fitting.close_to_current_position).
+    @param P:                   the points before the iteration
+    @param P_new:               the points after the iteration
+    @return The number of points of P_new that are close to the corresponding points of P.
+    '''
+    distances = np.sqrt((P_new[0::2] - P[0::2]) ** 2 + (P_new[1::2] - P[1::2]) ** 2)
+    return np.sum(distances <= 1.5)
+
+################################################################################
+# TESTS
+################################################################################
+def test():
+    import cv2
+    import time
+    for i in c.get_trainingSamples_range():
+        trainingSamples = c.get_trainingSamples_range()
+        trainingSamples.remove(i)
+        f.preprocess(trainingSamples)
+
+        fname = c.get_fname_vis_pre(i, f.method)
+        img = cv2.imread(fname)
+
+        PS = np.zeros((c.get_nb_teeth(), c.get_nb_dim()))
+        for j in range(c.get_nb_teeth()):
+            fname = c.get_fname_original_landmark(i, (j+1))
+            PS[j,:] = fu.original_to_cropped(np.fromfile(fname, dtype=float, count=-1, sep=' '))
+
+        start = time.time()
+        RS, nb_its = multi_resolution_search_batch([img] * c.get_nb_teeth(), PS, range(c.get_nb_teeth()))
+        print 'Batch: ' + str(time.time() - start) + 's, Iterations: ' + str(nb_its)
+
+        fname = str(i) + 'b.png'
+        cv2.imwrite(fname, fu.mark_results(np.copy(img), RS))
+
+def test_precision(tolerance=0.5):
+    '''
+    Checks that the fitted points with single precision profile models (fitting.dtype = np.float32)
+    are within the given (sub-pixel) tolerance of the fitted points with double precision profile
+    models, for each fitting function.
+    @param tolerance:           the tolerance (in pixels)
+    @throws AssertionError:     if a fitted point is not within the given tolerance
+    '''
+    import cv2
+    dtype = f.dtype
+    distances = []
+    try:
+        for i in c.get_trainingSamples_range():
+            trainingSamples = c.get_trainingSamples_range()
+            trainingSamples.remove(i)
+
+            fname = c.get_fname_vis_pre(i, f.method)
+            img = cv2.imread(fname)
+
+            PS = np.zeros((c.get_nb_teeth(), c.get_nb_dim()))
+            for j in range(c.get_nb_teeth()):
+                fname = c.get_fname_original_landmark(i, (j+1))
+                # Start a few pixels away from the landmarks, so the search has to move
+                PS[j,:] = fu.original_to_cropped(np.fromfile(fname, dtype=float, count=-1, sep=' ')) + np.tile([5, -5], c.get_nb_landmarks())
+
+            RS = []
+            for d in [np.float64, np.float32]:
+                f.dtype = d
+                f.preprocess(trainingSamples)
+                RS.append([multi_resolution_search_batch([img] * c.get_nb_teeth(), PS, range(c.get_nb_teeth()), fitting_function)[0]
+                           for fitting_function in range(3)])
+            for fitting_function in range(3):
+                R64, R32 = RS[0][fitting_function], RS[1][fitting_function]
+                distances.append(np.sqrt((R64[:,0::2] - R32[:,0::2]) ** 2 + (R64[:,1::2] - R32[:,1::2]) ** 2))
+                print ('Fitting function ' + str(fitting_function) + ', Profile models (single precision): ' + str(f.pns[1].nbytes + f.pts[1].nbytes) +
+                       ' bytes, Largest distance: ' + str(distances[-1].max()))
+    finally:
+        f.dtype = dtype
+    distances = np.array(distances)
+    print 'Mean distance: ' + str(distances.mean()) + ', Largest distance: ' + str(distances.max())
+    if distances.max() > tolerance:
+        raise AssertionError('Largest distance ' + str(distances.max()) + ' exceeds the tolerance of ' + str(tolerance) + ' pixels')
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,273 @@
+'''
+Benchmark suite of the stages of the Active Shape Models' pipeline:
+    * preprocessor.preproccess_image (one radiograph);
+    * procrustes_analysis.PA and principal_component_analysis.pca_percentage (all teeth);
+    * fitting_function.create_partial_GS_for_multiple_levels and
+      fitting_function.create_profile_models_for_multiple_levels (one fold);
+    * fitting.multi_resolution_search (each tooth, each fitting function) and
+      batch_fitting.multi_resolution_search_stacked (all teeth).
+The inputs of a benchmark are prepared once (outside the measurements). Each benchmark
+is measured in a forked process (so benchmarks do not influence each other's memory):
+after one warm-up run (e.g. filling the image cache), the stage is run a number of times
+and the minimum, median and maximum time and the peak growth of the resident memory are
+recorded. The results are written as JSON and compared against a stored baseline: a
+benchmark regresses if its median time or its memory exceeds the baseline by more than a
+relative tolerance (and an absolute margin for the noise of short benchmarks).
+@author     Matthias Moulin & Milan Samyn
+@version    1.0
+'''
+
+import cv2
+import json
+import multiprocessing
+import numpy as np
+import os
+import platform
+import resource
+import time
+
+import batch_fitting as bf
+import configuration as c
+import experiment as e
+import fitting as f
+import fitting_function as ff
+import fitting_utils as fu
+import gaussian_image_piramid as gip
+import image_cache as ic
+import loader as l
+import preprocessor as pre
+import principal_component_analysis as pca
+import procrustes_analysis as pa
+
+version = 1                     # The version of the format of the results
+nb_repeats = 5                  # The number of measured runs of each benchmark (after one warm-up run)
+tolerance = 0.2                 # The tolerated relative increase of the median time and the memory
+time_margin = 0.005             # The tolerated absolute increase of the median time (in seconds)
+memory_margin = 2 * 2**20       # The tolerated absolute increase of the memory (in bytes)
+fold = 1                        # The test sample of the fold used by the benchmarks
+
+def get_info():
+    '''
+    Returns the description of the machine, the libraries and the settings of the fitting procedure.
+    @return The description of the machine, the libraries and the settings of the fitting procedure.
+    '''
+    return {'machine' : platform.node(), 'processor' : platform.processor(), 'python' : platform.python_version(),
+            'numpy' : np.__version__, 'cv2' : cv2.__version__, 'settings' : e.get_settings()}
+
+def get_benchmarks():
+    '''
+    Returns the benchmarks. Each benchmark prepares its inputs when it is called
+    and returns the stage to measure (a function without arguments).
+    @return The (name, benchmark) pairs of all benchmarks (in order).
+    '''
+    trainingSamples = c.get_trainingSamples_range()
+    trainingSamples.remove(fold)
+    data = {}
+
+    def get_XS():
+        if 'XS' not in data:
+            data['XS'] = l.create_partial_XS(trainingSamples)
+        return data['XS']
+
+    def get_YS():
+        if 'YS' not in data:
+            data['YS'] = [pa.PA(get_XS()[j,:,:])[1] for j in range(c.get_nb_teeth())]
+        return data['YS']
+
+    def get_GNS():
+        if 'GNS' not in data:
+            data['GNS'] = ff.create_partial_GS_for_multiple_levels(trainingSamples, get_XS(), f.MS, (f.max_level+1), offsetX=fu.offsetX,
+                                                                   offsetY=fu.offsetY, k=f.k, method=f.method)[0]
+        return data['GNS']
+
+    def get_PS():
+        # The models of the fold are the models of the fitting procedure
+        if 'PS' not in data:
+            f.preprocess(trainingSamples)
+            data['PS'] = e.get_start_points(fold, trainingSamples)
+        return data['PS']
+
+    def preproccess_image():
+        img = cv2.imread(c.get_fname_radiograph(fold))
+        offsets = pre.learn_offsets_safe(l.create_full_XS())
+        return lambda: pre.preproccess_image(img, *offsets)
+
+    def PA():
+        XS = get_XS()
+        return lambda: [pa.PA(XS[j,:,:]) for j in range(c.get_nb_teeth())]
+
+    def pca_percentage():
+        YS = get_YS()
+        return lambda: [pca.pca_percentage(Y) for Y in YS]
+
+    def create_partial_GS_for_multiple_levels():
+        get_PS()
+        XS = get_XS()
+        return lambda: ff.create_partial_GS_for_multiple_levels(trainingSamples, XS, f.MS, (f.max_level+1), offsetX=fu.offsetX,
+                                                                offsetY=fu.offsetY, k=f.k, method=f.method)
+
+    def create_profile_models_for_multiple_levels():
+        get_PS()
+        GNS = get_GNS()
+        return lambda: ff.create_profile_models_for_multiple_levels(GNS, f.dtype)
+
+    def multi_resolution_search(j, fitting_function):
+        def benchmark():
+            PS = get_PS()
+            img = ic.get_image(fold, f.method)
+            return lambda: f.multi_resolution_search(img, PS[j,:], j, fitting_function)
+        return benchmark
+
+    def multi_resolution_search_stacked():
+        PS = get_PS()
+        stacks = gip.get_stacked_gaussian_pyramids([ic.get_image(fold, f.method)], f.max_level)
+        return lambda: bf.multi_resolution_search_stacked(stacks, np.zeros(c.get_nb_teeth()), PS, np.arange(c.get_nb_teeth()))
+
+    benchmarks = [('preproccess_image', preproccess_image),
+                  ('PA', PA),
+                  ('pca_percentage', pca_percentage),
+                  ('create_partial_GS_for_multiple_levels', create_partial_GS_for_multiple_levels),
+                  ('create_profile_models_for_multiple_levels', create_profile_models_for_multiple_levels)]
+    for fitting_function in range(3):
+        for j in range(c.get_nb_teeth()):
+            benchmarks.append(('multi_resolution_search-' + str(j+1) + '-f' + str(fitting_function), multi_resolution_search(j, fitting_function)))
+    benchmarks.append(('multi_resolution_search_stacked', multi_resolution_search_stacked))
+    return benchmarks
+
+def get_peak_memory():
+    '''
+    Returns the peak resident memory of this process.
+    @return The peak resident memory of this process (in bytes).
+    '''
+    # Linux reports kilobytes, OS X reports bytes
+    factor = 1 if platform.system() == 'Darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * factor
+
+def measure(stage, nb_repeats, connection):
+    '''
+    Measures the given stage (in a forked process) and sends the measurements through the given connection.
+    @param stage:               the stage (a function without arguments)
+    @param nb_repeats:          the number of measured runs
+    @param connection:          the connection
+    '''
+    try:
+        memory = get_peak_memory()
+        stage()
+        times = []
+        for r in range(nb_repeats):
+            start = time.time()
+            stage()
+            times.append(time.time() - start)
+        connection.send({'min' : min(times), 'median' : float(np.median(times)), 'max' : max(times),
+                         'memory' : get_peak_memory() - memory})
+    except Exception as exception:
+        connection.send({'error' : repr(exception)})
+    finally:
+        connection.close()
+
+def run(names=None, nb_repeats=nb_repeats):
+    '''
+    Runs the benchmarks.
+    @param names:               the names of the benchmarks to run (default: all benchmarks)
+    @param nb_repeats:          the number of measured runs of each benchmark
+    @return The results (see get_info) with for each benchmark, the minimum, median and maximum time
+            (in seconds) and the peak growth of the resident memory (in bytes).
+    '''
+    results = {'version' : version, 'nb_repeats' : nb_repeats, 'info' : get_info(), 'benchmarks' : {}}
+    for name, benchmark in get_benchmarks():
+        if (names is not None and name not in names):
+            continue
+        stage = benchmark()
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(target=measure, args=(stage, nb_repeats, sender))
+        process.start()
+        sender.close()
+        measurement = receiver.recv()
+        process.join()
+        if 'error' in measurement:
+            raise RuntimeError('Benchmark ' + name + ' failed: ' + measurement['error'])
+        results['benchmarks'][name] = measurement
+        print (name.ljust(45) + ('%.4f' % measurement['median']).rjust(10) + 's' +
+               ('%.1f' % (measurement['memory'] / float(2**20))).rjust(10) + 'MB')
+    return results
+
+def write(results, name):
+    '''
+    Writes the given results.
+    @param results:             the results
+    @param name:                the name of the results (see configuration.get_fname_benchmark)
+    '''
+    fname = c.get_fname_benchmark(name)
+    if not os.path.isdir(os.path.dirname(fname)):
+        os.makedirs(os.path.dirname(fname))
+    with open(fname, 'w') as results_file:
+        json.dump(results, results_file, indent=1, sort_keys=True)
+
+def read(name):
+    '''
+    Reads the results with the given name.
+    @param name:                the name of the results
+    @return The results with the given name (None if there are no such results).
+    '''
+    fname = c.get_fname_benchmark(name)
+    if not os.path.isfile(fname):
+        return None
+    with open(fname, 'r') as results_file:
+        return json.load(results_file)
+
+def compare(results, baseline, tolerance=tolerance):
+    '''
+    Compares the given results against the given baseline.
+    @param results:             the results
+    @param baseline:            the results of the baseline
+    @param tolerance:           the tolerated relative increase of the median time and the memory
+    @return The regressions: the (name, quantity, baseline value, value) of each benchmark
+            whose median time or memory exceeds the baseline.
+    '''
+    if baseline['version'] != results['version']:
+        raise ValueError('The baseline has another version: ' + str(baseline['version']))
+    if baseline['info'] != json.loads(json.dumps(results['info'])):
+        print 'Warning: the baseline was measured on another machine or with other settings: ' + str(baseline['info'])
+    regressions = []
+    for name, measurement in sorted(results['benchmarks'].items()):
+        if name not in baseline['benchmarks']:
+            continue
+        reference = baseline['benchmarks'][name]
+        if measurement['median'] > reference['median'] * (1 + tolerance) + time_margin:
+            regressions.append((name, 'median', reference['median'], measurement['median']))
+        if measurement['memory'] > reference['memory'] * (1 + tolerance) + memory_margin:
+            regressions.append((name, 'memory', reference['memory'], measurement['memory']))
+    return regressions
+
+def check(name='latest', baseline_name='baseline', names=None, nb_repeats=nb_repeats, update_baseline=False):
+    '''
+    Runs the benchmarks, writes the results and compares them against the baseline.
+    If there is no baseline (or the baseline must be updated), the results become the baseline.
+    @param name:                the name of the results
+    @param baseline_name:       the name of the baseline
+    @param names:               the names of the benchmarks to run (default: all benchmarks)
+    @param nb_repeats:          the number of measured runs of each benchmark
+    @param update_baseline:     must the results become the baseline
+    @return The regressions (see compare).
+    '''
+    results = run(names, nb_repeats)
+    write(results, name)
+    baseline = read(baseline_name)
+    if (baseline is None or update_baseline):
+        write(results, baseline_name)
+        print 'Baseline written: ' + c.get_fname_benchmark(baseline_name)
+        return []
+    regressions = compare(results, baseline)
+    for name, quantity, reference, value in regressions:
+        print 'Regression: ' + name + ' ' + quantity + ' ' + str(reference) + ' -> ' + str(value)
+    print 'Regressions: ' + str(len(regressions))
+    return regressions
+
+################################################################################
+# TESTS
+################################################################################
+def test():
+    check()
+
+if __name__ == "__main__":
+    test()
@@ -4,13 +4,14 @@ Classification utils
 @version    1.0
 '''
 
-import cv2
+import math
 import numpy as np
 import math_utils as mu
 import loader as l
 import procrustes_analysis as pa
 import fitting_utils as fu
 import configuration as c
+import sample_export as se
 
 def get_average_size(method=''):
     IBS = create_individual_bboxes(method)
@@ -48,7 +49,61 @@ def get_average_params(trainingSamples, method=''):
         Params[j,2] = ms / n
         Params[j,3] = mtheta / n
     return Params
-    
+
+def get_neighbour_offsets(poses, MS_ref, mask=None, MS=None):
+    '''
+    Returns for each tooth, the average pose offset (dx, dy, ds, dtheta) with respect to
+    its left neighbour in the same jaw. The translation (dx, dy) between both centers
+    is expressed in the coordinate frame of the neighbour (i.e. rotated by -theta and
+    divided by s of the neighbour), ds is the ratio of both scales and dtheta is the
+    difference of both rotations (see get_neighbour_params).
+    The offsets of the first tooth of each jaw are (0, 0, 1, 0).
+    @param poses:               the poses (see landmark_statistics.get_poses)
+    @param MS_ref:              the reference mean shapes of the poses (see landmark_statistics.get_poses)
+    @param mask:                the mask that selects the training samples (default: all training samples)
+    @param MS:                  the mean shapes the poses of the offsets must refer to (e.g. fitting.MS of a fold)
+                                (default: the reference mean shapes)
+    @return For each tooth, the average pose offset with respect to its left neighbour.
+    '''
+    if mask is None:
+        mask = np.ones(poses.shape[1], dtype=bool)
+    Poses = poses[:,mask,:].copy()
+    if MS is not None:
+        # Compose with the similarity that aligns the given mean shapes with the reference mean shapes
+        # (see landmark_statistics.get_average_params)
+        for j in range(MS.shape[0]):
+            s, theta = mu.align_params(mu.center_onOrigin(MS[j,:]), MS_ref[j,:])
+            Poses[j,:,2] *= s
+            Poses[j,:,3] += theta
+
+    Offsets = np.zeros((c.get_nb_teeth(), 4))
+    Offsets[:,2] = 1
+    for j in range(c.get_nb_teeth()):
+        if (j == 0 or j == c.get_nb_teeth()/2): continue
+        tx, ty, s, theta = Poses[j-1,:,0], Poses[j-1,:,1], Poses[j-1,:,2], Poses[j-1,:,3]
+        dx = Poses[j,:,0] - tx
+        dy = Poses[j,:,1] - ty
+        Offsets[j,0] = np.mean(( np.cos(theta) * dx + np.sin(theta) * dy) / s)
+        Offsets[j,1] = np.mean((-np.sin(theta) * dx + np.cos(theta) * dy) / s)
+        Offsets[j,2] = np.mean(Poses[j,:,2] / s)
+        Offsets[j,3] = np.mean(Poses[j,:,3] - theta)
+    return Offsets
+
+def get_neighbour_params(params, offsets):
+    '''
+    Returns the pose (tx, ty, s, theta) of a tooth predicted from the pose of
+    its left neighbour and the pose offset of the tooth (see get_neighbour_offsets).
+    @param params:              the pose (tx, ty, s, theta) of the left neighbour
+    @param offsets:             the pose offset (dx, dy, ds, dtheta) of the tooth
+    @return The predicted pose (tx, ty, s, theta) of the tooth.
+    '''
+    tx, ty, s, theta = params
+    dx, dy, ds, dtheta = offsets
+    return (tx + s * (math.cos(theta) * dx - math.sin(theta) * dy),
+            ty + s * (math.sin(theta) * dx + math.cos(theta) * dy),
+            s * ds,
+            theta + dtheta)
+
 def create_average_models(trainingSamples, method=''):
     XS = l.create_partial_XS(trainingSamples)
     MS = np.zeros((c.get_nb_teeth(), c.get_nb_dim()))
@@ -119,95 +174,10 @@ def create_bboxes(method=''):
     return BS
 
 def create_negatives(method=''):
-    XS = l.create_full_XS()
-    
-    for i in c.get_trainingSamples_range():
-        fname = c.get_fname_vis_pre(i, method)
-        img = cv2.imread(fname)
-        
-        s = ''    
-        if (i < 10): s = '0'
-        
-        min_y = min_x = float("inf")
-        max_y = max_x = 0
-    
-        for j in range(0, c.get_nb_teeth()/2):
-            x_coords, y_coords = mu.extract_coordinates(XS[j, i-1, :])
-            for k in range(c.get_nb_landmarks()):
-                if x_coords[k] < min_x: min_x = x_coords[k]
-                if x_coords[k] > max_x: max_x = x_coords[k]
-                if y_coords[k] < min_y: min_y = y_coords[k]
-                if y_coords[k] > max_y: max_y = y_coords[k]
-        
-        fname = c.get_dir_prefix() + 'data/Visualizations/Classified Samples/' + method + str(s) + str(i) + '-l' + '.png'    
-        cv2.imwrite(fname, img[max_y-fu.offsetY+1:,:])
-        
-        min_y = min_x = float("inf")
-        max_y = max_x = 0
-        
-        for j in range(c.get_nb_teeth()/2, c.get_nb_teeth()):
-            x_coords, y_coords = mu.extract_coordinates(XS[j, i-1, :])
-            for k in range(c.get_nb_landmarks()):
-                if x_coords[k] < min_x: min_x = x_coords[k]
-                if x_coords[k] > max_x: max_x = x_coords[k]
-                if y_coords[k] < min_y: min_y = y_coords[k]
-                if y_coords[k] > max_y: max_y = y_coords[k] 
-        
-        fname = c.get_dir_prefix() + 'data/Visualizations/Classified Samples/' + method + str(s) + str(i) + '-u' + '.png'    
-        cv2.imwrite(fname, img[:min_y-fu.offsetY,:])
-    
-    
-def classify_positives(method=''):
-    XS = l.create_full_XS()
-    
-    for s in c.get_trainingSamples_range():
-        trainingSamples = c.get_trainingSamples_range()
-        trainingSamples.remove(s)
-        try:
-            info_name_upper = c.get_dir_prefix() + 'data/Visualizations/Classified Samples/info' + method + str(s) + '-u' + '.txt' 
-            info_name_lower = c.get_dir_prefix() + 'data/Visualizations/Classified Samples/info' + method + str(s) + '-l' + '.txt' 
-
-            info_file_upper = open(info_name_upper, "w")
-            info_file_lower = open(info_name_lower, "w")
-            
-            for i in trainingSamples:
-                
-                s = ''    
-                if (i < 10):
-                    s = '0'
-                img_name = s + str(i) + '.png'
-                
-                min_y = min_x = float("inf")
-                max_y = max_x = 0
+    se.export_negatives(method)
 
-                for j in range(0, c.get_nb_teeth()/2):
-                    x_coords, y_coords = mu.extract_coordinates(XS[j, i-1, :])
-                    for k in range(c.get_nb_landmarks()):
-                        if x_coords[k] < min_x: min_x = x_coords[k]
-                        if x_coords[k] > max_x: max_x = x_coords[k]
-                        if y_coords[k] < min_y: min_y = y_coords[k]
-                        if y_coords[k] > max_y: max_y = y_coords[k]
-                
-                line = 'rawdata/' + method + img_name + ' 1 ' + str(int(min_x - fu.offsetX)) + ' ' + str(int(min_y - fu.offsetY)) + ' ' + str(int(max_x - min_x)) + ' ' + str(int(max_y - min_y)) + '\n' 
-                info_file_upper.write(line)
-                
-                min_y = min_x = float("inf")
-                max_y = max_x = 0
-                
-                for j in range(c.get_nb_teeth()/2, c.get_nb_teeth()):
-                    x_coords, y_coords = mu.extract_coordinates(XS[j, i-1, :])
-                    for k in range(c.get_nb_landmarks()):
-                        if x_coords[k] < min_x: min_x = x_coords[k]
-                        if x_coords[k] > max_x: max_x = x_coords[k]
-                        if y_coords[k] < min_y: min_y = y_coords[k]
-                        if y_coords[k] > max_y: max_y = y_coords[k] 
-                
-                line = 'rawdata/' + method + img_name + ' 1 ' + str(int(min_x - fu.offsetX)) + ' ' + str(int(min_y - fu.offsetY)) + ' ' + str(int(max_x - min_x)) + ' ' + str(int(max_y - min_y)) + '\n' 
-                info_file_lower.write(line) 
-
-        finally:
-            info_file_upper.close()
-            info_file_lower.close()
+def classify_positives(method=''):
+    se.export_positives(method)
 
 if __name__ == '__main__':
     #create_negatives(method='SCD')
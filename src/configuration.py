@@ -13,6 +13,10 @@ dir_training_radiographs = "data/Radiographs/Training"
 dir_test_radiographs = "data/Radiographs/Test"
 dir_mirrored = "data/Landmarks/mirrored"
 dir_original = "data/Landmarks/original"
+dir_landmark_store = "data/Landmarks"
+dir_results = "data/Results"
+dir_benchmarks = "data/Benchmarks"
+dir_synthetic = "data/Synthetic"
 
 #Own visualizations
 dir_vis_landmarks = "data/Visualizations/Landmarks"
@@ -25,6 +29,9 @@ dir_vis_ff_models = "data/Visualizations/Fitting Function/Models"
 dir_vis_ff_profile_normals = "data/Visualizations/Fitting Function/Profile Normals"
 dir_vis_class_samples = "data/Visualizations/Classified Samples"
 
+#Trained cascades
+dir_cascades = "data/Training/training"
+
 nb_trainingSamples = 14     #from 1 to 14
 nb_testSamples = 16         #from 15 to 30
 
@@ -36,9 +43,13 @@ nb_teeth = 8                #from 1 to 8
 nb_landmarks = 40           #from 1 to 40 (points representing an example)
 nb_dim = nb_landmarks*2
 
+dir_prefix = None           #overrides the directory prefix (e.g. the directory of a synthetic dataset, see synthetic)
+
 #Directories
 
 def get_dir_prefix():
+    if (dir_prefix is not None):
+        return dir_prefix
     if (os.environ.get("USERNAME") == "Milan Samyn"):
         return "../"
     else:
@@ -55,6 +66,18 @@ def get_dir_mirrored_landmarks():
 
 def get_dir_original_landmarks():
     return get_dir_prefix() + dir_original
+
+def get_dir_landmark_store():
+    return get_dir_prefix() + dir_landmark_store
+
+def get_dir_results():
+    return get_dir_prefix() + dir_results
+
+def get_dir_benchmarks():
+    return get_dir_prefix() + dir_benchmarks
+
+def get_dir_synthetic():
+    return get_dir_prefix() + dir_synthetic
     
 def get_dir_vis_landmarks():
     return get_dir_prefix() + dir_vis_landmarks
@@ -83,6 +106,9 @@ def get_dir_vis_ff_profile_normals():
 def get_dir_vis_class_samples():
     return get_dir_prefix() + dir_vis_class_samples
 
+def get_dir_cascades():
+    return get_dir_prefix() + dir_cascades
+
 #File names
   
 def get_fname_radiograph(nr_trainingSample):
@@ -131,6 +157,18 @@ def get_fname_original_landmark(nr_trainingSample, nr_tooth):
     
     return fname
 
+def get_fname_landmark_store():
+    return get_dir_landmark_store() + "/landmarks.npy"
+
+def get_fname_landmark_manifest():
+    return get_dir_landmark_store() + "/landmarks.json"
+
+def get_fname_results(name):
+    return get_dir_results() + "/" + name + ".jsonl"
+
+def get_fname_benchmark(name):
+    return get_dir_benchmarks() + "/" + name + ".json"
+
 def get_fname_vis_landmarks(nr_trainingSample):
     fname = (get_dir_vis_landmarks() + "/landmarks" + str(nr_trainingSample))
     
@@ -248,6 +286,15 @@ def get_fname_vis_class_samples(nr_trainingSample, direction, method=''):
         raise InvalidFileName(fname)
     
     return fname
+
+def get_fname_cascade(nr_trainingSample, direction, method=''):
+    s = '/cascades' + method
+    fname = (get_dir_cascades() + s + str(nr_trainingSample) + '-' + direction + '/cascade.xml')
+    
+    if (not is_valid_trainingSample(nr_trainingSample)):
+        raise InvalidFileName(fname)
+    
+    return fname
     
 #Numbers and ranges
 
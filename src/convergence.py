@@ -0,0 +1,158 @@
+'''
+Convergence controller for the Multi-Resolution Active Shape Models' fitting procedure.
+Besides the proportion of points found close to their current position (pclose)
+and the maximum number of iterations at each level (max_it), the controller tracks
+the total profile cost and the change of the shape parameters between iterations.
+A level is done as soon as the search settles (the shape hardly changes anymore),
+stagnates (the cost does not improve anymore) or oscillates (the shape returns to
+where it was two iterations ago). The controller keeps per-level iteration statistics.
+@author     Matthias Moulin & Milan Samyn
+@version    1.0
+'''
+
+import numpy as np
+
+import fitting as f
+
+class ConvergenceController(object):
+
+    def __init__(self, pclose=None, max_it=None, cost_tolerance=0.01, params_tolerance=0.05, patience=3, early_exit=True):
+        '''
+        Creates a convergence controller.
+        @param pclose:              the desired proportion of points found close to their current position
+                                    (default: fitting.pclose)
+        @param max_it:              the maximum number of iterations allowed at each level
+                                    (default: fitting.max_it)
+        @param cost_tolerance:      the relative improvement of the lowest total profile cost (at the current level)
+                                    below which an iteration does not improve the cost
+        @param params_tolerance:    the largest change of a shape parameter (in standard deviations)
+                                    below which an iteration does not change the shape
+        @param patience:            the number of successive iterations without improvement of the cost
+                                    (stagnation) or returning to the shape of two iterations ago (oscillation)
+                                    after which a level is done
+        @param early_exit:          must the level be done when the search settles, stagnates or oscillates
+                                    (otherwise only pclose and max_it are used, but the statistics
+                                    are still kept)
+        '''
+        if pclose is None:
+            pclose = f.pclose
+        if max_it is None:
+            max_it = f.max_it
+        self.pclose = pclose
+        self.max_it = max_it
+        self.cost_tolerance = cost_tolerance
+        self.params_tolerance = params_tolerance
+        self.patience = patience
+        self.early_exit = early_exit
+        self.statistics = []
+
+    def start_level(self, level):
+        '''
+        Starts a new level.
+        @param level:               the level
+        '''
+        self.level = level
+        self.cost_best = float("inf")
+        self.params = []
+        self.nb_stagnating = 0
+        self.nb_oscillating = 0
+        self.statistics.append({'level' : level, 'iterations' : 0, 'reason' : None, 'cost' : float("inf")})
+
+    def update(self, ratio, cost, bs):
+        '''
+        Updates the controller with the results of an iteration at the current level.
+        @param ratio:               the proportion of points found close to their current position
+        @param cost:                the total profile cost of the points found
+        @param bs:                  the (limited) shape parameters after validation, in standard deviations
+        @return True if and only if the current level is done.
+        '''
+        statistics = self.statistics[-1]
+        statistics['iterations'] += 1
+        statistics['cost'] = cost
+
+        # The first cost of a level (or the first finite cost) is an improvement (inf - inf is nan)
+        if (not np.isfinite(self.cost_best) or cost < self.cost_best - self.cost_tolerance * abs(self.cost_best)):
+            self.nb_stagnating = 0
+        else:
+            self.nb_stagnating += 1
+        self.cost_best = min(self.cost_best, cost)
+
+        settled = False
+        if len(self.params) > 0:
+            change = np.max(np.abs(bs - self.params[-1]))
+            settled = (change <= self.params_tolerance)
+        if len(self.params) > 1:
+            # Back (closer) to the shape of two iterations ago than to the shape of the previous iteration
+            returning = (np.max(np.abs(bs - self.params[-2])) < 0.5 * change)
+            self.nb_oscillating = (self.nb_oscillating + 1) if returning else 0
+        self.params.append(bs)
+
+        if (ratio >= self.pclose):
+            statistics['reason'] = 'pclose'
+        elif (self.early_exit and settled):
+            statistics['reason'] = 'settled'
+        elif (self.early_exit and self.nb_stagnating >= self.patience):
+            statistics['reason'] = 'stagnation'
+        elif (self.early_exit and self.nb_oscillating >= self.patience):
+            statistics['reason'] = 'oscillation'
+        elif (statistics['iterations'] >= self.max_it):
+            statistics['reason'] = 'max_it'
+        return (statistics['reason'] is not None)
+
+    def get_nb_iterations(self):
+        '''
+        Returns the total number of iterations over all levels.
+        @return The total number of iterations over all levels.
+        '''
+        return sum([statistics['iterations'] for statistics in self.statistics])
+
+    def show_statistics(self):
+        '''
+        Prints the iteration statistics of each level.
+        '''
+        for statistics in self.statistics:
+            print 'Level:' + str(statistics['level']) + ', Iterations: ' + str(statistics['iterations']) + ', Reason: ' + str(statistics['reason']) + ', Cost: ' + str(statistics['cost'])
+
+################################################################################
+# TESTS
+################################################################################
+def test():
+    import cv2
+    import configuration as c
+    import fitting_utils as fu
+
+    # The first iteration of a level never stagnates (also not after an infinite cost)
+    controller = ConvergenceController(patience=1)
+    controller.start_level(0)
+    done_first = controller.update(0.0, 10.0, np.zeros(2))
+    nb_stagnating_first = controller.nb_stagnating
+    controller.start_level(0)
+    controller.update(0.0, float("inf"), np.zeros(2))
+    done_infinite = controller.update(0.0, 10.0, np.ones(2))
+    print ('First iteration: ' + str(not done_first and nb_stagnating_first == 0) +
+           ', After infinite cost: ' + str(not done_infinite and controller.nb_stagnating == 0))
+
+    nb_its_default = nb_its_early_exit = 0
+    for i in c.get_trainingSamples_range():
+        trainingSamples = c.get_trainingSamples_range()
+        trainingSamples.remove(i)
+        f.preprocess(trainingSamples)
+
+        fname = c.get_fname_vis_pre(i, f.method)
+        img = cv2.imread(fname)
+
+        for j in range(c.get_nb_teeth()):
+            fname = c.get_fname_original_landmark(i, (j+1))
+            P = fu.original_to_cropped(np.fromfile(fname, dtype=float, count=-1, sep=' '))
+            controller = ConvergenceController(early_exit=False)
+            f.multi_resolution_search(img, P, j, controller=controller)
+            nb_its_default += controller.get_nb_iterations()
+            controller = ConvergenceController()
+            f.multi_resolution_search(img, P, j, controller=controller)
+            controller.show_statistics()
+            nb_its_early_exit += controller.get_nb_iterations()
+
+    print 'Iterations (pclose and max_it): ' + str(nb_its_default) + ', Iterations (early exit): ' + str(nb_its_early_exit)
+
+if __name__ == "__main__":
+    test()
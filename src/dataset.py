@@ -0,0 +1,159 @@
+'''
+Lazy dataset of training samples.
+A dataset yields for each selected training sample a (number of the training sample,
+landmarks, image) record. The landmarks are views on the landmark store (see landmark_store)
+and the (preprocessed) image (or a level of its gaussian pyramid) is only read when its record
+is reached, through the byte-budgeted image cache (see image_cache), so iterating over a dataset
+keeps a bounded number of images in memory. Optionally, the next images are read ahead by a
+background thread while the current record is processed.
+@author     Matthias Moulin & Milan Samyn
+@version    1.0
+'''
+
+import numpy as np
+import Queue
+import sys
+import threading
+
+import configuration as c
+import image_cache as ic
+import landmark_store as ls
+
+_end = object()                 # The marker of the end of the records read ahead
+_error = object()               # The marker of an exception raised while reading ahead
+
+class Dataset(object):
+
+    def __init__(self, trainingSamples=None, teeth=None, method='', images=True, nb_prefetch=0, level=0):
+        '''
+        Creates a dataset of the given training samples.
+        @param trainingSamples:     the training samples (default: all training samples)
+        @param teeth:               the indices of the teeth of the landmarks (default: all teeth)
+        @param method:              the method used for preprocessing
+        @param images:              must the records contain the images (otherwise the images are None)
+        @param nb_prefetch:         the number of images read ahead (0: no images are read ahead)
+        @param level:               the level of the gaussian pyramid of the images (0: the images themselves)
+        '''
+        if trainingSamples is None:
+            trainingSamples = c.get_trainingSamples_range()
+        self.trainingSamples = list(trainingSamples)
+        self.teeth = None if teeth is None else np.array(teeth, dtype=int)
+        self.method = method
+        self.images = images
+        self.nb_prefetch = nb_prefetch
+        self.level = level
+
+    def __len__(self):
+        return len(self.trainingSamples)
+
+    def get_landmarks(self, nr_trainingSample):
+        '''
+        Returns the landmarks of the selected teeth of the given training sample.
+        @param nr_trainingSample:   the number of the training sample
+        @return The (read-only) landmarks (shape = (nb selected teeth, nb dimensions)).
+                If all teeth are selected, the landmarks are a view on the landmark store.
+        '''
+        X = ls.get_landmarks()[nr_trainingSample-1].reshape(c.get_nb_teeth(), c.get_nb_dim())
+        if self.teeth is None:
+            return X
+        return X[self.teeth,:]
+
+    def get_image(self, nr_trainingSample):
+        '''
+        Returns the (preprocessed) image of the given training sample at the level of this dataset (see image_cache).
+        @param nr_trainingSample:   the number of the training sample
+        @return The (read-only) image of the given training sample at the level of this dataset.
+        '''
+        return ic.get_pyramid(nr_trainingSample, self.method, self.level)
+
+    def get_record(self, nr_trainingSample):
+        '''
+        Returns the record of the given training sample.
+        @param nr_trainingSample:   the number of the training sample
+        @return The (number of the training sample, landmarks, image) record of the given training sample.
+        '''
+        img = self.get_image(nr_trainingSample) if self.images else None
+        return nr_trainingSample, self.get_landmarks(nr_trainingSample), img
+
+    def subset(self, trainingSamples=None, teeth=None):
+        '''
+        Returns the dataset of the given subset of the training samples and teeth of this dataset.
+        @param trainingSamples:     the training samples (default: the training samples of this dataset)
+        @param teeth:               the indices of the teeth (default: the teeth of this dataset)
+        @return The dataset of the given subset.
+        '''
+        if trainingSamples is None:
+            trainingSamples = self.trainingSamples
+        elif not set(trainingSamples) <= set(self.trainingSamples):
+            raise ValueError('Training samples not in the dataset: ' + str(sorted(set(trainingSamples) - set(self.trainingSamples))))
+        if teeth is None:
+            teeth = self.teeth
+        elif self.teeth is not None:
+            teeth = self.teeth[np.array(teeth, dtype=int)]
+        return Dataset(trainingSamples, teeth, self.method, self.images, self.nb_prefetch, self.level)
+
+    def __iter__(self):
+        if (self.nb_prefetch <= 0 or not self.images):
+            for nr_trainingSample in self.trainingSamples:
+                yield self.get_record(nr_trainingSample)
+            return
+
+        # The records are read ahead by a background thread (OpenCV releases the GIL while reading)
+        queue = Queue.Queue(maxsize=self.nb_prefetch)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    queue.put(item, timeout=0.1)
+                    return True
+                except Queue.Full:
+                    pass
+            return False
+
+        def read_ahead():
+            try:
+                for nr_trainingSample in self.trainingSamples:
+                    if not put(self.get_record(nr_trainingSample)):
+                        return
+                put(_end)
+            except:
+                put((_error, sys.exc_info()))
+
+        thread = threading.Thread(target=read_ahead)
+        thread.daemon = True
+        thread.start()
+        try:
+            while True:
+                item = queue.get()
+                if item is _end:
+                    return
+                if item[0] is _error:
+                    raise item[1][0], item[1][1], item[1][2]
+                yield item
+        finally:
+            stop.set()
+            thread.join()
+
+################################################################################
+# TESTS
+################################################################################
+def test(method='SCD'):
+    import time
+    import loader as l
+
+    XS = l.create_full_XS()
+    for nb_prefetch in [0, 2]:
+        dataset = Dataset(method=method, nb_prefetch=nb_prefetch)
+        start = time.time()
+        equal = True
+        for nr_trainingSample, X, img in dataset:
+            equal &= np.array_equal(X, XS[:,nr_trainingSample-1,:])
+            img.mean()
+        print 'Prefetch ' + str(nb_prefetch) + ': ' + str(time.time() - start) + 's, Landmarks: ' + str(equal)
+
+    dataset = Dataset(method=method).subset([2, 5], [4, 5])
+    print 'Subset: ' + str([(nr_trainingSample, X.shape) for nr_trainingSample, X, img in dataset])
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,126 @@
+'''
+Detection of the upper and lower jaw with the trained cascade classifiers.
+The cascade classifiers are loaded once and shared by all detections. Both jaws
+are detected in one (shared) grey scale image, each within a region of interest
+derived from the bounding boxes of that jaw in the training samples, and
+only detections with a size similar to the size of the training jaws are considered.
+The detected jaw boxes have the layout of landmark_statistics.get_jaw_bboxes
+(x_min, x_max, y_min, y_max of the upper jaw, x_min, x_max, y_min, y_max of the lower jaw),
+so they can be used directly to initialize the fitting procedure (see fitting.test3_combined).
+@author     Matthias Moulin & Milan Samyn
+@version    1.0
+'''
+
+import cv2
+import numpy as np
+
+import configuration as c
+import gaussian_image_piramid as gip
+import landmark_statistics as ls
+
+directions = ['u', 'l']         # The direction of each jaw (used in the file names of the cascade classifiers)
+margin = 0.25                   # The margin around the bounding boxes of the training jaws (relative to their size)
+                                # used for the regions of interest
+scale_factor = 1.05             # The scale factor between two successive scales of the detection
+min_neighbors = 0               # The minimal number of neighbouring detections of a detection
+                                # (0: all raw detections are considered, the weak cascades rarely agree)
+
+_cascades = {}                  # The loaded cascade classifiers (by file name)
+
+def get_cascade(fname):
+    '''
+    Returns the cascade classifier stored in the given file. Each cascade classifier is only loaded once.
+    @param fname:               the file name of the cascade classifier
+    @return The cascade classifier stored in the given file.
+    '''
+    if fname not in _cascades:
+        cascade = cv2.CascadeClassifier(fname)
+        if cascade.empty():
+            raise IOError('Cascade classifier could not be loaded: ' + fname)
+        _cascades[fname] = cascade
+    return _cascades[fname]
+
+class JawDetector(object):
+
+    def __init__(self, trainingSamples, nr_cascade, method=''):
+        '''
+        Creates a detector for both jaws.
+        @param trainingSamples:     the training samples (used for the regions of interest and the jaw sizes)
+        @param nr_cascade:          the number of the cascade classifiers (the training sample left out while training them)
+        @param method:              the method used for preprocessing
+        '''
+        self.cascades = [get_cascade(c.get_fname_cascade(nr_cascade, direction, method)) for direction in directions]
+
+        IBS = ls.get_individual_bboxes(ls.get_landmarks())
+        BS = ls.get_jaw_bboxes(IBS)[ls.get_mask(trainingSamples),:].reshape(-1, len(directions), 4)
+        widths = BS[:,:,1] - BS[:,:,0]
+        heights = BS[:,:,3] - BS[:,:,2]
+        # For each jaw, the mean box (x_min, x_max, y_min, y_max)
+        self.mean_boxes = BS.mean(axis=0)
+        # For each jaw, the region of interest (x_min, x_max, y_min, y_max)
+        self.rois = np.zeros((len(directions), 4), dtype=int)
+        self.rois[:,0] = np.floor(BS[:,:,0].min(axis=0) - margin * widths.max(axis=0))
+        self.rois[:,1] = np.ceil(BS[:,:,1].max(axis=0) + margin * widths.max(axis=0))
+        self.rois[:,2] = np.floor(BS[:,:,2].min(axis=0) - margin * heights.max(axis=0))
+        self.rois[:,3] = np.ceil(BS[:,:,3].max(axis=0) + margin * heights.max(axis=0))
+        # For each jaw, the minimal and maximal size of a detection
+        self.min_sizes = np.floor((1 - margin) * heights.min(axis=0)).astype(int)
+        self.max_sizes = np.ceil((1 + margin) * widths.max(axis=0)).astype(int)
+
+    def detect(self, img):
+        '''
+        Detects both jaws in the given image.
+        @param img:                 the (preprocessed) image
+        @return The jaw boxes (x_min, x_max, y_min, y_max of the upper jaw, x_min, x_max, y_min, y_max of the lower jaw)
+                and for each jaw, whether it is detected (otherwise the mean box of the training jaws is returned).
+        '''
+        grey = gip.first_channel(img)
+        boxes = np.copy(self.mean_boxes)
+        detected = np.zeros(len(directions), dtype=bool)
+        for j in range(len(directions)):
+            x_min, x_max, y_min, y_max = np.clip(self.rois[j], 0, [grey.shape[1], grey.shape[1], grey.shape[0], grey.shape[0]])
+            roi = grey[y_min:y_max, x_min:x_max]
+            min_size = int(self.min_sizes[j])
+            max_size = int(min(self.max_sizes[j], roi.shape[0], roi.shape[1]))
+            if (max_size < min_size): continue
+            rects = self.cascades[j].detectMultiScale(roi, scaleFactor=scale_factor, minNeighbors=min_neighbors,
+                                                      minSize=(min_size, min_size), maxSize=(max_size, max_size))
+            if len(rects) == 0: continue
+
+            # The detection closest to the mean box of the training jaws
+            rects = np.array(rects, dtype=float)
+            xs = x_min + rects[:,0] + rects[:,2] / 2.0
+            ys = y_min + rects[:,1] + rects[:,3] / 2.0
+            xm = (self.mean_boxes[j,0] + self.mean_boxes[j,1]) / 2.0
+            ym = (self.mean_boxes[j,2] + self.mean_boxes[j,3]) / 2.0
+            r = np.argmin((xs - xm) ** 2 + (ys - ym) ** 2)
+            # The detected box is the mean box of the training jaws centered on the detection
+            boxes[j,:] += [xs[r] - xm, xs[r] - xm, ys[r] - ym, ys[r] - ym]
+            detected[j] = True
+        return boxes.ravel(), detected
+
+################################################################################
+# TESTS
+################################################################################
+def test(method='SCD'):
+    import time
+    for i in c.get_trainingSamples_range():
+        trainingSamples = c.get_trainingSamples_range()
+        trainingSamples.remove(i)
+        detector = JawDetector(trainingSamples, i, method)
+
+        fname = c.get_fname_vis_pre(i, method)
+        img = cv2.imread(fname)
+
+        start = time.time()
+        box, detected = detector.detect(img)
+        print 'Detection: ' + str(time.time() - start) + 's, Detected: ' + str(detected)
+
+        for j in range(len(directions)):
+            x_min, x_max, y_min, y_max = box[4*j:4*(j+1)].astype(int)
+            cv2.rectangle(img, (x_min, y_min), (x_max, y_max), (0, 255, 0), 2)
+        fname = 'test' + str(i) + '-d.png'
+        cv2.imwrite(fname, img)
+
+if __name__ == '__main__':
+    test()
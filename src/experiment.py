@@ -0,0 +1,243 @@
+'''
+Resumable experiment runner for the leave-one-out evaluation of the fitting procedure.
+An experiment fits each (fold, tooth, fitting function) unit with the settings of the
+fitting procedure (see fitting) and appends one record per unit (start points, fitted
+points, error and timings) to an append-only result file (one JSON record per line,
+flushed and synced to disk before the next unit starts). The first record describes the
+settings of the experiment.
+On restart the completed units are read back and skipped, so an interrupted experiment
+only loses the unit it was working on. A line that was only partially written when the
+experiment was interrupted is discarded. The remaining units are grouped per fold (so each
+fold is preprocessed once) and the folds can be fitted on a pool of processes which append
+their records to the same file under a lock.
+@author     Matthias Moulin & Milan Samyn
+@version    1.0
+'''
+
+import cv2
+import json
+import multiprocessing
+import numpy as np
+import os
+import time
+
+import configuration as c
+import fitting as f
+import fitting_utils as fu
+import image_cache as ic
+import landmark_statistics as ls
+import math_utils as mu
+
+settings = ['method', 'k', 'm', 'max_level', 'max_it', 'pclose', 'tolerable_deviation', 'convergence_threshold', 'augmented']
+                                # The settings of the fitting procedure recorded for an experiment
+init_offset = (8, -8)           # The offset of the initial positions of the teeth from their true position
+
+_lock = None                    # The lock of the result file used by a worker process
+
+def get_settings():
+    '''
+    Returns the current settings of the fitting procedure.
+    @return The current settings of the fitting procedure (see fitting).
+    '''
+    return dict([(name, getattr(f, name)) for name in settings])
+
+def get_key(record):
+    '''
+    Returns the key of the unit of the given record.
+    @param record:              the record
+    @return The (fold, tooth, fitting function) key of the unit of the given record.
+    '''
+    return (record['fold'], record['tooth'], record['fitting_function'])
+
+def read(fname):
+    '''
+    Reads the given result file and discards a partially written last line.
+    @param fname:               the file name of the result file
+    @return The settings of the experiment (None if the result file does not exist or is empty)
+            and the records of the completed units.
+    '''
+    if not os.path.isfile(fname):
+        return None, []
+    with open(fname, 'rb+') as result_file:
+        lines = result_file.read().split('\n')
+        # Every complete record ends with a newline
+        if lines[-1] != '':
+            result_file.truncate(result_file.tell() - len(lines[-1]))
+    records = [json.loads(line) for line in lines[:-1]]
+    if len(records) == 0:
+        return None, []
+    return records[0]['settings'], records[1:]
+
+def append(fname, record):
+    '''
+    Appends the given record to the given result file and syncs it to disk.
+    @param fname:               the file name of the result file
+    @param record:              the record
+    '''
+    line = json.dumps(record, sort_keys=True) + '\n'
+    if _lock is not None:
+        _lock.acquire()
+    try:
+        with open(fname, 'ab') as result_file:
+            result_file.write(line)
+            result_file.flush()
+            os.fsync(result_file.fileno())
+    finally:
+        if _lock is not None:
+            _lock.release()
+
+def init_worker(lock):
+    '''
+    Initializes a worker process with the given lock of the result file.
+    @param lock:                the lock of the result file
+    '''
+    global _lock
+    _lock = lock
+
+def get_start_points(i, trainingSamples):
+    '''
+    Returns the initial positions of the teeth of the given test sample: the mean shapes
+    (see fitting.preprocess) with the average pose of the given training samples, near the true position.
+    @param i:                   the number of the test sample
+    @param trainingSamples:     the number of the training samples
+    @return For each tooth, the initial position (shape = (nb teeth, nb dimensions)).
+    '''
+    XS = ls.get_landmarks()
+    poses, MS_ref = ls.get_poses(XS)
+    Params = ls.get_average_params(poses, MS_ref, ls.get_mask(trainingSamples), f.MS)
+    PS = np.zeros((c.get_nb_teeth(), c.get_nb_dim()))
+    for j in range(c.get_nb_teeth()):
+        tx, ty = mu.get_center_of_gravity(XS[j,i-1,:])
+        PS[j,:] = mu.full_align(f.MS[j,:], tx + init_offset[0], ty + init_offset[1], Params[j,2], Params[j,3])
+    return PS
+
+def run_fold(task):
+    '''
+    Fits the given units of one fold and appends their records to the result file.
+    @param task:                the file name of the result file, the settings of the experiment,
+                                the number of the test sample and the (tooth, fitting function) units
+    @return The number of units fitted.
+    '''
+    fname, experiment_settings, i, units = task
+    for name, value in experiment_settings.items():
+        setattr(f, name, value)
+    trainingSamples = c.get_trainingSamples_range()
+    trainingSamples.remove(i)
+
+    start = time.time()
+    f.preprocess(trainingSamples)
+    preprocess_time = time.time() - start
+
+    XS = ls.get_landmarks()
+    PS = get_start_points(i, trainingSamples)
+    img = ic.get_image(i, f.method)
+    for j, fitting_function in units:
+        start = time.time()
+        R = f.multi_resolution_search(img, PS[j,:], j, fitting_function)
+        fitting_time = time.time() - start
+        error = np.sqrt((R[0::2] - XS[j,i-1,0::2]) ** 2 + (R[1::2] - XS[j,i-1,1::2]) ** 2).mean()
+        append(fname, {'fold' : i, 'tooth' : j, 'fitting_function' : fitting_function,
+                       'P' : PS[j,:].tolist(), 'R' : R.tolist(), 'error' : float(error),
+                       'preprocess_time' : preprocess_time, 'fitting_time' : fitting_time})
+    return len(units)
+
+def run(name, folds=None, teeth=None, fitting_functions=None, nb_processes=1):
+    '''
+    Runs (or resumes) the experiment with the given name with the current settings of the fitting procedure.
+    @param name:                the name of the experiment (see configuration.get_fname_results)
+    @param folds:               the numbers of the test samples of the folds (default: all training samples)
+    @param teeth:               the indices of the teeth (default: all teeth)
+    @param fitting_functions:   the fitting functions (default: fitting function 1)
+    @param nb_processes:        the number of processes (1: the folds are fitted in this process)
+    @return The records of all units of the experiment.
+    '''
+    if folds is None:
+        folds = c.get_trainingSamples_range()
+    if teeth is None:
+        teeth = range(c.get_nb_teeth())
+    if fitting_functions is None:
+        fitting_functions = (1,)
+
+    fname = c.get_fname_results(name)
+    if not os.path.isdir(os.path.dirname(fname)):
+        os.makedirs(os.path.dirname(fname))
+    experiment_settings, records = read(fname)
+    if experiment_settings is None:
+        experiment_settings = get_settings()
+        append(fname, {'settings' : experiment_settings})
+    elif experiment_settings != json.loads(json.dumps(get_settings())):
+        raise ValueError('The settings differ from the settings of experiment ' + name + ': ' + str(experiment_settings))
+
+    completed = set([get_key(record) for record in records])
+    tasks = []
+    for i in folds:
+        units = [(j, fitting_function) for j in teeth for fitting_function in fitting_functions if (i, j, fitting_function) not in completed]
+        if len(units) > 0:
+            tasks.append((fname, experiment_settings, i, units))
+    print 'Completed units: ' + str(len(completed)) + ', Remaining units: ' + str(sum([len(task[3]) for task in tasks]))
+
+    if nb_processes == 1:
+        for task in tasks:
+            run_fold(task)
+    elif len(tasks) > 0:
+        pool = multiprocessing.Pool(min(nb_processes, len(tasks)), initializer=init_worker, initargs=(multiprocessing.Lock(),))
+        try:
+            pool.map(run_fold, tasks, 1)
+        finally:
+            pool.close()
+            pool.join()
+
+    keys = set([(i, j, fitting_function) for i in folds for j in teeth for fitting_function in fitting_functions])
+    return [record for record in read(fname)[1] if get_key(record) in keys]
+
+def write_images(name, fitting_function=1):
+    '''
+    Writes for each fold of the experiment with the given name, the image marked with
+    the true, fitted and initial positions of the teeth (see fitting.test3_combined).
+    @param name:                the name of the experiment
+    @param fitting_function:    the fitting function
+    '''
+    experiment_settings, records = read(c.get_fname_results(name))
+    XS = ls.get_landmarks()
+    for i in sorted(set([record['fold'] for record in records])):
+        fold_records = [record for record in records if (record['fold'] == i and record['fitting_function'] == fitting_function)]
+        PS = np.array([XS[record['tooth'],i-1,:] for record in fold_records] + [record['R'] for record in fold_records] + [record['P'] for record in fold_records])
+        color_lines = np.array([[0,0,255]] * len(fold_records) + [[0,255,0]] * len(fold_records) + [[255,0,0]] * len(fold_records))
+        img = np.copy(ic.get_image(i, experiment_settings['method']))
+        cv2.imwrite(name + '-' + str(i) + '.png', fu.mark_results(img, PS, color_lines))
+
+def print_summary(records):
+    '''
+    Prints the mean error and fitting time for each fitting function of the given records.
+    @param records:             the records
+    '''
+    for fitting_function in sorted(set([record['fitting_function'] for record in records])):
+        selected = [record for record in records if record['fitting_function'] == fitting_function]
+        print ('Fitting function ' + str(fitting_function) + ': ' + str(len(selected)) + ' units, Error: ' + str(np.mean([record['error'] for record in selected])) +
+               ', Fitting time: ' + str(np.sum([record['fitting_time'] for record in selected])) + 's')
+
+################################################################################
+# TESTS
+################################################################################
+def test():
+    name = 'test-experiment'
+    fname = c.get_fname_results(name)
+    if os.path.isfile(fname):
+        os.remove(fname)
+
+    # Interrupt the experiment after two folds, with a partially written record
+    run(name, folds=[1, 2])
+    with open(fname, 'ab') as result_file:
+        result_file.write('{"fold": 3, "tooth"')
+    start = time.time()
+    records = run(name, nb_processes=2)
+    print 'Resumed: ' + str(time.time() - start) + 's'
+    print 'Units: ' + str(len(records)) + ', Unique: ' + str(len(set([get_key(record) for record in records])))
+    print_summary(records)
+
+    start = time.time()
+    run(name)
+    print 'Completed: ' + str(time.time() - start) + 's'
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,196 @@
+'''
+Cache for the results of the Multi-Resolution Active Shape Models' fitting procedure.
+A fitting result is identified by the content of the image, the start points, the
+fitting parameters (k, m, max_level, max_it, pclose, fitting_function, tolerable_deviation)
+and a fingerprint of the models created by fitting.preprocess. Identical requests
+are answered from the cache without fitting again.
+The results are kept in memory with a least recently used eviction under a byte
+budget, and optionally on disk, so they survive the process.
+@author     Matthias Moulin & Milan Samyn
+@version    1.0
+'''
+
+import hashlib
+import numpy as np
+import os
+import tempfile
+
+from collections import OrderedDict
+
+import configuration as c
+import fitting as f
+import fitting_utils as fu
+
+max_bytes = 64 * 2**20          # The default byte budget of the results kept in memory
+
+_fingerprint = None             # The models (MS, EWS, pns, pts) of the last computed model fingerprint and that fingerprint
+
+def get_model_fingerprint():
+    '''
+    Returns a fingerprint of the models created by fitting.preprocess.
+    The fingerprint is only recomputed after fitting.preprocess created new models.
+    @return The fingerprint of the models created by fitting.preprocess.
+    '''
+    global _fingerprint
+    models = (f.MS, f.EWS, f.pns, f.pts)
+    if (_fingerprint is None or any([a is not b for a, b in zip(_fingerprint[0], models)])):
+        h = hashlib.sha1()
+        h.update(np.ascontiguousarray(f.MS).tostring())
+        for E, W in f.EWS:
+            h.update(np.ascontiguousarray(E).tostring())
+            h.update(np.ascontiguousarray(W).tostring())
+        for G_MU, C in (f.pns, f.pts):
+            h.update(np.ascontiguousarray(G_MU).tostring())
+            h.update(np.ascontiguousarray(C).tostring())
+        _fingerprint = (models, h.hexdigest())
+    return _fingerprint[1]
+
+def get_key(img, P, tooth_index, fitting_function=1):
+    '''
+    Returns the key of the fitting result of the given request.
+    @param img:                 the image
+    @param P:                   the start points for the target tooth
+    @param tooth_index:         the index of the the target tooth
+    @param fitting_function:    the fitting function used
+    @return The key of the fitting result of the given request.
+    '''
+    img = np.ascontiguousarray(img)
+    P = np.ascontiguousarray(P, dtype=float)
+    h = hashlib.sha1()
+    h.update(str((img.shape, img.dtype.str)))
+    h.update(img.tostring())
+    h.update(P.tostring())
+    h.update(str((tooth_index, fitting_function, f.k, f.m, f.max_level, f.max_it, f.pclose, f.tolerable_deviation, f.method)))
+    h.update(get_model_fingerprint())
+    return h.hexdigest()
+
+class FitCache(object):
+
+    def __init__(self, max_bytes=max_bytes, directory=None):
+        '''
+        Creates a cache for fitting results.
+        @param max_bytes:           the byte budget of the results kept in memory
+        @param directory:           the directory of the results kept on disk
+                                    (default: the results are only kept in memory)
+        '''
+        self.max_bytes = max_bytes
+        self.directory = directory
+        if (directory is not None and not os.path.isdir(directory)):
+            os.makedirs(directory)
+        self.results = OrderedDict()
+        self.nb_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        '''
+        Returns the fitting result with the given key.
+        @param key:                 the key
+        @return The fitting result with the given key (None if the result is not cached).
+        '''
+        if key in self.results:
+            # Mark as most recently used
+            R = self.results.pop(key)
+            self.results[key] = R
+            self.hits += 1
+            return R.copy()
+        if self.directory is not None:
+            fname = self.get_fname(key)
+            if os.path.isfile(fname):
+                R = np.load(fname)
+                self.put_in_memory(key, R)
+                self.disk_hits += 1
+                return R.copy()
+        self.misses += 1
+        return None
+
+    def put(self, key, R):
+        '''
+        Caches the given fitting result with the given key.
+        @param key:                 the key
+        @param R:                   the fitting result
+        '''
+        R = np.array(R, dtype=float)
+        self.put_in_memory(key, R)
+        if self.directory is not None:
+            # Write to a temporary file first, so no partially written result is ever read
+            fd, tmp_name = tempfile.mkstemp(suffix='.npy', dir=self.directory)
+            try:
+                with os.fdopen(fd, 'wb') as tmp_file:
+                    np.save(tmp_file, R)
+                os.rename(tmp_name, self.get_fname(key))
+            except:
+                os.remove(tmp_name)
+                raise
+
+    def put_in_memory(self, key, R):
+        '''
+        Keeps the given fitting result with the given key in memory and evicts the least
+        recently used fitting results until the byte budget is respected.
+        @param key:                 the key
+        @param R:                   the fitting result
+        '''
+        if key in self.results:
+            self.nb_bytes -= self.results.pop(key).nbytes
+        if R.nbytes > self.max_bytes:
+            return
+        self.results[key] = R
+        self.nb_bytes += R.nbytes
+        while self.nb_bytes > self.max_bytes:
+            old_key, old_R = self.results.popitem(last=False)
+            self.nb_bytes -= old_R.nbytes
+
+    def get_fname(self, key):
+        '''
+        Returns the file name of the fitting result with the given key on disk.
+        @param key:                 the key
+        @return The file name of the fitting result with the given key on disk.
+        '''
+        return os.path.join(self.directory, key + '.npy')
+
+    def multi_resolution_search(self, img, P, tooth_index, fitting_function=1):
+        '''
+        Fits the tooth corresponding to the given tooth index in the given image
+        (see fitting.multi_resolution_search) unless the result is cached.
+        @param img:                 the image
+        @param P:                   the start points for the target tooth
+        @param tooth_index:         the index of the the target tooth (used in MS, EWS, pns, pts)
+        @param fitting_function:    the fitting function used
+        @return The fitted points for the tooth corresponding to the given tooth index.
+        '''
+        key = get_key(img, P, tooth_index, fitting_function)
+        R = self.get(key)
+        if R is None:
+            R = f.multi_resolution_search(img, P, tooth_index, fitting_function)
+            self.put(key, R)
+        return R
+
+################################################################################
+# TESTS
+################################################################################
+def test():
+    import cv2
+    import time
+    cache = FitCache()
+    for i in c.get_trainingSamples_range():
+        trainingSamples = c.get_trainingSamples_range()
+        trainingSamples.remove(i)
+        f.preprocess(trainingSamples)
+
+        fname = c.get_fname_vis_pre(i, f.method)
+        img = cv2.imread(fname)
+
+        for j in range(c.get_nb_teeth()):
+            fname = c.get_fname_original_landmark(i, (j+1))
+            P = fu.original_to_cropped(np.fromfile(fname, dtype=float, count=-1, sep=' '))
+            RS = []
+            for r in range(2):
+                start = time.time()
+                RS.append(cache.multi_resolution_search(img, P, j))
+                print 'Fitting: ' + str(time.time() - start) + 's, Hits: ' + str(cache.hits) + ', Misses: ' + str(cache.misses)
+            # The hit returns the points of the miss
+            print 'Identical: ' + str(np.array_equal(RS[0], RS[1]))
+
+if __name__ == "__main__":
+    test()
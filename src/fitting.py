@@ -12,6 +12,7 @@ import configuration as c
 import fitting_function as ff
 import fitting_utils as fu
 import gaussian_image_piramid as gip
+import landmark_statistics as ls
 import loader as l
 import math_utils as mu
 import principal_component_analysis as pca
@@ -21,8 +22,8 @@ from matplotlib import pyplot
 
 MS = None                       # MS contains for each tooth, the tooth model (in the model coordinate frame)
 EWS = []                        # EWS contains for each tooth, a (sqrt(Eigenvalues), Eigenvectors) pair (in the model coordinate frame)
-fns = None                      # fitting functions for each tooth, for each landmark, for the profile normal through that landmark.
-fts = None                      # fitting functions for each tooth, for each landmark, for the profile gradient through that landmark.
+pns = None                      # (mean samples, inverted covariances) for each level, for each tooth, for each landmark, for the profile normal through that landmark.
+pts = None                      # (mean samples, inverted covariances) for each level, for each tooth, for each landmark, for the profile gradient through that landmark.
 
 offsetY = 497.0                 # The landmarks refer to the non-cropped images, so we need the vertical offset (up->down)
                                 # to locate them on the cropped images.
@@ -34,6 +35,10 @@ k = 4                           # The number of pixels to sample either side for
 m = 8                           # The number of pixels to sample either side for each of the model points along the profile normal
                                 # (used while iterating)
 method='SCD'                    # The method used for preproccesing.
+dtype = np.float64              # The floating point type of the profile models and of the profiles sampled and scored while iterating
+                                # (np.float32 halves their memory (bandwidth), see batch_fitting.test_precision)
+augmented = False               # Must the models also be trained on the mirrored landmarks of the training samples
+                                # (sampled in the horizontally flipped images)
 
 convergence_threshold = 0.002   # The convergence threshold (used while iterating).
 tolerable_deviation = 3         # The number of deviations that are tolerable by the models (used for limiting the shape).
@@ -42,8 +47,11 @@ tolerable_deviation = 3         # The number of deviations that are tolerable by
 max_level = 2                   # Coarsest level of gaussian pyramid (depends on the size of the object in the image)
 max_it = 20                     # Maximum number of iterations allowed at each level
 pclose = 0.9                    # Desired proportion of points found within m/2 of current position
+pose_stride = 4                 # The step between two successive landmarks that are searched while fitting only the pose
+tie_tolerance = 1e-4            # The relative difference between the costs of two positions along a profile below which they tie
+                                # (ties are broken in the order the positions are visited, see best_candidate)
 
-def multi_resolution_search(img, P, tooth_index, fitting_function=1, show=False):
+def multi_resolution_search(img, P, tooth_index, fitting_function=1, show=False, controller=None, pose_first=False):
     '''
     Fits the tooth corresponding to the given tooth index in the given image.
     @param img:                 the image  
@@ -55,6 +63,11 @@ def multi_resolution_search(img, P, tooth_index, fitting_function=1, show=False)
                                 * 1: fitting function along profile normal through landmark
                                 * 2: fitting function along profile gradient through landmark
     @param show:                must the intermediate results (after each iteration) be displayed
+    @param controller:          the convergence controller which decides when a level is done
+                                (see convergence.ConvergenceController)
+                                (default: done when pclose is reached or after max_it iterations)
+    @param pose_first:          must only the pose (tx, ty, s, theta) of the mean shape be fitted at the
+                                coarsest level (see pose_search) before the shape is fitted
     @return The fitted points for the tooth corresponding to the given tooth index
             and the number of iterations used.
     '''    
@@ -65,40 +78,15 @@ def multi_resolution_search(img, P, tooth_index, fitting_function=1, show=False)
     
     # Compute model point positions in image at coarsest level
     P = np.around(np.divide(P, 2**level))
+    if (pose_first):
+        P = pose_search(pyramids[level], P, tooth_index, level, fitting_function)
+    if (controller is not None):
+        controller.start_level(level)
     
     while (level >= 0):
         nb_it += 1
-        pxs, pys = mu.extract_coordinates(P)
-        for i in range(c.get_nb_landmarks()):
-            tx, ty, nx, ny = ff.create_ricos(pyramids[level], i, pxs, pys)
-            f_optimal = float("inf")
-            
-            if (fitting_function==0):
-                rn = rt = range(-(m-k), (m-k)+1)
-            elif (fitting_function==1):
-                rn = range(-(m-k), (m-k)+1)
-                rt = [0]
-            else:
-                rn = [0]
-                rt = range(-(m-k), (m-k)+1)
-            
-            for n in rn:
-                for t in rt:
-                    x = round(pxs[i] + n * nx + t * tx)
-                    y = round(pys[i] + n * ny + t * ty)
-                    try:    
-                        fn = fns[level][tooth_index][i](ff.normalize_Gi(ff.create_Gi(pyramids[level], k, x, y, nx, ny)))
-                        ft = fts[level][tooth_index][i](ff.normalize_Gi(ff.create_Gi(pyramids[level], k, x, y, tx, ty)))
-                    except (IndexError): continue
-                    f = fu.evaluate_fitting(fn=fn, ft=ft, fitting_function=fitting_function)
-                    if f < f_optimal:
-                        f_optimal = f
-                        cx = x
-                        cy = y
-            pxs[i] = cx
-            pys[i] = cy
-            
-        P_new = validate(pyramids[level], tooth_index, mu.zip_coordinates(pxs, pys), nb_it, show)
+        P_found, cost = search(pyramids[level], P, tooth_index, level, fitting_function)
+        P_new, bs = validate_with_params(pyramids[level], tooth_index, P_found, nb_it, show)
         nb_close_points = nb_closest_points(P, P_new)
         P = P_new
         
@@ -106,18 +94,136 @@ def multi_resolution_search(img, P, tooth_index, fitting_function=1, show=False)
         # or nmax iterations have been applied at this resolution
         print 'Level:' + str(level) + ', Iteration: ' + str(nb_it) + ', Ratio: ' + str((2 * nb_close_points / float(P.shape[0])))
 
-        converged = (2 * nb_close_points / float(P.shape[0]) >= pclose)    
-        if (converged or nb_it >= max_it):
+        if (controller is not None):
+            done = controller.update((2 * nb_close_points / float(P.shape[0])), cost, (bs / EWS[tooth_index][0]))
+        else:
+            converged = (2 * nb_close_points / float(P.shape[0]) >= pclose)
+            done = (converged or nb_it >= max_it)
+        if (done):
             if (level > 0): 
                 level -= 1
                 nb_it = 0
                 P = P * 2
+                if (controller is not None):
+                    controller.start_level(level)
             else:
                 break
                 
     return P
           
  
+def search(img, P, tooth_index, level, fitting_function=1, landmarks=None):
+    '''
+    Searches along the profiles of all landmarks for the best new positions of the given
+    points for the tooth corresponding to the given tooth index (one iteration of the
+    fitting procedure without validation).
+    @param img:                 the image (at the given level)
+    @param P:                   the current points for the target tooth
+    @param tooth_index:         the index of the the target tooth (used in pns, pts)
+    @param level:               the current level
+    @param fitting_function:    the fitting function used
+    @param landmarks:           the indices of the landmarks to search (default: all landmarks)
+    @return The best new positions of the points and the total profile cost of these positions.
+    '''
+    if landmarks is None:
+        landmarks = range(c.get_nb_landmarks())
+    cost = 0
+    pxs, pys = mu.extract_coordinates(P)
+    (G_MU_N, C_N), (G_MU_T, C_T) = pns, pts
+    for i in landmarks:
+        tx, ty, nx, ny = ff.create_ricos(img, i, pxs, pys)
+        # The profile models of this landmark (the profiles are scored in their floating point type)
+        g_mu_n, c_n = G_MU_N[level,tooth_index,i], C_N[level,tooth_index,i]
+        g_mu_t, c_t = G_MU_T[level,tooth_index,i], C_T[level,tooth_index,i]
+        xs = []
+        ys = []
+        fs = []
+        
+        if (fitting_function==0):
+            rn = rt = range(-(m-k), (m-k)+1)
+        elif (fitting_function==1):
+            rn = range(-(m-k), (m-k)+1)
+            rt = [0]
+        else:
+            rn = [0]
+            rt = range(-(m-k), (m-k)+1)
+        
+        for n in rn:
+            for t in rt:
+                x = round(pxs[i] + n * nx + t * tx)
+                y = round(pys[i] + n * ny + t * ty)
+                try:    
+                    gn = ff.normalize_Gi(ff.create_Gi(img, k, x, y, nx, ny)).astype(c_n.dtype)
+                    gt = ff.normalize_Gi(ff.create_Gi(img, k, x, y, tx, ty)).astype(c_t.dtype)
+                except (IndexError): continue
+                fn = ff.evaluate_profile_models(gn[np.newaxis], g_mu_n, c_n)[0]
+                ft = ff.evaluate_profile_models(gt[np.newaxis], g_mu_t, c_t)[0]
+                xs.append(x)
+                ys.append(y)
+                fs.append(fu.evaluate_fitting(fn=fn, ft=ft, fitting_function=fitting_function))
+        # Stay at the current position if no position along the profile can be evaluated
+        best = best_candidate(np.array(fs)) if len(fs) > 0 else None
+        if (best is None or not np.isfinite(fs[best])):
+            cost += float("inf")
+            continue
+        pxs[i] = xs[best]
+        pys[i] = ys[best]
+        cost += fs[best]
+    return mu.zip_coordinates(pxs, pys), cost
+
+def best_candidate(fs):
+    '''
+    Returns the index of the best position along a profile: the first position (in the order
+    the positions are visited) whose cost ties (see tie_tolerance) with the lowest cost. Positions
+    with mathematically equal costs (e.g. identical profiles) differ by rounding errors only,
+    so these are chosen the same way in single and double precision (see dtype).
+    @param fs:                  the costs of the positions (along the last axis)
+    @return The index of the best position (for each profile).
+    '''
+    # Positions whose cost can not be evaluated are never chosen over positions whose cost can be evaluated
+    fs = np.where(np.isnan(fs), float("inf"), fs)
+    fs_min = fs.min(axis=-1)
+    return np.argmax(fs <= (fs_min * (1 + tie_tolerance))[...,np.newaxis], axis=-1)
+    
+def pose_search(img, P, tooth_index, level, fitting_function=1):
+    '''
+    Fits only the pose (tx, ty, s, theta) of the mean shape of the tooth corresponding to the
+    given tooth index in the given image. After each search along the profiles, the mean
+    shape is aligned with the points found, so the shape itself is not deformed.
+    Four parameters do not need all landmarks, so only every pose_stride-th landmark is searched.
+    @param img:                 the image (at the given level)
+    @param P:                   the start points for the target tooth
+    @param tooth_index:         the index of the the target tooth (used in MS, pns, pts)
+    @param level:               the current level
+    @param fitting_function:    the fitting function used
+    @return The mean shape of the target tooth with the fitted pose.
+    '''
+    MU = MS[tooth_index]
+    tx, ty, s, theta = mu.full_align_params(MU, P)
+    P = mu.full_align(MU, tx, ty, s, theta)
+    
+    landmarks = range(0, c.get_nb_landmarks(), pose_stride)
+    dims = np.array([[2*i, 2*i+1] for i in landmarks]).ravel()
+    nb_it = 0
+    while (nb_it < max_it):
+        nb_it += 1
+        P_found, cost = search(img, P, tooth_index, level, fitting_function, landmarks)
+        s, theta = mu.align_params(mu.center_onOrigin(MU[dims]), mu.center_onOrigin(P_found[dims]))
+        P_new = mu.align(MU, s, theta)
+        # Center the searched landmarks (instead of all landmarks) on the points found
+        xm, ym = mu.get_center_of_gravity(P_found[dims])
+        rxm, rym = mu.get_center_of_gravity(P_new[dims])
+        P_new = mu.translate(P_new, (xm - rxm), (ym - rym))
+        nb_close_points = nb_closest_points(P[dims], P_new[dims])
+        P = P_new
+        
+        print 'Level:' + str(level) + ', Pose Iteration: ' + str(nb_it) + ', Ratio: ' + str((2 * nb_close_points / float(dims.shape[0])))
+        
+        # Repeat unless more than pclose of the searched points are found close to the current position
+        if (2 * nb_close_points / float(dims.shape[0]) >= pclose):
+            break
+    return P
+    
 def nb_closest_points(P, P_new):
     nb_close_points = 0
     for i in range(P.shape[0] / 2):
@@ -140,9 +246,46 @@ def validate(img, tooth_index, P_before, nb_it, show=False):
     @param nb_it:           the number of this iteration
     @param show:            must the intermediate results (after each iteration) be displayed
     '''
+    P_after, bs = validate_with_params(img, tooth_index, P_before, nb_it, show)
+    return P_after
+    
+def validate_with_params(img, tooth_index, P_before, nb_it, show=False):
+    '''
+    Validates the current points P for the target tooth corresponding to the given
+    tooth index.
+    @param img:             the image
+    @param P_before:        the current points for the target tooth before validation
+                            in the image coordinate frame
+    @param tooth_index:     the index of the the target tooth (used in MS, EWS, fs)
+    @param nb_it:           the number of this iteration
+    @param show:            must the intermediate results (after each iteration) be displayed
+    @return The validated points for the target tooth in the image coordinate frame
+            and the (limited) shape parameters of the validated points.
+    '''
     MU = MS[tooth_index]
     E, W = EWS[tooth_index]
+    P_after, bs, PY_before, PY_after = constrain(P_before, MU, E, W)
+    
+    if (show): 
+        fu.show_validation(MU, nb_it, PY_before, PY_after)
+        fu.show_iteration(np.copy(img), nb_it, P_before, P_after)
+        cv2.waitKey(0)
+        pyplot.close()  
 
+    return P_after, bs
+    
+def constrain(P_before, MU, E, W):
+    '''
+    Limits the given points to the shapes allowed by the given shape model.
+    @param P_before:        the points before validation in the image coordinate frame
+    @param MU:              the mean shape (in the model coordinate frame)
+    @param E:               the sqrt(Eigenvalues) of the shape model
+    @param W:               the Eigenvectors of the shape model
+    @return The points after validation in the image coordinate frame,
+            the (limited) shape parameters of the points,
+            the points before validation in the model coordinate frame
+            and the points after validation in the model coordinate frame.
+    '''
     xm, ym = mu.get_center_of_gravity(P_before)
     tx, ty, s, theta = mu.full_align_params(P_before, MU)
     PY_before = mu.full_align(P_before, tx, ty, s, theta)
@@ -152,35 +295,32 @@ def validate(img, tooth_index, P_before, nb_it, show=False):
 
     PY_after = pca.reconstruct(W, bs, MU)
     P_after = mu.full_align(PY_after, xm, ym, 1.0 / s, -theta)
-    
-    if (show): 
-        fu.show_validation(MU, nb_it, PY_before, PY_after)
-        fu.show_iteration(np.copy(img), nb_it, P_before, P_after)
-        cv2.waitKey(0)
-        pyplot.close()  
-
-    return P_after 
+    return P_after, bs, PY_before, PY_after
     
 def preprocess(trainingSamples):
     '''
-    Creates MS, EWS and fs, used by the fitting procedure
+    Creates MS, EWS, pns and pts, used by the fitting procedure
         * MS contains for each tooth, the tooth model (in the model coordinate frame)
         * EWS contains for each tooth, a (sqrt(Eigenvalues), Eigenvectors) pair (in the model coordinate frame)
-        * fitting function for each tooth, for each landmark.
+        * pns and pts contain the profile models for each level, for each tooth, for each landmark (in dtype).
+    If augmented, the models are trained on the landmarks and the mirrored landmarks of the training samples.
     '''
-    global MS, EWS, fns, fts
+    global MS, EWS, pns, pts
     XS = l.create_partial_XS(trainingSamples)
+    XS_mirrored = l.create_partial_XS(trainingSamples, mirrored=True) if augmented else None
     MS = np.zeros((c.get_nb_teeth(), c.get_nb_dim()))
+    EWS = []
     
     for j in range(c.get_nb_teeth()):
-        S = XS[j,:,:]
+        S = XS[j,:,:] if XS_mirrored is None else np.vstack((XS[j,:,:], XS_mirrored[j,:,:]))
         M, Y = pa.PA(S)
         MS[j,:] = M
         E, W, MU = pca.pca_percentage(Y)
         EWS.append((np.sqrt(E), W))
 
-    GNS, GTS = ff.create_partial_GS_for_multiple_levels(trainingSamples, XS, MS, (max_level+1), offsetX=fu.offsetX, offsetY=fu.offsetY, k=k, method=method)
-    fns, fts = ff.create_fitting_functions_for_multiple_levels(GNS, GTS)
+    GNS, GTS = ff.create_partial_GS_for_multiple_levels(trainingSamples, XS, MS, (max_level+1), offsetX=fu.offsetX, offsetY=fu.offsetY, k=k, method=method, XS_mirrored=XS_mirrored)
+    pns = ff.create_profile_models_for_multiple_levels(GNS, dtype)
+    pts = ff.create_profile_models_for_multiple_levels(GTS, dtype)
 
 ################################################################################
 # TESTS
@@ -259,9 +399,19 @@ def test2_combined():
         fname = str(i) + 'm.png'
         cv2.imwrite(fname, fu.mark_results(np.copy(img), Results[(i-1),:], color_lines))
             
-def test3_combined():
-    BS = cu.create_bboxes(method)
-    Avg = cu.get_average_size(method)
+def test3_combined(chained=False):
+    '''
+    Fits all teeth initialized from the bounding boxes of both jaws.
+    @param chained:         must the teeth (except the first tooth of each jaw) be initialized
+                            from the pose of their fitted left neighbour and the learned pose offsets
+                            between both teeth (see classification_utils.get_neighbour_offsets)
+                            instead of from the bounding boxes
+    '''
+    XS = ls.get_landmarks()
+    IBS = ls.get_individual_bboxes(XS)
+    BS = ls.get_jaw_bboxes(IBS)
+    Avg = ls.get_average_sizes(IBS)
+    poses, MS_ref = ls.get_poses(XS)
     
     Results = np.zeros((c.get_nb_trainingSamples(), 3*c.get_nb_teeth(), c.get_nb_dim()))
     color_lines = np.array([np.array([0,0,255]), np.array([0,0,255]), np.array([0,0,255]), np.array([0,0,255]), np.array([0,0,255]), np.array([0,0,255]), np.array([0,0,255]), np.array([0,0,255]), np.array([0,255,0]),np.array([0,255,0]),np.array([0,255,0]),np.array([0,255,0]),np.array([0,255,0]),np.array([0,255,0]),np.array([0,255,0]),np.array([0,255,0]),np.array([255, 0, 0]),np.array([255, 0, 0]),np.array([255, 0, 0]),np.array([255, 0, 0]),np.array([255, 0, 0]),np.array([255, 0, 0]),np.array([255, 0, 0]),np.array([255, 0, 0]),])        
@@ -274,7 +424,8 @@ def test3_combined():
         fname = c.get_fname_vis_pre(i, method)
         img = cv2.imread(fname)
         
-        Params = cu.get_average_params(trainingSamples, method)
+        Params = ls.get_average_params(poses, MS_ref, ls.get_mask(trainingSamples), MS)
+        if (chained): Offsets = cu.get_neighbour_offsets(poses, MS_ref, ls.get_mask(trainingSamples), MS)
         
         x_min = BS[(i-1),0]
         x_max = BS[(i-1),1]
@@ -287,7 +438,11 @@ def test3_combined():
             if j==2: tx = x_max - Avg[3, 0] - Avg[2, 0] / 2.0
             if j==3: tx = x_max - Avg[3, 0] / 2.0
     
-            P = limit(img, mu.full_align(MS[j,:], tx, ty, Params[j,2], Params[j,3]))
+            if (chained and j > 0):
+                params = mu.full_align_params(MS[(j-1),:], Results[(i-1), c.get_nb_teeth()+j-1, :])
+                P = limit(img, mu.full_align(MS[j,:], *cu.get_neighbour_params(params, Offsets[j,:])))
+            else:
+                P = limit(img, mu.full_align(MS[j,:], tx, ty, Params[j,2], Params[j,3]))
             
             fname = c.get_fname_original_landmark(i, (j+1))
             I = fu.original_to_cropped(np.fromfile(fname, dtype=float, count=-1, sep=' '))
@@ -306,7 +461,11 @@ def test3_combined():
             if j==6: tx = x_max - Avg[7, 0] - Avg[6, 0] / 2.0
             if j==7: tx = x_max - Avg[7, 0] / 2.0
             
-            P = limit(img, mu.full_align(MS[j,:], tx, ty, Params[j,2], Params[j,3]))
+            if (chained and j > c.get_nb_teeth()/2):
+                params = mu.full_align_params(MS[(j-1),:], Results[(i-1), c.get_nb_teeth()+j-1, :])
+                P = limit(img, mu.full_align(MS[j,:], *cu.get_neighbour_params(params, Offsets[j,:])))
+            else:
+                P = limit(img, mu.full_align(MS[j,:], tx, ty, Params[j,2], Params[j,3]))
             
             fname = c.get_fname_original_landmark(i, (j+1))
             I = fu.original_to_cropped(np.fromfile(fname, dtype=float, count=-1, sep=' '))
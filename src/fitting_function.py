@@ -6,13 +6,12 @@ training set and building a statistical model of the grey-level structure.
 @version    1.0
 '''
 
-import cv2
 import math
 import numpy as np
 import scipy.spatial.distance as dist
 
 import configuration as c
-import gaussian_image_piramid as gip
+import dataset as ds
 import math_utils as mu
 
 def create_fitting_functions_for_multiple_levels(L_GNS, L_GTS):
@@ -73,7 +72,47 @@ def get_fitting_function(tooth_index, landmark_index, GS):
 
     return fitting_function     
 
-def create_partial_GS_for_multiple_levels(trainingSamples, XS, MS, nb_levels=1, offsetX=0, offsetY=0, k=5, method=''):
+def create_profile_models_for_multiple_levels(L_GS, dtype=np.float64):
+    '''
+    Creates the profile model (the mean sample and the pseudo-inverse of the covariance matrix)
+    for each level, for each tooth, for each landmark. These are the arrays underlying
+    the fitting functions, so they can be evaluated for many samples at once.
+    @param L_GS:             the matrix L_GS which contains for each level, for each tooth, for each of the given training samples,
+                             for each landmark, a normalized sample (along the profile normal/tangent through that landmark)
+    @param dtype:            the floating point type of the profile models
+    @return The mean samples for each level, for each tooth, for each landmark
+            (shape = (nb levels, nb teeth, nb landmarks, 2k+1)) and the pseudo-inverses of the
+            covariance matrices for each level, for each tooth, for each landmark
+            (shape = (nb levels, nb teeth, nb landmarks, 2k+1, 2k+1)).
+            The profile models are computed in double precision and only stored in the given type:
+            the pseudo-inverses are sensitive to the rounding of the samples.
+    '''
+    G_MU = L_GS.mean(axis=2)
+    G = L_GS - G_MU[:,:,np.newaxis,:,:]
+    n = float(L_GS.shape[2])
+    C = np.zeros((L_GS.shape[0], L_GS.shape[1], L_GS.shape[3], L_GS.shape[4], L_GS.shape[4]))
+    for level in range(L_GS.shape[0]):
+        for tooth in range(L_GS.shape[1]):
+            for landmark in range(L_GS.shape[3]):
+                Gl = G[level,tooth,:,landmark,:]
+                # Use the Moore-Penrose pseudo-inverse because C can be singular
+                C[level,tooth,landmark,:] = np.linalg.pinv((np.dot(Gl.T, Gl) / n))
+    return G_MU.astype(dtype), C.astype(dtype)
+    
+def evaluate_profile_models(GS, G_MU, C):
+    '''
+    Calculates the Mahalanobis distances for the given samples (the vectorized
+    counterpart of calling the fitting functions one sample at a time).
+    @param GS:              the samples, shape = (..., nb candidates, 2k+1)
+    @param G_MU:            the mean sample for each sample, shape = (..., 2k+1)
+    @param C:               the pseudo-inverse of the covariance matrix for each sample,
+                            shape = (..., 2k+1, 2k+1)
+    @return The Mahalanobis distances for the given samples, shape = (..., nb candidates).
+    '''
+    D = GS - G_MU[...,np.newaxis,:]
+    return np.sqrt(np.maximum(np.einsum('...ci,...ij,...cj->...c', D, C, D), 0))
+
+def create_partial_GS_for_multiple_levels(trainingSamples, XS, MS, nb_levels=1, offsetX=0, offsetY=0, k=5, method='', XS_mirrored=None):
     '''
     Creates the matrix L_GNS which contains for each level, for each tooth, for each of the given training samples,
     for each landmark, a normalized sample (along the profile normal through the landmarks).
@@ -87,20 +126,24 @@ def create_partial_GS_for_multiple_levels(trainingSamples, XS, MS, nb_levels=1,
     @param offsetY:         the possible offset in y direction (used when working with cropped images and non-cropped landmarks)
     @param k:               the number of pixels to sample either side for each of the model points along the profile normal
     @param method:          the method used for preprocessing
+    @param XS_mirrored:     contains for each tooth, for each training sample, all mirrored landmarks
+                            (default: no mirrored landmarks are used, see create_partial_GS)
     @return The matrix L_GNS which contains for each level, for each tooth, for each of the given training samples,
             for each landmark, a normalized sample (along the profile normal through that landmark).
             The matrix L_GTS which contains for each level, for each tooth, for each of the given training samples,
             for each landmark, a normalized sample (along the profile tangent through that landmark).
     '''
-    L_GNS = np.zeros((nb_levels, c.get_nb_teeth(), len(trainingSamples), c.get_nb_landmarks(), 2*k+1))
-    L_GTS = np.zeros((nb_levels, c.get_nb_teeth(), len(trainingSamples), c.get_nb_landmarks(), 2*k+1))
+    nb_samples = len(trainingSamples) if XS_mirrored is None else 2*len(trainingSamples)
+    L_GNS = np.zeros((nb_levels, c.get_nb_teeth(), nb_samples, c.get_nb_landmarks(), 2*k+1))
+    L_GTS = np.zeros((nb_levels, c.get_nb_teeth(), nb_samples, c.get_nb_landmarks(), 2*k+1))
     for i in range(nb_levels):
-        GNS, GTS = create_partial_GS(trainingSamples, np.around(np.divide(XS, 2**i)), MS, i, offsetX=round(float(offsetX)/2**i), offsetY=round(float(offsetY)/2**i), k=k, method=method)
+        XS_mirrored_i = None if XS_mirrored is None else np.around(np.divide(XS_mirrored, 2**i))
+        GNS, GTS = create_partial_GS(trainingSamples, np.around(np.divide(XS, 2**i)), MS, i, offsetX=round(float(offsetX)/2**i), offsetY=round(float(offsetY)/2**i), k=k, method=method, XS_mirrored=XS_mirrored_i)
         L_GNS[i,:] = GNS
         L_GTS[i,:] = GTS
     return L_GNS, L_GTS  
 
-def create_partial_GS(trainingSamples, XS, MS, level=0, offsetX=0, offsetY=0, k=5, method=''):
+def create_partial_GS(trainingSamples, XS, MS, level=0, offsetX=0, offsetY=0, k=5, method='', XS_mirrored=None):
     '''
     Creates the matrix GNS which contains for each tooth, for each of the given training samples,
     for each landmark, a normalized sample (along the profile normal through the landmarks).
@@ -114,25 +157,35 @@ def create_partial_GS(trainingSamples, XS, MS, level=0, offsetX=0, offsetY=0, k=
     @param offsetY:         the possible offset in y direction (used when working with cropped images and non-cropped landmarks)
     @param k:               the number of pixels to sample either side for each of the model points along the profile normal
     @param method:          the method used for preprocessing
+    @param XS_mirrored:     contains for each tooth, for each training sample, all mirrored landmarks
+                            (in the coordinate frame of the horizontally flipped image, x -> -x)
+                            (default: no mirrored landmarks are used)
     @return The matrix GNS which contains for each tooth, for each of the given training samples,
             for each landmark, a normalized sample (along the profile normal through that landmark).
             The matrix GTS which contains for each tooth, for each of the given training samples,
             for each landmark, a normalized sample (along the profile tangent through that landmark).
+            If mirrored landmarks are given, the samples of the mirrored landmarks of the given
+            training samples follow the samples of the given training samples.
     '''
-    GNS = np.zeros((c.get_nb_teeth(), len(trainingSamples), c.get_nb_landmarks(), 2*k+1))
-    GTS = np.zeros((c.get_nb_teeth(), len(trainingSamples), c.get_nb_landmarks(), 2*k+1))
-    for j in range(c.get_nb_teeth()):
-        index = 0
-        for i in trainingSamples:
-            # model of tooth j from model coordinate frame to image coordinate frame
-            xs, ys = mu.extract_coordinates(mu.full_align_with(MS[j], XS[j,index,:]))
-            fname = c.get_fname_vis_pre(i, method)
-            img = cv2.imread(fname)
-            pyramid = gip.get_gaussian_pyramid_at(img, level)
-            GN, GT = create_G(pyramid, k, xs, ys, offsetX, offsetY)
-            GNS[j,index,:] = GN
-            GTS[j,index,:] = GT
-            index += 1
+    n = len(trainingSamples)
+    nb_samples = n if XS_mirrored is None else 2*n
+    GNS = np.zeros((c.get_nb_teeth(), nb_samples, XS.shape[2] / 2, 2*k+1))
+    GTS = np.zeros((c.get_nb_teeth(), nb_samples, XS.shape[2] / 2, 2*k+1))
+    # Each pyramid is read once (and the next pyramid is read ahead) and used for all teeth
+    # (through the process-wide image cache, so it is only computed once for all folds)
+    for index, (i, X, pyramid) in enumerate(ds.Dataset(trainingSamples, method=method, nb_prefetch=1, level=level)):
+        views = [(pyramid, XS, offsetX, index)]
+        if XS_mirrored is not None:
+            # The mirrored landmarks are sampled in a horizontally flipped view of the same pyramid (no copy):
+            # column x of the flipped view is column (width - 1 - x) of the pyramid
+            views.append((pyramid[:,::-1], XS_mirrored, -(offsetX + pyramid.shape[1] - 1), n + index))
+        for view, YS, offsetX_view, column in views:
+            for j in range(c.get_nb_teeth()):
+                # model of tooth j from model coordinate frame to image coordinate frame
+                xs, ys = mu.extract_coordinates(mu.full_align_with(MS[j], YS[j,index,:]))
+                GN, GT = create_G(view, k, xs, ys, offsetX_view, offsetY)
+                GNS[j,column,:] = GN
+                GTS[j,column,:] = GT
     return GNS, GTS
                  
 def create_G(img, k, xs, ys, offsetX=0, offsetY=0):
@@ -155,9 +208,9 @@ def create_G(img, k, xs, ys, offsetX=0, offsetY=0):
             The matrix GT, which contains for each landmark a normalized sample 
             (sampled along the profile tangent through the landmarks).
     '''
-    GN = np.zeros((c.get_nb_landmarks(), 2*k+1))
-    GT = np.zeros((c.get_nb_landmarks(), 2*k+1))
-    for i in range(c.get_nb_landmarks()):
+    GN = np.zeros((xs.shape[0], 2*k+1))
+    GT = np.zeros((xs.shape[0], 2*k+1))
+    for i in range(xs.shape[0]):
         x = xs[i] - offsetX
         y = ys[i] - offsetY
         tx, ty, nx, ny = create_ricos(img, i, xs, ys)
@@ -245,3 +298,38 @@ def create_Gi(img, k, x, y, dx, dy):
     
     # We explicitly do not want a normalized vector at this stage.
     return Gi
+    
+def create_Gis(imgs, shapes, bs, xs, ys, dxs, dys, k, dtype=np.float64):
+    '''
+    Samples along the profile lines characterized by (dxs[i], dys[i]) k pixels either side
+    of the given model points (xs[i], ys[i]) in the images bs[i] to create the normalized
+    vectors Gi (the vectorized counterpart of normalize_Gi(create_Gi(...))).
+    @param imgs:         the stacked images, shape = (nb images, max height, max width)
+    @param shapes:       the (height, width) of each image, shape = (nb images, 2)
+    @param bs:           for each sample, the index of the image to sample
+    @param xs:           for each sample, x position of the model point in the image
+    @param ys:           for each sample, y position of the model point in the image
+    @param dxs:          for each sample, profile line x-change in direction
+    @param dys:          for each sample, profile line y-change in direction
+    @param k:            the number of pixels to sample either side of the given model
+                         points along the profile lines
+    @param dtype:        the floating point type of the normalized vectors Gi
+    @return The normalized vectors Gi (shape = (nb samples, 2k+1)) and for each sample whether
+            it is valid (create_Gi raises an IndexError for the invalid samples).
+    '''
+    steps = np.arange(k, -(k+2), -1)
+    kxs = mu.round_away(xs[:,np.newaxis] + steps * dxs[:,np.newaxis])
+    kys = mu.round_away(ys[:,np.newaxis] + steps * dys[:,np.newaxis])
+    hs = shapes[bs,0][:,np.newaxis]
+    ws = shapes[bs,1][:,np.newaxis]
+    # Negative indices wrap around (like plain indexing does)
+    valid = ((kxs >= -ws) & (kxs < ws) & (kys >= -hs) & (kys < hs)).all(axis=1)
+    kxs = np.where(valid[:,np.newaxis], kxs % ws, 0).astype(int)
+    kys = np.where(valid[:,np.newaxis], kys % hs, 0).astype(int)
+    
+    Gis = imgs[bs[:,np.newaxis], kys, kxs].astype(dtype)
+    Gis = (Gis[:,1:] - Gis[:,:-1])
+    
+    norms = np.abs(Gis).sum(axis=1)
+    norms[norms==0] = 1
+    return Gis / norms[:,np.newaxis], valid
@@ -7,6 +7,7 @@ Used in the multi-resolution search algorithm.
 @version    1.0
 '''
 import cv2
+import numpy as np
 
 def get_gaussian_pyramids(img, level):
     pyramids = [img]
@@ -21,4 +22,33 @@ def get_gaussian_pyramid_at(img, level):
     for i in range(level):
         pyramid = cv2.pyrDown(pyramid)
     return pyramid
-        
\ No newline at end of file
+
+def get_stacked_gaussian_pyramids(imgs, level):
+    '''
+    Returns for each level (up to the given level) the first channel of the
+    gaussian pyramids of all given images, stacked in one zero padded array.
+    @param imgs:            the images
+    @param level:           the coarsest level
+    @return For each level, the stacked pyramids (shape = (nb images, max height, max width))
+            and the (height, width) of each pyramid (shape = (nb images, 2)).
+    '''
+    pyramids = [get_gaussian_pyramids(first_channel(img), level) for img in imgs]
+    stacks = []
+    for l in range(level+1):
+        shapes = np.array([pyramid[l].shape[:2] for pyramid in pyramids])
+        stack = np.zeros((len(imgs), shapes[:,0].max(), shapes[:,1].max()), dtype=pyramids[0][l].dtype)
+        for i in range(len(imgs)):
+            stack[i,:shapes[i,0],:shapes[i,1]] = pyramids[i][l]
+        stacks.append((stack, shapes))
+    return stacks
+    
+def first_channel(img):
+    '''
+    Returns the first channel of the given image (the channels of a
+    preprocessed grey scale image are identical).
+    @param img:             the image
+    @return The first channel of the given image.
+    '''
+    if img.ndim == 3:
+        return np.ascontiguousarray(img[:,:,0])
+    return img
@@ -0,0 +1,163 @@
+'''
+Process-wide cache of the decoded (preprocessed) images of the training samples and
+their gaussian pyramids, keyed by (number of the training sample, method, level).
+The cache keeps the images with a least recently used eviction under a byte budget.
+A level of a gaussian pyramid is computed from the (cached) previous level, so each
+image is decoded once and each level is computed once as long as they fit in the budget.
+The cached images are read-only: callers that draw on an image must copy it first.
+@author     Matthias Moulin & Milan Samyn
+@version    1.0
+'''
+
+import cv2
+import threading
+
+from collections import OrderedDict
+
+import configuration as c
+
+max_bytes = 256 * 2**20         # The default byte budget of the cached images
+
+class ImageCache(object):
+
+    def __init__(self, max_bytes=max_bytes):
+        '''
+        Creates a cache for images and their gaussian pyramids.
+        @param max_bytes:           the byte budget of the cached images
+        '''
+        self.max_bytes = max_bytes
+        self.images = OrderedDict()
+        self.nb_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        '''
+        Returns the image with the given key.
+        @param key:                 the key
+        @return The image with the given key (None if the image is not cached).
+        '''
+        with self.lock:
+            if key in self.images:
+                # Mark as most recently used
+                img = self.images.pop(key)
+                self.images[key] = img
+                self.hits += 1
+                return img
+            self.misses += 1
+            return None
+
+    def put(self, key, img):
+        '''
+        Caches the given image with the given key and evicts the least recently used
+        images until the byte budget is respected.
+        @param key:                 the key
+        @param img:                 the image
+        @return The cached (read-only) image.
+        '''
+        img.flags.writeable = False
+        with self.lock:
+            if key in self.images:
+                self.nb_bytes -= self.images.pop(key).nbytes
+            if img.nbytes > self.max_bytes:
+                return img
+            self.images[key] = img
+            self.nb_bytes += img.nbytes
+            while self.nb_bytes > self.max_bytes:
+                old_key, old_img = self.images.popitem(last=False)
+                self.nb_bytes -= old_img.nbytes
+                self.evictions += 1
+        return img
+
+    def clear(self):
+        '''
+        Removes all cached images (the counters are not reset).
+        '''
+        with self.lock:
+            self.images = OrderedDict()
+            self.nb_bytes = 0
+
+    def get_image(self, nr_trainingSample, method=''):
+        '''
+        Returns the (preprocessed) image of the given training sample.
+        @param nr_trainingSample:   the number of the training sample
+        @param method:              the method used for preprocessing
+        @return The (read-only) image of the given training sample.
+        '''
+        return self.get_pyramid(nr_trainingSample, method, 0)
+
+    def get_pyramid(self, nr_trainingSample, method='', level=0):
+        '''
+        Returns the given level of the gaussian pyramid of the (preprocessed) image of the given training sample
+        (see gaussian_image_piramid.get_gaussian_pyramid_at).
+        @param nr_trainingSample:   the number of the training sample
+        @param method:              the method used for preprocessing
+        @param level:               the level of the gaussian pyramid
+        @return The (read-only) given level of the gaussian pyramid of the image of the given training sample.
+        '''
+        key = (nr_trainingSample, method, level)
+        img = self.get(key)
+        if img is None:
+            if level == 0:
+                fname = c.get_fname_vis_pre(nr_trainingSample, method)
+                img = cv2.imread(fname)
+                if img is None:
+                    raise IOError('Image could not be read: ' + fname)
+            else:
+                img = cv2.pyrDown(self.get_pyramid(nr_trainingSample, method, level-1))
+            img = self.put(key, img)
+        return img
+
+_cache = ImageCache()           # The process-wide cache
+
+def get_cache():
+    '''
+    Returns the process-wide cache.
+    @return The process-wide cache.
+    '''
+    return _cache
+
+def get_image(nr_trainingSample, method=''):
+    '''
+    Returns the (preprocessed) image of the given training sample from the process-wide cache.
+    @param nr_trainingSample:   the number of the training sample
+    @param method:              the method used for preprocessing
+    @return The (read-only) image of the given training sample.
+    '''
+    return _cache.get_image(nr_trainingSample, method)
+
+def get_pyramid(nr_trainingSample, method='', level=0):
+    '''
+    Returns the given level of the gaussian pyramid of the (preprocessed) image of the given training sample
+    from the process-wide cache.
+    @param nr_trainingSample:   the number of the training sample
+    @param method:              the method used for preprocessing
+    @param level:               the level of the gaussian pyramid
+    @return The (read-only) given level of the gaussian pyramid of the image of the given training sample.
+    '''
+    return _cache.get_pyramid(nr_trainingSample, method, level)
+
+################################################################################
+# TESTS
+################################################################################
+def test(method='SCD'):
+    import numpy as np
+    import time
+    import gaussian_image_piramid as gip
+
+    cache = ImageCache(max_bytes=16 * 2**20)
+    for r in range(2):
+        start = time.time()
+        equal = True
+        for i in c.get_trainingSamples_range():
+            for level in range(3):
+                pyramid = cache.get_pyramid(i, method, level)
+                if r == 0:
+                    equal &= np.array_equal(pyramid, gip.get_gaussian_pyramid_at(cv2.imread(c.get_fname_vis_pre(i, method)), level))
+        print ('Pass ' + str(r) + ': ' + str(time.time() - start) + 's, Equal: ' + str(equal) + ', Hits: ' + str(cache.hits) +
+               ', Misses: ' + str(cache.misses) + ', Evictions: ' + str(cache.evictions) + ', Bytes: ' + str(cache.nb_bytes))
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,306 @@
+'''
+Incremental refitting of a fitted tooth after manual landmark corrections.
+A user drags a few landmarks of an existing fit to their correct position
+(see click.py for clicking landmarks). These landmarks are pinned: they keep their
+position, and only a few iterations at the finest level are applied to the other
+landmarks, with a shape constraint that honours the pinned landmarks.
+The finest level of the gaussian pyramid is computed once per refit session and
+the profile models created by fitting.preprocess are reused, so a refit takes only
+a few milliseconds.
+The refit session can be driven by OpenCV mouse events or, headless, by feeding
+synthetic mouse events to RefitSession.on_mouse.
+@author     Matthias Moulin & Milan Samyn
+@version    1.0
+'''
+
+import cv2
+import numpy as np
+
+import batch_fitting as bf
+import configuration as c
+import fitting as f
+import fitting_function as ff
+import fitting_utils as fu
+import gaussian_image_piramid as gip
+import math_utils as mu
+import principal_component_analysis as pca
+
+max_it = 5                      # Maximum number of iterations of a refit
+pin_weight = 100.0              # The weight of a pinned landmark relative to a searched landmark in the shape constraint
+
+def weighted_align_params(v, t, weights):
+    '''
+    Returns the transformation parameters (tx, ty, s, theta) for aligning v with t
+    (see math_utils.full_align_params), where each landmark is weighted with the given weight.
+    The translation (tx, ty) moves the weighted center of gravity of v (after scaling
+    and rotating about it) to the weighted center of gravity of t.
+    @pre    The coordinates are stored as successive xi, yi, xj, yj, ...
+    @param v:               the vector to align
+    @param t:               the vector to align with
+    @param weights:         the weight of each landmark
+    @return The transformation parameters (tx, ty, s, theta) and the weighted center of gravity of v.
+    '''
+    w = weights / float(np.sum(weights))
+    vxm, vym = np.dot(w, v[0::2]), np.dot(w, v[1::2])
+    txm, tym = np.dot(w, t[0::2]), np.dot(w, t[1::2])
+    vx, vy = v[0::2] - vxm, v[1::2] - vym
+    tx, ty = t[0::2] - txm, t[1::2] - tym
+    n = np.dot(w, vx*vx + vy*vy)
+    a = np.dot(w, vx*tx + vy*ty) / n
+    b = np.dot(w, vx*ty - vy*tx) / n
+    return txm, tym, np.sqrt(a*a + b*b), np.arctan2(b, a), (vxm, vym)
+
+def transform(v, tx, ty, s, theta, center):
+    '''
+    Scales and rotates the given vector v about the given center and moves that center to (tx, ty).
+    @pre    The coordinates are stored as successive xi, yi, xj, yj, ...
+    @param v:               the vector to transform
+    @param tx:              the x coordinate of the new center
+    @param ty:              the y coordinate of the new center
+    @param s:               the scaling parameter
+    @param theta:           the rotation parameter
+    @param center:          the center of scaling and rotation
+    @return The transformed vector.
+    '''
+    return mu.translate(mu.align(mu.translate(v, -center[0], -center[1]), s, theta), tx, ty)
+
+def constrain_pinned(P_before, MU, E, W, weights, nb_alternations=5):
+    '''
+    Limits the given points to the shapes allowed by the given shape model
+    (see fitting.constrain), where each landmark is weighted with the given weight
+    in the estimation of both the pose and the shape parameters. The pose and the
+    shape parameters are estimated alternately.
+    @param P_before:        the points before validation in the image coordinate frame
+    @param MU:              the mean shape (in the model coordinate frame)
+    @param E:               the sqrt(Eigenvalues) of the shape model
+    @param W:               the Eigenvectors of the shape model
+    @param weights:         the weight of each landmark
+    @param nb_alternations: the number of alternations between the pose and the shape parameters
+    @return The points after validation in the image coordinate frame.
+    '''
+    D = np.repeat(weights, 2)
+    WD = W.T * D
+    WDW = np.dot(WD, W)
+    bs = np.zeros(W.shape[1])
+    for a in range(nb_alternations):
+        X = pca.reconstruct(W, bs, MU)
+        # Weighted pose of the current model shape in the image
+        tx, ty, s, theta, center = weighted_align_params(X, P_before, weights)
+        # Weighted least squares estimate of the shape parameters in the model coordinate frame
+        PY_before = transform(P_before, center[0], center[1], 1.0 / s, -theta, (tx, ty))
+        bs = np.linalg.solve(WDW, np.dot(WD, (PY_before - MU)))
+        bs = np.maximum(np.minimum(bs, f.tolerable_deviation*E), -f.tolerable_deviation*E)
+
+    X = pca.reconstruct(W, bs, MU)
+    tx, ty, s, theta, center = weighted_align_params(X, P_before, weights)
+    return transform(X, tx, ty, s, theta, center)
+
+def search_simultaneously(stack, P, tooth_index, fitting_function=1):
+    '''
+    Searches along the profiles of all landmarks for the best new positions for the given
+    points at the finest level (one iteration of the fitting procedure without validation).
+    Unlike batch_fitting.search_batch (which moves the landmarks one after the other, like
+    fitting.search), all landmarks are searched simultaneously along the profiles through
+    their positions before the iteration, so the search is one vectorized step. This is
+    sufficient close to convergence.
+    @param stack:               the stacked image and its shape (at the finest level)
+    @param P:                   the current points for the target tooth
+    @param tooth_index:         the index of the target tooth (used in pns, pts)
+    @param fitting_function:    the fitting function used
+    @return The best new positions of the points.
+    '''
+    imgs, shapes = stack
+    k = f.k
+    if (fitting_function==0):
+        rn = rt = range(-(f.m-k), (f.m-k)+1)
+    elif (fitting_function==1):
+        rn = range(-(f.m-k), (f.m-k)+1)
+        rt = [0]
+    else:
+        rn = [0]
+        rt = range(-(f.m-k), (f.m-k)+1)
+    ns = np.repeat(rn, len(rt)).astype(float)
+    ts = np.tile(rt, len(rn)).astype(float)
+
+    pxs = P[0::2]
+    pys = P[1::2]
+    nb_landmarks = pxs.shape[0]
+    nc = ns.shape[0]
+    dxs = np.roll(pxs, -1) - np.roll(pxs, 1)
+    dys = np.roll(pys, -1) - np.roll(pys, 1)
+    sqs = np.sqrt(dxs*dxs + dys*dys)
+    # Profile Tangent to Boundary
+    txs = (dxs / sqs)
+    tys = (dys / sqs)
+    # Profile Normal to Boundary
+    nxs = - tys
+    nys = txs
+
+    xs = mu.round_away(pxs[:,np.newaxis] + ns * nxs[:,np.newaxis] + ts * txs[:,np.newaxis]).ravel()
+    ys = mu.round_away(pys[:,np.newaxis] + ns * nys[:,np.newaxis] + ts * tys[:,np.newaxis]).ravel()
+    cbs = np.zeros(xs.shape[0], dtype=int)
+    (G_MU_N, C_N), (G_MU_T, C_T) = f.pns, f.pts
+    GN, valid_n = ff.create_Gis(imgs, shapes, cbs, xs, ys, np.repeat(nxs, nc), np.repeat(nys, nc), k, C_N.dtype)
+    GT, valid_t = ff.create_Gis(imgs, shapes, cbs, xs, ys, np.repeat(txs, nc), np.repeat(tys, nc), k, C_T.dtype)
+    fn = ff.evaluate_profile_models(GN.reshape(nb_landmarks, nc, -1), G_MU_N[0,tooth_index], C_N[0,tooth_index])
+    ft = ff.evaluate_profile_models(GT.reshape(nb_landmarks, nc, -1), G_MU_T[0,tooth_index], C_T[0,tooth_index])
+    fs = fu.evaluate_fitting(fn=fn, ft=ft, fitting_function=fitting_function)
+    fs[~(valid_n & valid_t).reshape(nb_landmarks, nc)] = float("inf")
+
+    best = f.best_candidate(fs)
+    # Stay at the current position if no position along the profile can be evaluated
+    found = np.isfinite(fs[np.arange(nb_landmarks), best])
+    P_found = np.copy(P)
+    P_found[0::2][found] = xs.reshape(nb_landmarks, nc)[np.arange(nb_landmarks), best][found]
+    P_found[1::2][found] = ys.reshape(nb_landmarks, nc)[np.arange(nb_landmarks), best][found]
+    return P_found
+
+class RefitSession(object):
+
+    def __init__(self, img, P, tooth_index, fitting_function=1):
+        '''
+        Creates a refit session for the given fit.
+        @param img:                 the image
+        @param P:                   the fitted points for the target tooth
+        @param tooth_index:         the index of the the target tooth (used in MS, EWS, pns, pts)
+        @param fitting_function:    the fitting function used
+                                    * 0: fitting function along profile normal through landmark +
+                                         fitting function along profile gradient through landmark
+                                    * 1: fitting function along profile normal through landmark
+                                    * 2: fitting function along profile gradient through landmark
+        '''
+        self.stack = gip.get_stacked_gaussian_pyramids([img], 0)[0]
+        self.P = np.array(P, dtype=float)
+        self.tooth_index = tooth_index
+        self.fitting_function = fitting_function
+        self.pinned = np.zeros(c.get_nb_landmarks(), dtype=bool)
+        self.selected = None
+
+    def pin(self, index, x, y):
+        '''
+        Pins the landmark with the given index at the given position.
+        @param index:               the index of the landmark
+        @param x:                   the x coordinate of the position
+        @param y:                   the y coordinate of the position
+        '''
+        self.P[2*index] = x
+        self.P[2*index+1] = y
+        self.pinned[index] = True
+
+    def unpin(self, index):
+        '''
+        Unpins the landmark with the given index.
+        @param index:               the index of the landmark
+        '''
+        self.pinned[index] = False
+
+    def get_closest_landmark(self, x, y):
+        '''
+        Returns the index of the landmark closest to the given position.
+        @param x:                   the x coordinate of the position
+        @param y:                   the y coordinate of the position
+        @return The index of the landmark closest to the given position.
+        '''
+        return np.argmin((self.P[0::2] - x) ** 2 + (self.P[1::2] - y) ** 2)
+
+    def refit(self):
+        '''
+        Refits the landmarks that are not pinned at the finest level.
+        @return The refitted points for the target tooth and the number of iterations used.
+        '''
+        MU = f.MS[self.tooth_index]
+        E, W = f.EWS[self.tooth_index]
+        weights = np.where(self.pinned, pin_weight, 1.0)
+        dims = np.repeat(self.pinned, 2)
+        P_pinned = self.P[dims]
+
+        P = self.P
+        nb_it = 0
+        while (nb_it < max_it):
+            nb_it += 1
+            P_found = search_simultaneously(self.stack, P, self.tooth_index, self.fitting_function)
+            P_found[dims] = P_pinned
+            P_new = constrain_pinned(P_found, MU, E, W, weights)
+            P_new[dims] = P_pinned
+            nb_close_points = bf.nb_closest_points(P, P_new)
+            P = P_new
+
+            # Repeat unless more than pclose of the points are found close to the current position
+            if (2 * nb_close_points / float(P.shape[0]) >= f.pclose):
+                break
+
+        self.P = P
+        return np.copy(P), nb_it
+
+    def on_mouse(self, event, x, y, flags, param):
+        '''
+        Handles the given mouse event (see cv2.setMouseCallback).
+        Pressing the left button selects the landmark closest to the mouse position,
+        releasing the left button pins the selected landmark at the mouse position and
+        refits the other landmarks. Clicking the right button unpins the landmark closest
+        to the mouse position.
+        '''
+        if (event == cv2.EVENT_LBUTTONDOWN):
+            self.selected = self.get_closest_landmark(x, y)
+        elif (event == cv2.EVENT_LBUTTONUP and self.selected is not None):
+            self.pin(self.selected, float(x), float(y))
+            self.selected = None
+            self.refit()
+        elif (event == cv2.EVENT_RBUTTONDOWN):
+            self.unpin(self.get_closest_landmark(x, y))
+
+def correct_landmarks(img, P, tooth_index, fitting_function=1):
+    '''
+    Lets the user drag landmarks of the given fit to their correct position
+    and refits after each correction.
+    @param img:                 the image
+    @param P:                   the fitted points for the target tooth
+    @param tooth_index:         the index of the the target tooth (used in MS, EWS, pns, pts)
+    @param fitting_function:    the fitting function used
+    @return The corrected points for the target tooth.
+    '''
+    session = RefitSession(img, P, tooth_index, fitting_function)
+    img_name = 'Drag a landmark to correct it, click right to unpin, click esc to terminate'
+    cv2.namedWindow(img_name)
+    cv2.setMouseCallback(img_name, session.on_mouse)
+
+    while(1):
+        cv2.imshow(img_name, fu.mark_results(np.copy(img), np.array([session.P])))
+        k = cv2.waitKey(1) & 0xFF
+        if k == 27:
+            break
+    cv2.destroyAllWindows()
+    return session.P
+
+################################################################################
+# TESTS
+################################################################################
+def test():
+    import time
+    for i in c.get_trainingSamples_range():
+        trainingSamples = c.get_trainingSamples_range()
+        trainingSamples.remove(i)
+        f.preprocess(trainingSamples)
+
+        fname = c.get_fname_vis_pre(i, f.method)
+        img = cv2.imread(fname)
+
+        for j in range(c.get_nb_teeth()):
+            fname = c.get_fname_original_landmark(i, (j+1))
+            I = fu.original_to_cropped(np.fromfile(fname, dtype=float, count=-1, sep=' '))
+            R = f.multi_resolution_search(img, I, j)
+
+            # Synthetic clicks: drag the three worst landmarks to their true position
+            session = RefitSession(img, R, j)
+            distances = np.sqrt((R[0::2] - I[0::2]) ** 2 + (R[1::2] - I[1::2]) ** 2)
+            for index in np.argsort(distances)[::-1][:3]:
+                start = time.time()
+                session.on_mouse(cv2.EVENT_LBUTTONDOWN, int(round(session.P[2*index])), int(round(session.P[2*index+1])), 0, None)
+                session.on_mouse(cv2.EVENT_LBUTTONUP, int(I[2*index]), int(I[2*index+1]), 0, None)
+                print 'Refit: ' + str(time.time() - start) + 's'
+
+            fname = str(i) + '-' + str((j+1)) + 'r.png'
+            cv2.imwrite(fname, fu.mark_results(np.copy(img), np.array([R, session.P])))
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,140 @@
+'''
+Multi-Resolution Active Shape Models' fitting procedure with a joint shape model
+for each jaw. The landmarks of the teeth of one jaw are concatenated into one shape
+(the upper teeth 1-4 and the lower teeth 5-8), so the teeth of a jaw are fitted
+as one contour set and the correlation between neighbouring teeth is part of the
+shape constraint. The profiles along the contour of each tooth are searched with the
+profile models of that tooth (see batch_fitting.search_batch).
+The fitting procedure uses the models created by jaw_fitting.preprocess.
+@author     Matthias Moulin & Milan Samyn
+@version    1.0
+'''
+
+import numpy as np
+
+import batch_fitting as bf
+import configuration as c
+import fitting as f
+import fitting_utils as fu
+import gaussian_image_piramid as gip
+import loader as l
+import principal_component_analysis as pca
+import procrustes_analysis as pa
+
+JMS = None                      # JMS contains for each jaw, the jaw model (in the model coordinate frame)
+JEWS = []                       # JEWS contains for each jaw, a (sqrt(Eigenvalues), Eigenvectors) pair (in the model coordinate frame)
+nb_jaws = 2                     # The number of jaws (the upper jaw and the lower jaw)
+
+def get_teeth(jaw_index):
+    '''
+    Returns the indices of the teeth (used in MS, EWS, pns, pts) of the given jaw.
+    @param jaw_index:           the index of the jaw (0: upper jaw, 1: lower jaw)
+    @return The indices of the teeth of the given jaw.
+    '''
+    nb_teeth = c.get_nb_teeth() / nb_jaws
+    return range(jaw_index * nb_teeth, (jaw_index+1) * nb_teeth)
+
+def multi_resolution_search_jaw(img, PS, jaw_index, fitting_function=1):
+    '''
+    Fits the teeth of the jaw corresponding to the given jaw index in the given image.
+    @param img:                 the image
+    @param PS:                  for each tooth of the target jaw, the start points
+    @param jaw_index:           the index of the target jaw (used in JMS, JEWS)
+    @param fitting_function:    the fitting function used
+                                * 0: fitting function along profile normal through landmark +
+                                     fitting function along profile gradient through landmark
+                                * 1: fitting function along profile normal through landmark
+                                * 2: fitting function along profile gradient through landmark
+    @return The fitted points for each tooth of the target jaw (shape = (nb teeth, nb dimensions))
+            and the total number of iterations used.
+    '''
+    teeth = np.array(get_teeth(jaw_index))
+    MU = JMS[jaw_index]
+    E, W = JEWS[jaw_index]
+    level = f.max_level
+    stacks = gip.get_stacked_gaussian_pyramids([img], level)
+    bs = np.zeros(teeth.shape[0], dtype=int)
+
+    # Compute model point positions in image at coarsest level
+    P = np.around(np.divide(np.array(PS, dtype=float), 2**level)).ravel()
+    nb_it = 0
+    nb_its = 0
+
+    while (level >= 0):
+        nb_it += 1
+        nb_its += 1
+        # The contour of each tooth is searched with the profile models of that tooth
+        P_found = bf.search_batch(stacks[level], P.reshape(teeth.shape[0], -1), bs, teeth, level, fitting_function)
+        P_new = f.constrain(P_found.ravel(), MU, E, W)[0]
+        nb_close_points = bf.nb_closest_points(P, P_new)
+        P = P_new
+
+        # Repeat unless more than pclose of the points are found close to the current position
+        # or nmax iterations have been applied at this resolution
+        print 'Level:' + str(level) + ', Iteration: ' + str(nb_it) + ', Ratio: ' + str((2 * nb_close_points / float(P.shape[0])))
+
+        converged = (2 * nb_close_points / float(P.shape[0]) >= f.pclose)
+        if (converged or nb_it >= f.max_it):
+            if (level > 0):
+                level -= 1
+                nb_it = 0
+                P = P * 2
+            else:
+                break
+
+    return P.reshape(teeth.shape[0], -1), nb_its
+
+def preprocess(trainingSamples):
+    '''
+    Creates the (profile) models used by the fitting procedure (see fitting.preprocess)
+    and creates JMS and JEWS, used by the fitting procedure
+        * JMS contains for each jaw, the jaw model (in the model coordinate frame)
+        * JEWS contains for each jaw, a (sqrt(Eigenvalues), Eigenvectors) pair (in the model coordinate frame)
+    '''
+    global JMS, JEWS
+    f.preprocess(trainingSamples)
+
+    XS = l.create_partial_XS(trainingSamples)
+    nb_dim = len(get_teeth(0)) * c.get_nb_dim()
+    JMS = np.zeros((nb_jaws, nb_dim))
+    JEWS = []
+    for jaw_index in range(nb_jaws):
+        # Concatenate the landmarks of the teeth of the jaw for each training sample
+        S = np.swapaxes(XS[get_teeth(jaw_index),:,:], 0, 1).reshape(XS.shape[1], nb_dim)
+        M, Y = pa.PA(S)
+        JMS[jaw_index,:] = M
+        E, W, MU = pca.pca_percentage(Y)
+        JEWS.append((np.sqrt(E), W))
+
+################################################################################
+# TESTS
+################################################################################
+def test():
+    import cv2
+    import time
+    for i in c.get_trainingSamples_range():
+        trainingSamples = c.get_trainingSamples_range()
+        trainingSamples.remove(i)
+        preprocess(trainingSamples)
+
+        fname = c.get_fname_vis_pre(i, f.method)
+        img = cv2.imread(fname)
+
+        PS = np.zeros((c.get_nb_teeth(), c.get_nb_dim()))
+        RS = np.zeros((c.get_nb_teeth(), c.get_nb_dim()))
+        for j in range(c.get_nb_teeth()):
+            fname = c.get_fname_original_landmark(i, (j+1))
+            PS[j,:] = fu.original_to_cropped(np.fromfile(fname, dtype=float, count=-1, sep=' '))
+
+        start = time.time()
+        for jaw_index in range(nb_jaws):
+            teeth = get_teeth(jaw_index)
+            RS[teeth,:], nb_its = multi_resolution_search_jaw(img, PS[teeth,:], jaw_index)
+        print 'Fitting: ' + str(time.time() - start) + 's'
+
+        color_lines = np.array([np.array([0,0,255])] * c.get_nb_teeth() + [np.array([0,255,0])] * c.get_nb_teeth())
+        fname = str(i) + 'j.png'
+        cv2.imwrite(fname, fu.mark_results(np.copy(img), np.concatenate((PS, RS)), color_lines))
+
+if __name__ == "__main__":
+    test()
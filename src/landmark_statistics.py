@@ -0,0 +1,163 @@
+'''
+Statistics of the landmarks of all training samples: the bounding boxes of each
+tooth and each jaw, the average sizes of the teeth and the average pose
+(tx, ty, s, theta) of each tooth. All statistics are computed with a few NumPy
+reductions over the landmarks of all teeth of all training samples at once
+(see classification_utils for the loop based counterparts). The statistics of a
+subset of the training samples (e.g. the training samples of a fold) are selected
+with a mask instead of being recomputed.
+@author     Matthias Moulin & Milan Samyn
+@version    1.0
+'''
+
+import numpy as np
+
+import configuration as c
+import fitting_utils as fu
+import loader as l
+import math_utils as mu
+import procrustes_analysis as pa
+
+def get_landmarks():
+    '''
+    Returns the landmarks of all teeth of all training samples in the cropped images.
+    @return The landmarks (shape = (nb teeth, nb training samples, nb dimensions)).
+    '''
+    return l.create_full_XS() - np.tile([fu.offsetX, fu.offsetY], c.get_nb_landmarks())
+
+def get_mask(trainingSamples):
+    '''
+    Returns the mask that selects the given training samples.
+    @param trainingSamples:     the training samples
+    @return The mask that selects the given training samples (shape = (nb training samples,)).
+    '''
+    mask = np.zeros(c.get_nb_trainingSamples(), dtype=bool)
+    mask[np.array(trainingSamples)-1] = True
+    return mask
+
+def get_individual_bboxes(XS):
+    '''
+    Returns for each tooth, for each training sample, the bounding box (x_min, x_max, y_min, y_max)
+    of the tooth (see classification_utils.create_individual_bboxes).
+    @param XS:                  the landmarks (see get_landmarks)
+    @return The bounding boxes (shape = (nb teeth, nb training samples, 4)).
+    '''
+    IBS = np.zeros(XS.shape[:2] + (4,))
+    IBS[:,:,0] = XS[:,:,0::2].min(axis=2)
+    IBS[:,:,1] = XS[:,:,0::2].max(axis=2)
+    IBS[:,:,2] = XS[:,:,1::2].min(axis=2)
+    IBS[:,:,3] = XS[:,:,1::2].max(axis=2)
+    return IBS
+
+def get_jaw_bboxes(IBS):
+    '''
+    Returns for each training sample, the bounding boxes of the upper and the lower jaw
+    (x_min, x_max, y_min, y_max of the upper jaw, x_min, x_max, y_min, y_max of the lower jaw)
+    (see classification_utils.create_bboxes).
+    @param IBS:                 the bounding boxes of the teeth (see get_individual_bboxes)
+    @return The bounding boxes of the jaws (shape = (nb training samples, 8)).
+    '''
+    JBS = IBS.reshape((2, IBS.shape[0]/2) + IBS.shape[1:])
+    BS = np.zeros((IBS.shape[1], 2, 4))
+    BS[:,:,0] = JBS[:,:,:,0].min(axis=1).T
+    BS[:,:,1] = JBS[:,:,:,1].max(axis=1).T
+    BS[:,:,2] = JBS[:,:,:,2].min(axis=1).T
+    BS[:,:,3] = JBS[:,:,:,3].max(axis=1).T
+    return BS.reshape(IBS.shape[1], 8)
+
+def get_average_sizes(IBS, mask=None):
+    '''
+    Returns for each tooth, the average (width, height) of the selected training samples
+    (see classification_utils.get_average_size).
+    @param IBS:                 the bounding boxes of the teeth (see get_individual_bboxes)
+    @param mask:                the mask that selects the training samples (default: all training samples)
+    @return The average sizes (shape = (nb teeth, 2)).
+    '''
+    if mask is None:
+        mask = np.ones(IBS.shape[1], dtype=bool)
+    return np.dstack((IBS[:,mask,1] - IBS[:,mask,0], IBS[:,mask,3] - IBS[:,mask,2])).mean(axis=1)
+
+def get_poses(XS):
+    '''
+    Returns for each tooth, for each training sample, the pose (tx, ty, s, theta) of the tooth
+    with respect to the mean shape of that tooth over all training samples
+    (see math_utils.full_align_params).
+    @param XS:                  the landmarks (see get_landmarks)
+    @return The poses (shape = (nb teeth, nb training samples, 4)) and
+            the reference mean shapes (shape = (nb teeth, nb dimensions)).
+    '''
+    MS = np.zeros((XS.shape[0], XS.shape[2]))
+    for j in range(XS.shape[0]):
+        M, Y = pa.PA(XS[j,:,:])
+        MS[j,:] = mu.center_onOrigin(M)
+
+    txs = XS[:,:,0::2].mean(axis=2)
+    tys = XS[:,:,1::2].mean(axis=2)
+    # The centered landmarks and the centered reference mean shapes
+    xs = XS[:,:,0::2] - txs[:,:,np.newaxis]
+    ys = XS[:,:,1::2] - tys[:,:,np.newaxis]
+    mxs = MS[:,np.newaxis,0::2]
+    mys = MS[:,np.newaxis,1::2]
+    # See math_utils.align_params
+    n = (mxs ** 2 + mys ** 2).sum(axis=2)
+    a = (mxs * xs + mys * ys).sum(axis=2) / n
+    b = (mxs * ys - mys * xs).sum(axis=2) / n
+
+    poses = np.zeros(XS.shape[:2] + (4,))
+    poses[:,:,0] = txs
+    poses[:,:,1] = tys
+    poses[:,:,2] = np.sqrt(a*a + b*b)
+    poses[:,:,3] = np.arctan(b / a)
+    return poses, MS
+
+def get_average_params(poses, MS_ref, mask=None, MS=None):
+    '''
+    Returns for each tooth, the average pose (tx, ty, s, theta) of the selected training samples
+    (see classification_utils.get_average_params).
+    @param poses:               the poses (see get_poses)
+    @param MS_ref:              the reference mean shapes of the poses (see get_poses)
+    @param mask:                the mask that selects the training samples (default: all training samples)
+    @param MS:                  the mean shapes the average poses must refer to (e.g. fitting.MS of a fold)
+                                (default: the reference mean shapes)
+    @return The average poses (shape = (nb teeth, 4)).
+    '''
+    if mask is None:
+        mask = np.ones(poses.shape[1], dtype=bool)
+    Params = poses[:,mask,:].mean(axis=1)
+    if MS is not None:
+        # Compose with the similarity that aligns the given mean shapes with the reference mean shapes
+        for j in range(MS.shape[0]):
+            s, theta = mu.align_params(mu.center_onOrigin(MS[j,:]), MS_ref[j,:])
+            Params[j,2] *= s
+            Params[j,3] += theta
+    return Params
+
+################################################################################
+# TESTS
+################################################################################
+def test():
+    import time
+    import classification_utils as cu
+
+    start = time.time()
+    XS = get_landmarks()
+    IBS = get_individual_bboxes(XS)
+    BS = get_jaw_bboxes(IBS)
+    Avg = get_average_sizes(IBS)
+    poses, MS_ref = get_poses(XS)
+    print 'Statistics: ' + str(time.time() - start) + 's'
+
+    print 'Bounding boxes: ' + str(np.allclose(BS, cu.create_bboxes()))
+    print 'Average sizes: ' + str(np.allclose(Avg, cu.get_average_size()))
+    for i in c.get_trainingSamples_range():
+        trainingSamples = c.get_trainingSamples_range()
+        trainingSamples.remove(i)
+        MS = np.array([pa.PA(XS[j,get_mask(trainingSamples),:])[0] for j in range(c.get_nb_teeth())])
+        Params = get_average_params(poses, MS_ref, get_mask(trainingSamples), MS)
+        Params_cu = cu.get_average_params(trainingSamples)
+        # theta is close to 0, so it is compared with an absolute tolerance (in radians)
+        print ('Average params (largest relative difference of tx, ty, s): ' + str((np.abs(Params[:,:3] - Params_cu[:,:3]) / np.abs(Params_cu[:,:3])).max(axis=0)) +
+               ', (largest absolute difference of theta): ' + str(np.abs(Params[:,3] - Params_cu[:,3]).max()))
+
+if __name__ == "__main__":
+    test()
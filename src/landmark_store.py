@@ -0,0 +1,190 @@
+'''
+Binary store of the landmarks of all training samples.
+The original landmarks (training samples 1, ..., nb training samples) and the mirrored
+landmarks (training samples nb training samples + 1, ..., 2 * nb training samples) are
+compiled from the text files into one .npy array (shape = (2 * nb training samples, nb teeth,
+nb landmarks, 2)). A manifest records for each text file its modification time, size and
+hash. The store is rebuilt when a text file changed (and only then), and it is loaded
+once per process as a (read-only) memory map, so loading all landmarks reads no text files
+and copies no data.
+@author     Matthias Moulin & Milan Samyn
+@version    1.0
+'''
+
+import hashlib
+import json
+import numpy as np
+import os
+import tempfile
+
+import configuration as c
+
+version = 1                     # The version of the layout of the store (a store with another version is rebuilt)
+
+_store = None                   # The loaded store (memory map)
+
+def get_fnames():
+    '''
+    Returns the file names of the text files of all landmarks in the order of the store.
+    @return For each training sample (original, then mirrored), for each tooth, the file name of the text file.
+    '''
+    fnames = []
+    for i in range(1, 2 * c.get_nb_trainingSamples() + 1):
+        if i <= c.get_nb_trainingSamples():
+            dname = c.get_dir_original_landmarks()
+        else:
+            dname = c.get_dir_mirrored_landmarks()
+        fnames.append([dname + '/landmarks' + str(i) + '-' + str(j) + '.txt' for j in c.get_teeth_range()])
+    return fnames
+
+def get_hash(fname):
+    '''
+    Returns the hash of the content of the given file.
+    @param fname:               the file name
+    @return The hash of the content of the given file.
+    '''
+    with open(fname, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+def get_file_entry(fname):
+    '''
+    Returns the manifest entry of the given file.
+    @param fname:               the file name
+    @return The manifest entry (modification time, size and hash) of the given file.
+    '''
+    st = os.stat(fname)
+    return {'mtime' : st.st_mtime, 'size' : st.st_size, 'sha1' : get_hash(fname)}
+
+def is_up_to_date(manifest):
+    '''
+    Checks whether the store described by the given manifest is up to date.
+    The hash of a text file is only recomputed if its modification time or size changed.
+    If the content of such a file did not change (e.g. after a checkout, a copy or a touch),
+    the manifest is rewritten with its new modification time and size, so the file is not
+    hashed again by later processes.
+    @param manifest:            the manifest
+    @return True if and only if no text file changed since the store was built.
+    '''
+    fnames = [fname for fnames in get_fnames() for fname in fnames]
+    if (manifest.get('version') != version or
+        manifest.get('shape') != [2 * c.get_nb_trainingSamples(), c.get_nb_teeth(), c.get_nb_landmarks(), 2] or
+        sorted(manifest.get('files', {}).keys()) != sorted(fnames)):
+        return False
+    refreshed = False
+    for fname in fnames:
+        entry = manifest['files'][fname]
+        st = os.stat(fname)
+        if (st.st_mtime != entry['mtime'] or st.st_size != entry['size']):
+            if get_hash(fname) != entry['sha1']:
+                return False
+            entry['mtime'] = st.st_mtime
+            entry['size'] = st.st_size
+            refreshed = True
+    if refreshed:
+        write_manifest(manifest)
+    return True
+
+def write_manifest(manifest):
+    '''
+    Writes the given manifest (atomically).
+    @param manifest:            the manifest
+    '''
+    write_atomically(c.get_fname_landmark_manifest(), lambda f: json.dump(manifest, f, indent=1, sort_keys=True))
+
+def write_atomically(fname, write):
+    '''
+    Writes the given file by writing a temporary file first, so no partially written file is ever read.
+    @param fname:               the file name
+    @param write:               the function writing the content to a given (opened) file
+    '''
+    fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(fname))
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file:
+            write(tmp_file)
+        os.rename(tmp_name, fname)
+    except:
+        os.remove(tmp_name)
+        raise
+
+def build():
+    '''
+    Compiles the text files of all landmarks into the store and writes its manifest.
+    '''
+    fnames = get_fnames()
+    S = np.zeros((len(fnames), c.get_nb_teeth(), c.get_nb_landmarks(), 2))
+    manifest = {'version' : version, 'shape' : list(S.shape), 'files' : {}}
+    for i in range(len(fnames)):
+        for j in range(len(fnames[i])):
+            manifest['files'][fnames[i][j]] = get_file_entry(fnames[i][j])
+            S[i,j,:,:] = np.fromfile(fnames[i][j], dtype=float, count=-1, sep=' ').reshape(-1, 2)
+    write_atomically(c.get_fname_landmark_store(), lambda f: np.save(f, S))
+    # The manifest is written last, so it never describes an older store
+    write_manifest(manifest)
+
+def load(rebuild=False):
+    '''
+    Returns the store of all landmarks. The store is (re)built if necessary and only loaded once.
+    @param rebuild:             must the store be rebuilt
+    @return The (read-only) memory map of the store (shape = (2 * nb training samples, nb teeth, nb landmarks, 2)).
+    '''
+    global _store
+    if (_store is None or rebuild):
+        try:
+            with open(c.get_fname_landmark_manifest(), 'r') as f:
+                manifest = json.load(f)
+        except (IOError, ValueError):
+            manifest = {}
+        if (rebuild or not os.path.isfile(c.get_fname_landmark_store()) or not is_up_to_date(manifest)):
+            build()
+        _store = np.load(c.get_fname_landmark_store(), mmap_mode='r')
+    return _store
+
+def get_landmarks(mirrored=False):
+    '''
+    Returns the landmarks of all training samples without copying them.
+    @param mirrored:            must the mirrored landmarks be returned instead of the original landmarks
+    @return The (read-only) landmarks (shape = (nb training samples, nb teeth, nb landmarks, 2)).
+    '''
+    n = c.get_nb_trainingSamples()
+    if mirrored:
+        return load()[n:2*n]
+    return load()[0:n]
+
+################################################################################
+# TESTS
+################################################################################
+def test():
+    import time
+    import loader as l
+
+    start = time.time()
+    load(rebuild=True)
+    print 'Build: ' + str(time.time() - start) + 's'
+
+    global _store
+    _store = None
+    start = time.time()
+    S = get_landmarks()
+    print 'Load: ' + str(time.time() - start) + 's'
+
+    start = time.time()
+    XS = l.create_full_XS()
+    print 'create_full_XS: ' + str(time.time() - start) + 's'
+
+    print 'Memory map: ' + str(isinstance(S.base, np.memmap) or isinstance(S, np.memmap))
+    print 'Original: ' + str(np.array_equal(S[0,0,:,:].ravel(), np.fromfile(c.get_fname_original_landmark(1, 1), dtype=float, count=-1, sep=' ')))
+    print 'Mirrored: ' + str(np.array_equal(get_landmarks(mirrored=True)[13,7,:,:].ravel(),
+                                             np.fromfile(c.get_dir_mirrored_landmarks() + '/landmarks28-8.txt', dtype=float, count=-1, sep=' ')))
+    print 'Loader: ' + str(np.array_equal(XS, S.reshape(S.shape[0], S.shape[1], -1).transpose(1, 0, 2)))
+
+    # A touched (unchanged) text file is hashed once and recorded with its new modification time
+    fname = c.get_fname_original_landmark(1, 1)
+    os.utime(fname, None)
+    with open(c.get_fname_landmark_manifest(), 'r') as f:
+        manifest = json.load(f)
+    print 'Touched: ' + str(is_up_to_date(manifest))
+    with open(c.get_fname_landmark_manifest(), 'r') as f:
+        print 'Manifest refreshed: ' + str(json.load(f)['files'][fname]['mtime'] == os.stat(fname).st_mtime)
+
+if __name__ == '__main__':
+    test()
@@ -1,31 +1,36 @@
 '''
 Loader for training samples
+The landmarks are read from the binary landmark store (see landmark_store).
 @author     Matthias Moulin & Milan Samyn
 @version    1.0
 '''
 
 import numpy as np
 import configuration as c
+import landmark_store as ls
 
-def create_full_XS():
+def create_full_XS(mirrored=False):
     '''
     Creates an array that contains all the training samples
     corresponding to all the teeth.
+    @param mirrored:             must the mirrored landmarks be used
     @return np.array, shape=(nb of teeth, nb of training samples, nb of dimensions)
     '''
-    return create_partial_XS(c.get_trainingSamples_range())
+    return create_partial_XS(c.get_trainingSamples_range(), mirrored)
     
-def create_partial_XS(trainingSamples):
+def create_partial_XS(trainingSamples, mirrored=False):
     '''
     Creates an array that contains all the training samples
     corresponding to the given training samples and corresponding to all the teeth.
+    The mirrored landmarks of a training sample are the landmarks of the horizontally
+    flipped radiograph (x -> -x) of that training sample. Tooth j of the mirrored landmarks
+    is at the position of tooth j in the flipped radiograph (see get_mirrored_tooth_index).
     @param trainingSamples:      the training samples
+    @param mirrored:             must the mirrored landmarks be used
     @return np.array, shape=(nb of teeth, nb of training samples, nb of dimensions)
     '''
-    XS = np.zeros(np.array([c.get_nb_teeth(), len(trainingSamples), c.get_nb_dim()]))
-    for j in range(c.get_nb_teeth()):
-        XS[j,:,:] = create_partial_X(trainingSamples, nr_tooth=(j+1))
-    return XS
+    S = ls.get_landmarks(mirrored)[np.array(trainingSamples, dtype=int)-1]
+    return S.reshape(len(trainingSamples), c.get_nb_teeth(), c.get_nb_dim()).transpose(1, 0, 2).copy()
 
 def create_full_X(nr_tooth=1):
     '''
@@ -44,11 +49,16 @@ def create_partial_X(trainingSamples, nr_tooth=1):
     @param nrTooth:              the number of the tooth
     @return np.array, shape=(nb of training samples, nb of dimensions)
     '''
-    X = np.zeros((len(trainingSamples), c.get_nb_dim()))
-    index = 0
-    for i in trainingSamples:
-        fname = c.get_fname_original_landmark(i, nr_tooth)
-        print("loaded: " + fname)
-        X[index,:] = np.fromfile(fname, dtype=float, count=-1, sep=' ')
-        index += 1
-    return X
\ No newline at end of file
+    S = ls.get_landmarks()[np.array(trainingSamples, dtype=int)-1, nr_tooth-1]
+    return S.reshape(len(trainingSamples), c.get_nb_dim()).copy()
+
+def get_mirrored_tooth_index(tooth_index):
+    '''
+    Returns the index of the tooth of which the mirrored tooth with the given index is the mirror image.
+    Flipping a radiograph horizontally reverses the order of the teeth within each jaw.
+    @param tooth_index:          the index of the mirrored tooth
+    @return The index of the (original) tooth of which the mirrored tooth with the given index is the mirror image.
+    '''
+    nb_teeth = c.get_nb_teeth() / 2
+    jaw = tooth_index / nb_teeth
+    return jaw * nb_teeth + (nb_teeth - 1 - tooth_index % nb_teeth)
@@ -202,3 +202,13 @@ def align(v, s=1, theta=0):
         r[(2*i)] = sc*x-ss*y
         r[(2*i+1)] = ss*x+sc*y
     return r
+    
+def round_away(v):
+    '''
+    Rounds the given values to the nearest integers, rounding halfway cases
+    away from zero (like the built-in round does for a single value).
+    @param v:           the values to round
+    @return The rounded values.
+    '''
+    v = np.asarray(v, dtype=float)
+    return np.where(v >= 0, np.floor(v + 0.5), np.ceil(v - 0.5))
@@ -0,0 +1,130 @@
+'''
+Multi-Resolution Active Shape Models' fitting procedure for all teeth of one
+radiograph (optionally on a pool of threads).
+The teeth are independent searches which only share the (read-only) gaussian
+pyramid of the radiograph and the models created by fitting.preprocess, so the
+pyramid is computed once and shared without copying it. By default, all teeth
+are fitted in one call of the vectorized batch fitting procedure. The batch
+fitting procedure visits the landmarks one after the other in Python (each
+landmark is searched from the moved positions of its neighbours) on arrays of a
+few dozen elements, so it holds the GIL for most of its time: splitting the
+teeth over threads only adds overhead (see test_threads).
+@author     Matthias Moulin & Milan Samyn
+@version    1.0
+'''
+
+import numpy as np
+
+from multiprocessing.pool import ThreadPool
+
+import batch_fitting as bf
+import configuration as c
+import fitting as f
+import fitting_utils as fu
+import gaussian_image_piramid as gip
+
+def multi_resolution_search_teeth(img, PS, tooth_indices=None, fitting_function=1, nb_threads=1):
+    '''
+    Fits the teeth corresponding to the given tooth indices in the given image.
+    The result does not depend on the number of threads: for each tooth, it is
+    the same as the result of fitting.multi_resolution_search for that tooth.
+    @param img:                 the image
+    @param PS:                  for each target tooth, the start points
+    @param tooth_indices:       for each target tooth, the index of the target tooth (used in MS, EWS, pns, pts)
+                                (default: all teeth)
+    @param fitting_function:    the fitting function used
+                                * 0: fitting function along profile normal through landmark +
+                                     fitting function along profile gradient through landmark
+                                * 1: fitting function along profile normal through landmark
+                                * 2: fitting function along profile gradient through landmark
+    @param nb_threads:          the number of threads (default: 1, all teeth are fitted in one batch)
+    @return The fitted points for each target tooth (shape = (nb target teeth, nb dimensions))
+            and for each target tooth, the total number of iterations used.
+    '''
+    if tooth_indices is None:
+        tooth_indices = range(c.get_nb_teeth())
+    PS = np.array(PS, dtype=float)
+    tooth_indices = np.array(tooth_indices, dtype=int)
+    nb_threads = max(1, min(nb_threads, tooth_indices.shape[0]))
+
+    # The pyramid is computed once and shared (read-only) by all threads
+    stacks = gip.get_stacked_gaussian_pyramids([img], f.max_level)
+
+    # Each thread gets a fixed subset of the teeth, so the work does not depend on the scheduling
+    chunks = [range(t, tooth_indices.shape[0], nb_threads) for t in range(nb_threads)]
+
+    def fit_chunk(chunk):
+        return bf.multi_resolution_search_stacked(stacks, np.zeros(len(chunk), dtype=int), PS[chunk,:], tooth_indices[chunk], fitting_function)
+
+    if nb_threads == 1:
+        results = [fit_chunk(chunks[0])]
+    else:
+        pool = ThreadPool(nb_threads)
+        try:
+            results = pool.map(fit_chunk, chunks)
+        finally:
+            pool.close()
+            pool.join()
+
+    RS = np.zeros(PS.shape)
+    nb_its = np.zeros(tooth_indices.shape[0], dtype=int)
+    for chunk, (R, nb_it) in zip(chunks, results):
+        RS[chunk,:] = R
+        nb_its[chunk] = nb_it
+    return RS, nb_its
+
+################################################################################
+# TESTS
+################################################################################
+def test():
+    import cv2
+    import time
+    for i in c.get_trainingSamples_range():
+        trainingSamples = c.get_trainingSamples_range()
+        trainingSamples.remove(i)
+        f.preprocess(trainingSamples)
+
+        fname = c.get_fname_vis_pre(i, f.method)
+        img = cv2.imread(fname)
+
+        PS = np.zeros((c.get_nb_teeth(), c.get_nb_dim()))
+        for j in range(c.get_nb_teeth()):
+            fname = c.get_fname_original_landmark(i, (j+1))
+            PS[j,:] = fu.original_to_cropped(np.fromfile(fname, dtype=float, count=-1, sep=' '))
+
+        start = time.time()
+        RS, nb_its = multi_resolution_search_teeth(img, PS)
+        print 'Fitting: ' + str(time.time() - start) + 's, Iterations: ' + str(nb_its)
+
+        color_lines = np.array([np.array([0,0,255])] * c.get_nb_teeth() + [np.array([0,255,0])] * c.get_nb_teeth())
+        fname = str(i) + 't.png'
+        cv2.imwrite(fname, fu.mark_results(np.copy(img), np.concatenate((PS, RS)), color_lines))
+
+def test_threads(i=1, nb_repeats=5):
+    '''
+    Measures the fitting time of all teeth of the given training sample for 1, 2, 4 and 8 threads.
+    @param i:                   the number of the test sample
+    @param nb_repeats:          the number of measured runs (the median is printed)
+    '''
+    import time
+    import image_cache as ic
+    trainingSamples = c.get_trainingSamples_range()
+    trainingSamples.remove(i)
+    f.preprocess(trainingSamples)
+    img = ic.get_image(i, f.method)
+    PS = np.zeros((c.get_nb_teeth(), c.get_nb_dim()))
+    for j in range(c.get_nb_teeth()):
+        fname = c.get_fname_original_landmark(i, (j+1))
+        PS[j,:] = fu.original_to_cropped(np.fromfile(fname, dtype=float, count=-1, sep=' '))
+
+    RS = multi_resolution_search_teeth(img, PS)[0]
+    for nb_threads in [1, 2, 4, 8]:
+        times = []
+        for r in range(nb_repeats):
+            start = time.time()
+            R = multi_resolution_search_teeth(img, PS, nb_threads=nb_threads)[0]
+            times.append(time.time() - start)
+        print 'Threads: ' + str(nb_threads) + ', Fitting: ' + str(np.median(times)) + 's, Identical: ' + str(np.array_equal(R, RS))
+
+if __name__ == "__main__":
+    test()
@@ -246,6 +246,27 @@ def sigmoid(image, alpha, beta):
     
 #Preproccess
     
+def preproccess_image(image, ymin, ymax, xmin, xmax):
+    '''
+    Preproccesses the given radiograph.
+    @param image:               the radiograph
+    @param ymin:                the minimal y coordinate of the region of interest
+    @param ymax:                the maximal y coordinate of the region of interest
+    @param xmin:                the minimal x coordinate of the region of interest
+    @param xmax:                the maximal x coordinate of the region of interest
+    @return For each method, the preproccessed image.
+    '''
+    # crop -> convert to grey scale
+    grey_image = cv2.cvtColor(crop_by_diagonal(image, ymin, ymax, xmin, xmax), cv2.COLOR_BGR2GRAY)
+    grey_image_denoised = cv2.fastNlMeansDenoising(grey_image)
+    return {'O' : grey_image,
+            'D' : grey_image_denoised,
+            'EH' : cv2.equalizeHist(grey_image),
+            'EHD' : cv2.equalizeHist(grey_image_denoised),
+            # stretch_contrast stretches the given image in place
+            'SC' : stretch_contrast(np.copy(grey_image)),
+            'SCD' : stretch_contrast(np.copy(grey_image_denoised))}
+
 def preproccess():
     '''
     Preproccess all the radiographs.
@@ -259,15 +280,10 @@ def preproccess():
     print(" * xmax: " + str(xmax)) #xmax: 1773.0
     
     for i in c.get_trainingSamples_range():
-        # read -> crop -> convert to grey scale
-        grey_image = cv2.cvtColor(crop_by_diagonal(cv2.imread(c.get_fname_radiograph(i)), ymin, ymax, xmin, xmax), cv2.COLOR_BGR2GRAY)
-        grey_image_denoised = cv2.fastNlMeansDenoising(grey_image)
-        cv2.imwrite(c.get_fname_vis_pre(i, method='O'), grey_image)
-        cv2.imwrite(c.get_fname_vis_pre(i, method='D'), grey_image_denoised)
-        cv2.imwrite(c.get_fname_vis_pre(i, method='EH'), cv2.equalizeHist(grey_image))
-        cv2.imwrite(c.get_fname_vis_pre(i, method='EHD'), cv2.equalizeHist(grey_image_denoised))
-        cv2.imwrite(c.get_fname_vis_pre(i, method='SC'), stretch_contrast(grey_image))
-        cv2.imwrite(c.get_fname_vis_pre(i, method='SCD'), stretch_contrast(grey_image_denoised))
+        # read -> crop -> convert to grey scale -> reduce noise / enhance contrast
+        images = preproccess_image(cv2.imread(c.get_fname_radiograph(i)), ymin, ymax, xmin, xmax)
+        for method in ['O', 'D', 'EH', 'EHD', 'SC', 'SCD']:
+            cv2.imwrite(c.get_fname_vis_pre(i, method=method), images[method])
         #cv2.imwrite(c.get_fname_vis_pre(i, method='S'), apply_sigmoid(grey_image))
         #cv2.imwrite(c.get_fname_vis_pre(i, method='SD'), apply_sigmoid(grey_image_denoised))
         
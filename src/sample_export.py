@@ -0,0 +1,162 @@
+'''
+Export of the samples used for training the cascade classifiers of the upper and
+lower jaw (see classification_utils.create_negatives and classification_utils.classify_positives).
+The jaw boxes of all training samples are computed once (see landmark_statistics).
+The negative samples (the image parts above the lower jaw and below the upper jaw)
+of all training samples are written by a pool of threads. For each left out
+training sample, the info files with the positive samples (the jaw boxes of the
+remaining training samples) are written incrementally: each line is appended to
+the info files of all folds containing its training sample as soon as it is known.
+@author     Matthias Moulin & Milan Samyn
+@version    1.0
+'''
+
+import cv2
+import multiprocessing
+import os
+
+from multiprocessing.pool import ThreadPool
+
+import configuration as c
+import image_cache as ic
+import landmark_statistics as ls
+
+directions = ['u', 'l']         # The direction of each jaw (used in the file names of the samples)
+
+def get_fname_negative(nr_trainingSample, direction, method='', directory=None):
+    '''
+    Returns the file name of the negative sample of the given training sample for the given jaw.
+    @param nr_trainingSample:   the number of the training sample
+    @param direction:           the direction of the jaw ('u' or 'l')
+    @param method:              the method used for preprocessing
+    @param directory:           the directory of the samples (default: configuration.get_dir_vis_class_samples())
+    @return The file name of the negative sample of the given training sample for the given jaw.
+    '''
+    if directory is None:
+        directory = c.get_dir_vis_class_samples()
+    return os.path.join(directory, method + '%02d' % nr_trainingSample + '-' + direction + '.png')
+
+def get_fname_info(nr_trainingSample, direction, method='', directory=None):
+    '''
+    Returns the file name of the info file of the positive samples of the given jaw
+    for the fold leaving out the given training sample.
+    @param nr_trainingSample:   the number of the left out training sample
+    @param direction:           the direction of the jaw ('u' or 'l')
+    @param method:              the method used for preprocessing
+    @param directory:           the directory of the samples (default: configuration.get_dir_vis_class_samples())
+    @return The file name of the info file.
+    '''
+    if directory is None:
+        directory = c.get_dir_vis_class_samples()
+    return os.path.join(directory, 'info' + method + str(nr_trainingSample) + '-' + direction + '.txt')
+
+def get_info_line(nr_trainingSample, box, method=''):
+    '''
+    Returns the line of the info file describing the given jaw box of the given training sample.
+    @param nr_trainingSample:   the number of the training sample
+    @param box:                 the jaw box (x_min, x_max, y_min, y_max)
+    @param method:              the method used for preprocessing
+    @return The line of the info file describing the given jaw box of the given training sample.
+    '''
+    x_min, x_max, y_min, y_max = box
+    return ('rawdata/' + method + '%02d' % nr_trainingSample + '.png 1 ' + str(int(x_min)) + ' ' + str(int(y_min)) +
+            ' ' + str(int(x_max - x_min)) + ' ' + str(int(y_max - y_min)) + '\n')
+
+def write_negatives(nr_trainingSample, BS, method='', directory=None):
+    '''
+    Writes the negative samples of the given training sample: the image part below the
+    upper jaw (the 'l' file) and the image part above the lower jaw (the 'u' file).
+    @param nr_trainingSample:   the number of the training sample
+    @param BS:                  the jaw boxes of all training samples (see landmark_statistics.get_jaw_bboxes)
+    @param method:              the method used for preprocessing
+    @param directory:           the directory of the samples (default: configuration.get_dir_vis_class_samples())
+    '''
+    img = ic.get_image(nr_trainingSample, method)
+    box = BS[nr_trainingSample-1,:]
+    cv2.imwrite(get_fname_negative(nr_trainingSample, 'l', method, directory), img[int(box[3])+1:,:])
+    cv2.imwrite(get_fname_negative(nr_trainingSample, 'u', method, directory), img[:int(box[6]),:])
+
+def export_negatives(method='', directory=None, nb_threads=None):
+    '''
+    Writes the negative samples of all training samples on a pool of threads.
+    @param method:              the method used for preprocessing
+    @param directory:           the directory of the samples (default: configuration.get_dir_vis_class_samples())
+    @param nb_threads:          the number of threads (default: the number of CPUs)
+    '''
+    if nb_threads is None:
+        nb_threads = multiprocessing.cpu_count()
+    BS = ls.get_jaw_bboxes(ls.get_individual_bboxes(ls.get_landmarks()))
+
+    pool = ThreadPool(max(1, nb_threads))
+    try:
+        pool.map(lambda i: write_negatives(i, BS, method, directory), c.get_trainingSamples_range())
+    finally:
+        pool.close()
+        pool.join()
+
+def export_positives(method='', directory=None):
+    '''
+    Writes for each left out training sample, the info files of the positive samples of both jaws.
+    @param method:              the method used for preprocessing
+    @param directory:           the directory of the samples (default: configuration.get_dir_vis_class_samples())
+    '''
+    BS = ls.get_jaw_bboxes(ls.get_individual_bboxes(ls.get_landmarks()))
+    trainingSamples = c.get_trainingSamples_range()
+
+    files = {}
+    try:
+        for s in trainingSamples:
+            for direction in directions:
+                files[(s, direction)] = open(get_fname_info(s, direction, method, directory), 'w')
+        for i in trainingSamples:
+            for d, direction in enumerate(directions):
+                line = get_info_line(i, BS[i-1,4*d:4*(d+1)], method)
+                for s in trainingSamples:
+                    if s != i: files[(s, direction)].write(line)
+    finally:
+        for info_file in files.values():
+            info_file.close()
+
+def export(method='', directory=None, nb_threads=None):
+    '''
+    Writes the negative samples of all training samples and the info files of the positive samples of all folds.
+    @param method:              the method used for preprocessing
+    @param directory:           the directory of the samples (default: configuration.get_dir_vis_class_samples())
+    @param nb_threads:          the number of threads (default: the number of CPUs)
+    '''
+    export_negatives(method, directory, nb_threads)
+    export_positives(method, directory)
+
+################################################################################
+# TESTS
+################################################################################
+def test(method='SCD'):
+    import filecmp
+    import shutil
+    import tempfile
+    import time
+
+    directory = tempfile.mkdtemp()
+    try:
+        start = time.time()
+        export(method, directory)
+        print 'Export: ' + str(time.time() - start) + 's'
+
+        fnames = sorted(os.listdir(directory))
+        nb_identical = 0
+        for fname in fnames:
+            fname_new = os.path.join(directory, fname)
+            fname_old = os.path.join(c.get_dir_vis_class_samples(), fname)
+            if fname.endswith('.png'):
+                # The encoded images depend on the version of OpenCV, so the decoded images are compared
+                img_new = cv2.imread(fname_new)
+                img_old = cv2.imread(fname_old)
+                nb_identical += (img_old is not None and img_new.shape == img_old.shape and (img_new == img_old).all())
+            else:
+                nb_identical += filecmp.cmp(fname_new, fname_old, shallow=False)
+        print 'Identical samples: ' + str(nb_identical) + '/' + str(len(fnames))
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    test()
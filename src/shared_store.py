@@ -0,0 +1,236 @@
+'''
+Store of arrays shared by processes.
+The arrays are published once as .npy files in a named directory in shared memory
+(/dev/shm if available, otherwise the temporary directory) and attached by name as
+(read-only) memory maps, so all processes share the same physical pages and attaching
+to a store copies and sends nothing but its name. This is used to share the models
+created by fitting.preprocess and the gaussian pyramids of the images with a pool of
+worker processes (see multi_resolution_search_pool): each task only sends the indices
+of its image and tooth and its start points.
+@author     Matthias Moulin & Milan Samyn
+@version    1.0
+'''
+
+import multiprocessing
+import numpy as np
+import os
+import shutil
+import tempfile
+import uuid
+
+import batch_fitting as bf
+import configuration as c
+import fitting as f
+import gaussian_image_piramid as gip
+
+directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+                                # The directory of the stores
+
+_stacks = None                  # The gaussian pyramids attached by a worker process
+
+class SharedStore(object):
+
+    def __init__(self, name=None):
+        '''
+        Creates a new store (if no name is given) or attaches to the store with the given name.
+        @param name:                the name of the store (default: a new store with a unique name is created)
+        '''
+        self.owner = name is None
+        self.name = 'asm-' + uuid.uuid4().hex if name is None else name
+        self.path = os.path.join(directory, self.name)
+        if self.owner:
+            os.makedirs(self.path)
+        elif not os.path.isdir(self.path):
+            raise IOError('Shared store does not exist: ' + self.name)
+        self.arrays = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def get_fname(self, key):
+        '''
+        Returns the file name of the array with the given key.
+        @param key:                 the key
+        @return The file name of the array with the given key.
+        '''
+        return os.path.join(self.path, key + '.npy')
+
+    def publish(self, key, A):
+        '''
+        Publishes the given array with the given key.
+        @param key:                 the key
+        @param A:                   the array
+        @return The published array (read-only memory map).
+        '''
+        # Write to a temporary file first, so no partially written array is ever attached
+        fd, tmp_name = tempfile.mkstemp(suffix='.npy', dir=self.path)
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                np.save(tmp_file, np.ascontiguousarray(A))
+            os.rename(tmp_name, self.get_fname(key))
+        except:
+            os.remove(tmp_name)
+            raise
+        self.arrays.pop(key, None)
+        return self.attach(key)
+
+    def attach(self, key):
+        '''
+        Returns the array with the given key.
+        @param key:                 the key
+        @return The array with the given key (read-only memory map).
+        '''
+        if key not in self.arrays:
+            self.arrays[key] = np.load(self.get_fname(key), mmap_mode='r')
+        return self.arrays[key]
+
+    def close(self):
+        '''
+        Detaches from this store and removes this store if it was created (and not attached to).
+        '''
+        self.arrays = {}
+        if (self.owner and os.path.isdir(self.path)):
+            shutil.rmtree(self.path)
+
+def publish_models(store):
+    '''
+    Publishes the models created by fitting.preprocess in the given store.
+    @param store:               the store
+    '''
+    store.publish('MS', f.MS)
+    for j in range(len(f.EWS)):
+        store.publish('E' + str(j), f.EWS[j][0])
+        store.publish('W' + str(j), f.EWS[j][1])
+    for name, (G_MU, C) in [('pns', f.pns), ('pts', f.pts)]:
+        store.publish(name + '-G_MU', G_MU)
+        store.publish(name + '-C', C)
+
+def attach_models(store):
+    '''
+    Sets the models used by the (batch) fitting procedure to the models in the given store.
+    @param store:               the store
+    '''
+    f.MS = store.attach('MS')
+    f.EWS = [(store.attach('E' + str(j)), store.attach('W' + str(j))) for j in range(c.get_nb_teeth())]
+    f.pns = (store.attach('pns-G_MU'), store.attach('pns-C'))
+    f.pts = (store.attach('pts-G_MU'), store.attach('pts-C'))
+
+def publish_pyramids(store, imgs, prefix='', max_level=None):
+    '''
+    Publishes the gaussian pyramids of the given images in the given store.
+    @param store:               the store
+    @param imgs:                the images
+    @param prefix:              the prefix of the keys of the pyramids
+    @param max_level:           the coarsest level of the pyramids (default: fitting.max_level)
+    '''
+    if max_level is None:
+        max_level = f.max_level
+    for level, (stack, shapes) in enumerate(gip.get_stacked_gaussian_pyramids(imgs, max_level)):
+        store.publish(prefix + 'stack' + str(level), stack)
+        store.publish(prefix + 'shapes' + str(level), shapes)
+
+def attach_pyramids(store, prefix='', max_level=None):
+    '''
+    Returns the gaussian pyramids in the given store.
+    @param store:               the store
+    @param prefix:              the prefix of the keys of the pyramids
+    @param max_level:           the coarsest level of the pyramids (default: fitting.max_level)
+    @return For each level, the stacked pyramids and the (height, width) of each pyramid
+            (see gaussian_image_piramid.get_stacked_gaussian_pyramids).
+    '''
+    if max_level is None:
+        max_level = f.max_level
+    return [(store.attach(prefix + 'stack' + str(level)), store.attach(prefix + 'shapes' + str(level))) for level in range(max_level+1)]
+
+def init_worker(name):
+    '''
+    Attaches a worker process to the store with the given name.
+    @param name:                the name of the store
+    '''
+    global _stacks
+    store = SharedStore(name)
+    attach_models(store)
+    _stacks = attach_pyramids(store)
+
+def fit(task):
+    '''
+    Fits the given teeth in a worker process (see init_worker).
+    @param task:                the indices of the images, the start points and the indices of the target teeth
+                                and the fitting function used
+    @return The fitted points and the total number of iterations used for each target tooth.
+    '''
+    image_indices, PS, tooth_indices, fitting_function = task
+    return bf.multi_resolution_search_stacked(_stacks, image_indices, PS, tooth_indices, fitting_function)
+
+def multi_resolution_search_pool(imgs, image_indices, PS, tooth_indices, fitting_function=1, nb_processes=None):
+    '''
+    Fits the teeth corresponding to the given tooth indices in the given images on a pool of processes.
+    The models created by fitting.preprocess and the gaussian pyramids of the images are published once
+    in a shared store and each process attaches to them by name.
+    For each target tooth, the result is the same as the result of the batch fitting procedure
+    (up to rounding: the attached arrays are not necessarily aligned like the original arrays).
+    @param imgs:                the images
+    @param image_indices:       for each target tooth, the index of its image
+    @param PS:                  for each target tooth, the start points
+    @param tooth_indices:       for each target tooth, the index of the target tooth (used in MS, EWS, pns, pts)
+    @param fitting_function:    the fitting function used
+    @param nb_processes:        the number of processes (default: the number of CPUs)
+    @return The fitted points for each target tooth (shape = (nb target teeth, nb dimensions))
+            and for each target tooth, the total number of iterations used.
+    '''
+    if nb_processes is None:
+        nb_processes = multiprocessing.cpu_count()
+    image_indices = np.array(image_indices, dtype=int)
+    PS = np.array(PS, dtype=float)
+    tooth_indices = np.array(tooth_indices, dtype=int)
+    nb_processes = max(1, min(nb_processes, tooth_indices.shape[0]))
+    chunks = [range(t, tooth_indices.shape[0], nb_processes) for t in range(nb_processes)]
+
+    with SharedStore() as store:
+        publish_models(store)
+        publish_pyramids(store, imgs)
+        pool = multiprocessing.Pool(nb_processes, initializer=init_worker, initargs=(store.name,))
+        try:
+            results = pool.map(fit, [(image_indices[chunk], PS[chunk,:], tooth_indices[chunk], fitting_function) for chunk in chunks])
+        finally:
+            pool.close()
+            pool.join()
+
+    RS = np.zeros(PS.shape)
+    nb_its = np.zeros(tooth_indices.shape[0], dtype=int)
+    for chunk, (R, nb_it) in zip(chunks, results):
+        RS[chunk,:] = R
+        nb_its[chunk] = nb_it
+    return RS, nb_its
+
+################################################################################
+# TESTS
+################################################################################
+def test():
+    import cv2
+    import time
+    import fitting_utils as fu
+
+    trainingSamples = c.get_trainingSamples_range()
+    trainingSamples.remove(1)
+    f.preprocess(trainingSamples)
+
+    imgs = [cv2.imread(c.get_fname_vis_pre(i, f.method)) for i in [1, 2]]
+    image_indices = np.repeat([0, 1], c.get_nb_teeth())
+    tooth_indices = np.tile(range(c.get_nb_teeth()), 2)
+    PS = np.array([fu.original_to_cropped(np.fromfile(c.get_fname_original_landmark(i, j+1), dtype=float, count=-1, sep=' '))
+                   for i in [1, 2] for j in range(c.get_nb_teeth())])
+
+    start = time.time()
+    R_batch, nb_its_batch = bf.multi_resolution_search_stacked(gip.get_stacked_gaussian_pyramids(imgs, f.max_level), image_indices, PS, tooth_indices)
+    print 'Batch: ' + str(time.time() - start) + 's'
+    start = time.time()
+    R_pool, nb_its_pool = multi_resolution_search_pool(imgs, image_indices, PS, tooth_indices, nb_processes=2)
+    print 'Pool: ' + str(time.time() - start) + 's'
+    print 'Equal: ' + str(np.allclose(R_batch, R_pool) and np.array_equal(nb_its_batch, nb_its_pool))
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,182 @@
+'''
+Multi-Resolution Active Shape Models' fitting procedure with a landmark density
+per level. At the coarse levels, the contour is smaller, so only a subsampled set
+of the landmarks is searched and constrained with shape and profile models built
+for that subsampled set. Only the finest level uses all landmarks.
+The fitting procedure uses the models created by subsampled_fitting.preprocess.
+@author     Matthias Moulin & Milan Samyn
+@version    1.0
+'''
+
+import numpy as np
+
+import batch_fitting as bf
+import configuration as c
+import fitting as f
+import fitting_function as ff
+import fitting_utils as fu
+import gaussian_image_piramid as gip
+import loader as l
+import math_utils as mu
+import principal_component_analysis as pca
+import procrustes_analysis as pa
+
+strides = [1, 2, 4]             # The step between two successive landmarks that are used at each level
+LMS = None                      # LMS contains for each level, for each tooth, the model of the subsampled tooth (in the model coordinate frame)
+LEWS = None                     # LEWS contains for each level, for each tooth, a (sqrt(Eigenvalues), Eigenvectors) pair of the subsampled tooth
+lmodels = None                  # lmodels contains for each level, the profile models of the subsampled teeth (see batch_fitting.search_batch)
+
+def get_stride(level):
+    '''
+    Returns the step between two successive landmarks that are used at the given level.
+    @param level:               the level
+    @return The step between two successive landmarks that are used at the given level.
+    '''
+    return strides[min(level, len(strides)-1)]
+
+def get_dimensions(level):
+    '''
+    Returns the dimensions (xi, yi, xj, yj, ...) of the landmarks that are used at the given level.
+    @param level:               the level
+    @return The dimensions of the landmarks that are used at the given level.
+    '''
+    landmarks = np.arange(0, c.get_nb_landmarks(), get_stride(level))
+    return np.dstack((2*landmarks, 2*landmarks+1)).ravel()
+
+def upsample(P, tooth_index, level):
+    '''
+    Returns all landmarks of the given subsampled points. The landmarks in between the
+    subsampled landmarks are found by fitting the (full) shape model of the target tooth
+    to the subsampled points.
+    @pre    The coordinates are stored as successive xi, yi, xj, yj, ...
+    @param P:                   the subsampled points in the image coordinate frame
+    @param tooth_index:         the index of the target tooth (used in MS, EWS)
+    @param level:               the level of the subsampled points
+    @return All landmarks of the given subsampled points in the image coordinate frame.
+    '''
+    dims = get_dimensions(level)
+    MU = f.MS[tooth_index]
+    E, W = f.EWS[tooth_index]
+
+    xm, ym = mu.get_center_of_gravity(P)
+    tx, ty, s, theta = mu.full_align_params(P, MU[dims])
+    PY = mu.full_align(P, tx, ty, s, theta)
+
+    # Least squares estimate of the shape parameters from the subsampled landmarks only
+    bs = np.linalg.lstsq(W[dims,:], (PY - MU[dims]))[0]
+    bs = np.maximum(np.minimum(bs, f.tolerable_deviation*E), -f.tolerable_deviation*E)
+
+    R = mu.full_align(pca.reconstruct(W, bs, MU), 0, 0, 1.0 / s, -theta)
+    # Center the subsampled landmarks (instead of all landmarks) on the subsampled points
+    rxm, rym = mu.get_center_of_gravity(R[dims])
+    R = mu.translate(R, (xm - rxm), (ym - rym))
+    # Only the landmarks in between the subsampled landmarks are taken from the shape model
+    R[dims] = P
+    return R
+
+def multi_resolution_search_subsampled(img, P, tooth_index, fitting_function=1):
+    '''
+    Fits the tooth corresponding to the given tooth index in the given image
+    using the landmark density of each level.
+    @param img:                 the image
+    @param P:                   the start points for the target tooth
+    @param tooth_index:         the index of the the target tooth (used in LMS, LEWS, lmodels)
+    @param fitting_function:    the fitting function used
+                                * 0: fitting function along profile normal through landmark +
+                                     fitting function along profile gradient through landmark
+                                * 1: fitting function along profile normal through landmark
+                                * 2: fitting function along profile gradient through landmark
+    @return The fitted points for the tooth corresponding to the given tooth index
+            and the number of iterations used at each level.
+    '''
+    level = f.max_level
+    stacks = gip.get_stacked_gaussian_pyramids([img], level)
+    bs = np.zeros(1, dtype=int)
+    tooth_indices = np.array([tooth_index])
+    nb_its = np.zeros(level+1, dtype=int)
+
+    # Compute model point positions in image at coarsest level
+    P = np.around(np.divide(P, 2**level))[get_dimensions(level)]
+
+    while (level >= 0):
+        nb_its[level] += 1
+        MU = LMS[level][tooth_index]
+        E, W = LEWS[level][tooth_index]
+
+        # The profile models of each level are stored as a single level
+        P_found = bf.search_batch(stacks[level], P[np.newaxis,:], bs, tooth_indices, 0, fitting_function, models=lmodels[level])
+        P_new = f.constrain(P_found[0,:], MU, E, W)[0]
+        nb_close_points = bf.nb_closest_points(P, P_new)
+        P = P_new
+
+        # Repeat unless more than pclose of the points are found close to the current position
+        # or nmax iterations have been applied at this resolution
+        converged = (2 * nb_close_points / float(P.shape[0]) >= f.pclose)
+        if (converged or nb_its[level] >= f.max_it):
+            if (level > 0):
+                P = upsample(P, tooth_index, level) * 2
+                level -= 1
+                P = P[get_dimensions(level)]
+            else:
+                break
+
+    return P, nb_its
+
+def preprocess(trainingSamples):
+    '''
+    Creates the models used by the fitting procedure at the finest level (see fitting.preprocess)
+    and creates LMS, LEWS and lmodels, used by the fitting procedure (the finest level refers to
+    the models created by fitting.preprocess)
+        * LMS contains for each level, for each tooth, the model of the subsampled tooth (in the model coordinate frame)
+        * LEWS contains for each level, for each tooth, a (sqrt(Eigenvalues), Eigenvectors) pair of the subsampled tooth
+        * lmodels contains for each level, the profile models of the subsampled teeth
+    '''
+    global LMS, LEWS, lmodels
+    f.preprocess(trainingSamples)
+
+    XS = l.create_partial_XS(trainingSamples)
+    LMS = [f.MS]
+    LEWS = [f.EWS]
+    lmodels = [((f.pns[0][0:1], f.pns[1][0:1]), (f.pts[0][0:1], f.pts[1][0:1]))]
+    for level in range(1, f.max_level+1):
+        dims = get_dimensions(level)
+        SXS = XS[:,:,dims]
+        SMS = np.zeros((c.get_nb_teeth(), dims.shape[0]))
+        SEWS = []
+        for j in range(c.get_nb_teeth()):
+            M, Y = pa.PA(SXS[j,:,:])
+            SMS[j,:] = M
+            E, W, MU = pca.pca_percentage(Y)
+            SEWS.append((np.sqrt(E), W))
+        LMS.append(SMS)
+        LEWS.append(SEWS)
+
+        GNS, GTS = ff.create_partial_GS(trainingSamples, np.around(np.divide(SXS, 2**level)), SMS, level, offsetX=round(fu.offsetX/2**level), offsetY=round(fu.offsetY/2**level), k=f.k, method=f.method)
+        # The profile models are stored as a single level
+        lmodels.append((ff.create_profile_models_for_multiple_levels(GNS[np.newaxis,:]), ff.create_profile_models_for_multiple_levels(GTS[np.newaxis,:])))
+
+################################################################################
+# TESTS
+################################################################################
+def test():
+    import cv2
+    import time
+    for i in c.get_trainingSamples_range():
+        trainingSamples = c.get_trainingSamples_range()
+        trainingSamples.remove(i)
+        preprocess(trainingSamples)
+
+        fname = c.get_fname_vis_pre(i, f.method)
+        img = cv2.imread(fname)
+
+        for j in range(c.get_nb_teeth()):
+            fname = c.get_fname_original_landmark(i, (j+1))
+            P = fu.original_to_cropped(np.fromfile(fname, dtype=float, count=-1, sep=' '))
+            start = time.time()
+            R, nb_its = multi_resolution_search_subsampled(img, P, j)
+            print 'Fitting: ' + str(time.time() - start) + 's, Iterations: ' + str(nb_its)
+            fname = str(i) + '-' + str((j+1)) + 's.png'
+            cv2.imwrite(fname, fu.mark_results(np.copy(img), np.array([P, R])))
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,236 @@
+'''
+Hyperparameter sweep of the Multi-Resolution Active Shape Models' fitting procedure
+(k, m, max_level, tolerable_deviation, pclose and the preprocessing method) with
+leave-one-out cross validation over all training samples.
+The work that does not depend on the hyperparameters is done once:
+    * the shape models (PA, PCA) of each fold are created once;
+    * the training profiles of each fold are sampled once per method and level at the
+      largest k used at that level. The profiles for a smaller k are the central part of
+      these profiles (renormalized), so the profile models of each (method, k, level) are
+      created once per process;
+    * the gaussian pyramids of the test images are computed once per method.
+These arrays are published in a shared store (see shared_store) and the configurations
+are evaluated on a pool of processes. The models of all folds are stacked (the tooth
+index fold * nb teeth + tooth refers to a tooth of a fold), so all folds of a configuration
+are fitted in one batch (see batch_fitting).
+@author     Matthias Moulin & Milan Samyn
+@version    1.0
+'''
+
+import itertools
+import multiprocessing
+import numpy as np
+import time
+
+import batch_fitting as bf
+import configuration as c
+import fitting as f
+import fitting_function as ff
+import fitting_utils as fu
+import image_cache as ic
+import landmark_statistics as ls
+import loader as l
+import math_utils as mu
+import principal_component_analysis as pca
+import procrustes_analysis as pa
+import shared_store as ss
+
+parameters = ['method', 'k', 'm', 'max_level', 'tolerable_deviation', 'pclose']
+                                # The hyperparameters of a configuration
+init_offset = (8, -8)           # The offset of the initial positions of the teeth from their true position
+
+_store = None                   # The shared store attached by a worker process
+_models = {}                    # The profile models (of all folds) created by a worker process (by (method, k, level))
+
+def get_grid(methods=('SCD',), ks=(4,), ms=(8,), max_levels=(2,), tolerable_deviations=(3,), pcloses=(0.9,)):
+    '''
+    Returns all configurations of the given hyperparameters (with m >= k).
+    @param methods:             the methods used for preprocessing
+    @param ks:                  the numbers of pixels sampled either side of the model points for the profile models
+    @param ms:                  the numbers of pixels sampled either side of the model points while iterating
+    @param max_levels:          the coarsest levels of the gaussian pyramids
+    @param tolerable_deviations: the numbers of deviations that are tolerable by the shape models
+    @param pcloses:             the proportions of points that must be found close to their current position
+    @return The configurations (dictionaries of the hyperparameters).
+    '''
+    return [dict(zip(parameters, values)) for values in itertools.product(methods, ks, ms, max_levels, tolerable_deviations, pcloses) if values[2] >= values[1]]
+
+def crop_profiles(GS, k):
+    '''
+    Returns the given normalized profiles restricted to k pixels either side of the model points.
+    (the same as sampling the profiles with k, see fitting_function.create_G).
+    @param GS:                  the normalized profiles (shape = (..., 2K+1) with K >= k)
+    @param k:                   the number of pixels sampled either side of the model points
+    @return The normalized profiles (shape = (..., 2k+1)).
+    '''
+    K = (GS.shape[-1] - 1) / 2
+    GS = GS[...,(K-k):(K+k+1)]
+    norms = np.abs(GS).sum(axis=-1)
+    norms[norms==0] = 1
+    return GS / norms[...,np.newaxis]
+
+def publish(store, configurations):
+    '''
+    Creates the shape models and samples the training profiles of each fold, computes the gaussian
+    pyramids of the test images and the initial positions of the teeth, and publishes them in the given store.
+    @param store:               the store
+    @param configurations:      the configurations
+    '''
+    trainingSamples = c.get_trainingSamples_range()
+    nb_teeth = c.get_nb_teeth()
+    max_level = max([configuration['max_level'] for configuration in configurations])
+    # The coarser levels are only sampled with the values of k used at these levels
+    ks = [max([configuration['k'] for configuration in configurations if configuration['max_level'] >= level]) for level in range(max_level+1)]
+    methods = sorted(set([configuration['method'] for configuration in configurations]))
+
+    XS = ls.get_landmarks()
+    poses, MS_ref = ls.get_poses(XS)
+    MS = np.zeros((len(trainingSamples) * nb_teeth, c.get_nb_dim()))
+    PS = np.zeros((len(trainingSamples) * nb_teeth, c.get_nb_dim()))
+    XS_folds = []
+    for i in trainingSamples:
+        fold = list(trainingSamples)
+        fold.remove(i)
+        XS_fold = l.create_partial_XS(fold)
+        XS_folds.append((fold, XS_fold))
+        for j in range(nb_teeth):
+            t = (i-1) * nb_teeth + j
+            M, Y = pa.PA(XS_fold[j,:,:])
+            MS[t,:] = M
+            E, W, MU = pca.pca_percentage(Y)
+            store.publish('E' + str(t), np.sqrt(E))
+            store.publish('W' + str(t), W)
+        # The initial positions: the mean shapes with the average pose of the fold, near the true position
+        Params = ls.get_average_params(poses, MS_ref, ls.get_mask(fold), MS[(i-1)*nb_teeth:i*nb_teeth,:])
+        for j in range(nb_teeth):
+            tx, ty = mu.get_center_of_gravity(XS[j,i-1,:])
+            PS[(i-1)*nb_teeth+j,:] = mu.full_align(MS[(i-1)*nb_teeth+j,:], tx + init_offset[0], ty + init_offset[1], Params[j,2], Params[j,3])
+    store.publish('MS', MS)
+    store.publish('PS', PS)
+    store.publish('XS', XS.transpose(1, 0, 2).reshape(-1, c.get_nb_dim()))
+
+    for method in methods:
+        for level in range(max_level+1):
+            GNS = np.zeros((len(trainingSamples) * nb_teeth, len(trainingSamples) - 1, c.get_nb_landmarks(), 2*ks[level]+1))
+            GTS = np.zeros(GNS.shape)
+            for i, (fold, XS_fold) in zip(trainingSamples, XS_folds):
+                teeth = slice((i-1) * nb_teeth, i * nb_teeth)
+                GNS[teeth], GTS[teeth] = ff.create_partial_GS(fold, np.around(np.divide(XS_fold, 2**level)), MS[teeth,:], level,
+                                                              offsetX=round(float(fu.offsetX)/2**level), offsetY=round(float(fu.offsetY)/2**level),
+                                                              k=ks[level], method=method)
+            store.publish(method + '-GNS' + str(level), GNS)
+            store.publish(method + '-GTS' + str(level), GTS)
+        ss.publish_pyramids(store, [ic.get_image(i, method) for i in trainingSamples], method + '-', max_level)
+
+def attach(name):
+    '''
+    Attaches a worker process to the store with the given name.
+    @param name:                the name of the store
+    '''
+    global _store, _models
+    _store = ss.SharedStore(name)
+    _models = {}
+
+def get_models(method, k, max_level):
+    '''
+    Returns the profile models of all folds for the given method, k and levels
+    (the profile models of each level are created once per process).
+    @param method:              the method used for preprocessing
+    @param k:                   the number of pixels sampled either side of the model points
+    @param max_level:           the coarsest level
+    @return The profile models for the profile normal and the profile tangent
+            (see fitting_function.create_profile_models_for_multiple_levels).
+    '''
+    for level in range(max_level+1):
+        if (method, k, level) not in _models:
+            _models[(method, k, level)] = [ff.create_profile_models_for_multiple_levels(crop_profiles(_store.attach(method + '-' + name + str(level)), k)[np.newaxis], f.dtype)
+                                           for name in ['GNS', 'GTS']]
+    return tuple([tuple([np.concatenate([_models[(method, k, level)][p][q] for level in range(max_level+1)]) for q in range(2)]) for p in range(2)])
+
+def evaluate(configuration, fitting_function=1):
+    '''
+    Evaluates the given configuration with leave-one-out cross validation (in a worker process, see attach).
+    @param configuration:       the configuration
+    @param fitting_function:    the fitting function used
+    @return The given configuration, the mean distance between the fitted and the true landmarks,
+            the fitting time (of all folds) and the mean number of iterations.
+    '''
+    MS = _store.attach('MS')
+    pns, pts = get_models(configuration['method'], configuration['k'], configuration['max_level'])
+    stacks = ss.attach_pyramids(_store, configuration['method'] + '-', configuration['max_level'])
+
+    settings = [(name, getattr(f, name)) for name in parameters[1:] + ['MS', 'EWS', 'pns', 'pts']]
+    try:
+        for name in parameters[1:]:
+            setattr(f, name, configuration[name])
+        f.MS = MS
+        f.EWS = [(_store.attach('E' + str(t)), _store.attach('W' + str(t))) for t in range(MS.shape[0])]
+        f.pns = pns
+        f.pts = pts
+
+        image_indices = np.arange(MS.shape[0]) / c.get_nb_teeth()
+        start = time.time()
+        RS, nb_its = bf.multi_resolution_search_stacked(stacks, image_indices, _store.attach('PS'), np.arange(MS.shape[0]), fitting_function)
+        duration = time.time() - start
+    finally:
+        for name, value in settings:
+            setattr(f, name, value)
+
+    XS = _store.attach('XS')
+    error = np.sqrt((RS[:,0::2] - XS[:,0::2]) ** 2 + (RS[:,1::2] - XS[:,1::2]) ** 2).mean()
+    return configuration, error, duration, nb_its.mean()
+
+def run(configurations, nb_processes=None):
+    '''
+    Evaluates the given configurations with leave-one-out cross validation on a pool of processes.
+    @param configurations:      the configurations (see get_grid)
+    @param nb_processes:        the number of processes (default: the number of CPUs)
+    @return For each configuration, the configuration, the mean distance between the fitted and the true landmarks,
+            the fitting time (of all folds) and the mean number of iterations (sorted by mean distance).
+    '''
+    if nb_processes is None:
+        nb_processes = multiprocessing.cpu_count()
+    # Consecutive configurations share their profile models
+    configurations = sorted(configurations, key=lambda configuration: (configuration['method'], configuration['k'], configuration['max_level']))
+
+    with ss.SharedStore() as store:
+        publish(store, configurations)
+        if nb_processes == 1:
+            attach(store.name)
+            results = map(evaluate, configurations)
+        else:
+            pool = multiprocessing.Pool(nb_processes, initializer=attach, initargs=(store.name,))
+            try:
+                chunksize = int(np.ceil(len(configurations) / float(nb_processes)))
+                results = pool.map(evaluate, configurations, chunksize)
+            finally:
+                pool.close()
+                pool.join()
+    return sorted(results, key=lambda result: result[1])
+
+def print_table(results):
+    '''
+    Prints the given results of a sweep as a table.
+    @param results:             the results (see run)
+    '''
+    print ''.join([name.rjust(20) for name in parameters + ['error', 'time', 'iterations']])
+    for configuration, error, duration, nb_it in results:
+        values = [configuration[name] for name in parameters] + ['%.3f' % error, '%.3f' % duration, '%.2f' % nb_it]
+        print ''.join([str(value).rjust(20) for value in values])
+
+################################################################################
+# TESTS
+################################################################################
+def test():
+    start = time.time()
+    results = run([dict(zip(parameters, [f.method, f.k, f.m, f.max_level, f.tolerable_deviation, f.pclose]))])
+    print 'Sweep of 1 configuration: ' + str(time.time() - start) + 's'
+
+    start = time.time()
+    results = run(get_grid(methods=['SCD'], ks=[2, 3, 4], ms=[4, 6, 8, 12], max_levels=[1, 2], tolerable_deviations=[2, 3], pcloses=[0.8, 0.9]))
+    duration = time.time() - start
+    print_table(results)
+    print 'Sweep of ' + str(len(results)) + ' configurations: ' + str(duration) + 's'
+
+if __name__ == "__main__":
+    test()
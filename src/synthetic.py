@@ -0,0 +1,268 @@
+'''
+Generator of synthetic datasets (radiographs and landmarks) for scaling tests.
+The tooth shapes are sampled from the shape models (PA, PCA) of the real landmarks
+(within the tolerable deviation) and placed with poses sampled from the joint distribution
+(mean and covariance) of the poses of all teeth of the real training samples, so the
+teeth of a synthetic sample are arranged like the teeth of a real jaw. Each radiograph is
+rendered as a dark, smoothly varying background with bright teeth (with a darker pulp),
+blurred to obtain edge profiles and with added noise. The written landmarks are noisy annotations
+(rounded to pixels) of the rendered teeth.
+A dataset is written in the layout configuration expects (radiographs, original and mirrored
+landmarks and preprocessed images) in its own directory (configuration.get_dir_synthetic)
+and used by pointing configuration to that directory (see use_dataset), so all modules
+run unchanged on the synthetic training samples. Each sample is generated from its own
+seed, so a dataset only depends on its seed and not on the number of processes.
+@author     Matthias Moulin & Milan Samyn
+@version    1.0
+'''
+
+import cv2
+import json
+import multiprocessing
+import numpy as np
+import os
+
+import configuration as c
+import fitting_utils as fu
+import image_cache as ic
+import landmark_statistics as ls
+import landmark_store as lst
+import loader as l
+import math_utils as mu
+import preprocessor as pre
+import principal_component_analysis as pca
+import procrustes_analysis as pa
+
+version = 1                     # The version of the generator (recorded in the manifest of a dataset)
+radiograph_shape = (1597, 3023) # The (height, width) of the radiographs (as the real radiographs)
+crop_shape = (866, 540)         # The (height, width) of the preprocessed images (as the real preprocessed images)
+tolerable_deviation = 3         # The number of deviations of the sampled shape parameters (see fitting.constrain)
+background = 70.0               # The mean grey level of the background
+background_deviation = 15.0     # The deviation of the grey level of the background
+tooth_range = (170.0, 210.0)    # The range of the grey levels of the teeth
+pulp_scale = 0.35               # The size of the pulp relative to its tooth
+pulp_contrast = 40.0            # The difference between the grey levels of a tooth and its pulp
+blur = 1.5                      # The standard deviation of the gaussian blur of the edges
+noise = 6.0                     # The standard deviation of the noise
+annotation_noise = 1.0          # The standard deviation of the noise of the written landmarks (the annotations)
+
+_original = None                # The (directory prefix, nb training samples) of the configuration before use_dataset
+
+def get_dir(name):
+    '''
+    Returns the directory of the synthetic dataset with the given name.
+    @param name:                the name of the dataset
+    @return The directory of the synthetic dataset with the given name (used as directory prefix).
+    '''
+    return c.get_dir_synthetic() + '/' + name + '/'
+
+def get_fname_manifest(name):
+    '''
+    Returns the file name of the manifest of the synthetic dataset with the given name.
+    @param name:                the name of the dataset
+    @return The file name of the manifest of the synthetic dataset with the given name.
+    '''
+    return get_dir(name) + 'dataset.json'
+
+def reset():
+    '''
+    Resets the caches of the landmarks and images of the previous dataset.
+    '''
+    lst._store = None
+    ic.get_cache().clear()
+
+def use_dataset(name):
+    '''
+    Points configuration (and all modules) to the synthetic dataset with the given name.
+    @param name:                the name of the dataset
+    '''
+    global _original
+    use_original()
+    with open(get_fname_manifest(name), 'r') as manifest_file:
+        manifest = json.load(manifest_file)
+    _original = (c.dir_prefix, c.nb_trainingSamples)
+    c.dir_prefix = get_dir(name)
+    c.nb_trainingSamples = manifest['nb_trainingSamples']
+    reset()
+
+def use_original():
+    '''
+    Points configuration (and all modules) back to the dataset used before use_dataset.
+    '''
+    global _original
+    if _original is not None:
+        c.dir_prefix, c.nb_trainingSamples = _original
+        _original = None
+        reset()
+
+def create_model():
+    '''
+    Creates the model of the synthetic samples from the landmarks of the real training samples.
+    @return For each tooth, the (mean, sqrt(Eigenvalues), Eigenvectors) of its shape model,
+            the mean of the poses (tx, ty, s, theta) of all teeth (in the cropped images) and the
+            deviations of the poses of each training sample from that mean (scaled by 1 / sqrt(nb training samples - 1)).
+    '''
+    XS = ls.get_landmarks()
+    shapes = []
+    for j in range(c.get_nb_teeth()):
+        M, Y = pa.PA(XS[j,:,:])
+        E, W, MU = pca.pca_percentage(Y)
+        shapes.append((MU, np.sqrt(E), W))
+    poses, MS_ref = ls.get_poses(XS)
+    # One pose vector (of all teeth) for each training sample
+    P = poses.transpose(1, 0, 2).reshape(XS.shape[1], -1)
+    P_MU = P.mean(axis=0)
+    return shapes, P_MU, (P - P_MU) / np.sqrt(P.shape[0] - 1)
+
+def sample_landmarks(model, random):
+    '''
+    Samples the landmarks of all teeth of a synthetic sample. Samples are drawn until all landmarks
+    lie within the preprocessed images with the safety margins of the preprocessor (as the real landmarks).
+    @param model:               the model (see create_model)
+    @param random:              the random number generator
+    @return The landmarks of all teeth (in the cropped images) (shape = (nb teeth, nb dimensions)).
+    '''
+    shapes, P_MU, P_D = model
+    while True:
+        # A normally distributed combination of the deviations has the covariance of the poses
+        # (sampling from the (singular) covariance matrix itself is numerically unstable)
+        poses = (P_MU + np.dot(random.normal(0, 1, P_D.shape[0]), P_D)).reshape(c.get_nb_teeth(), 4)
+        X = np.zeros((c.get_nb_teeth(), c.get_nb_dim()))
+        for j, (MU, E, W) in enumerate(shapes):
+            b = np.clip(random.normal(0, 1, E.shape[0]), -tolerable_deviation, tolerable_deviation) * E
+            X[j,:] = mu.full_align(pca.reconstruct(W, b, MU), *poses[j,:])
+        if (X[:,0::2].min() >= pre.left_saftey_offset and X[:,0::2].max() < crop_shape[1] - pre.right_safety_offset and
+            X[:,1::2].min() >= pre.top_safety_offset and X[:,1::2].max() < crop_shape[0] - pre.bottem_safety_offset):
+            return X
+
+def get_mirrored_landmarks(X):
+    '''
+    Returns the mirrored landmarks of the given landmarks (the landmarks in the horizontally
+    flipped radiograph: negated x coordinates, reversed order of the landmarks and teeth).
+    @param X:                   the landmarks of all teeth (in the radiograph)
+    @return The mirrored landmarks of all teeth.
+    '''
+    X_mirrored = np.zeros(X.shape)
+    for j in range(c.get_nb_teeth()):
+        x = X[l.get_mirrored_tooth_index(j),:].reshape(-1, 2)[::-1] * [-1, 1]
+        X_mirrored[j,:] = x.ravel()
+    return X_mirrored
+
+def render(X, random):
+    '''
+    Renders a synthetic radiograph of the given teeth.
+    @param X:                   the landmarks of all teeth (in the radiograph)
+    @param random:              the random number generator
+    @return The synthetic radiograph (grey levels in 3 channels, as the real radiographs).
+    '''
+    height, width = radiograph_shape
+    coarse = random.normal(0, background_deviation, (height / 32 + 2, width / 32 + 2)).astype(np.float32)
+    img = background + cv2.resize(cv2.GaussianBlur(coarse, (0, 0), 2), (width, height), interpolation=cv2.INTER_CUBIC)
+    for j in range(X.shape[0]):
+        x = X[j,:].reshape(-1, 2)
+        grey = random.uniform(*tooth_range)
+        # Sub-pixel polygon corners (4 fractional bits)
+        cv2.fillPoly(img, [np.round(x * 16).astype(np.int32)], grey, lineType=cv2.LINE_AA, shift=4)
+        pulp = x.mean(axis=0) + pulp_scale * (x - x.mean(axis=0))
+        cv2.fillPoly(img, [np.round(pulp * 16).astype(np.int32)], grey - pulp_contrast, lineType=cv2.LINE_AA, shift=4)
+    img = cv2.GaussianBlur(img, (0, 0), blur) + random.normal(0, noise, img.shape)
+    img = np.clip(np.round(img), 0, 255).astype(np.uint8)
+    return cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+
+def write_sample(task):
+    '''
+    Generates and writes the synthetic sample with the given number.
+    @param task:                the number of the sample, the model (see create_model), the seed
+                                and the methods used for preprocessing
+    '''
+    i, model, seed, methods = task
+    random = np.random.RandomState([seed, i])
+    offsets = np.tile([fu.offsetX, fu.offsetY], c.get_nb_landmarks())
+    X = sample_landmarks(model, random) + offsets
+    img = render(X, random)
+    # The annotations are noisy and rounded (as the real annotations), so the landmarks are not confined to the shape models
+    X = np.round(X + random.normal(0, annotation_noise, X.shape))
+
+    fnames = lst.get_fnames()
+    X_mirrored = get_mirrored_landmarks(X)
+    for j in range(c.get_nb_teeth()):
+        np.savetxt(fnames[i-1][j], X[j,:], fmt='%f')
+        np.savetxt(fnames[c.get_nb_trainingSamples()+i-1][j], X_mirrored[j,:], fmt='%f')
+    cv2.imwrite(c.get_fname_radiograph(i), img)
+    if len(methods) > 0:
+        ymin, xmin = int(fu.offsetY), int(fu.offsetX)
+        imgs = pre.preproccess_image(img, ymin, ymin + crop_shape[0] - 1, xmin, xmin + crop_shape[1] - 1)
+        for method in methods:
+            cv2.imwrite(c.get_fname_vis_pre(i, method), imgs[method])
+
+def generate(name, nb_samples, seed=0, methods=['SCD'], nb_processes=None):
+    '''
+    Generates the synthetic dataset with the given name from the current (real) dataset.
+    @param name:                the name of the dataset
+    @param nb_samples:          the number of synthetic training samples
+    @param seed:                the seed
+    @param methods:             the methods used for preprocessing (the preprocessed images are written for these methods)
+    @param nb_processes:        the number of processes (default: the number of CPUs)
+    '''
+    if nb_processes is None:
+        nb_processes = multiprocessing.cpu_count()
+    model = create_model()
+
+    dname = get_dir(name)
+    settings = (c.dir_prefix, c.nb_trainingSamples)
+    c.dir_prefix = dname
+    c.nb_trainingSamples = nb_samples
+    try:
+        for directory in [c.get_dir_radiographs(), c.get_dir_original_landmarks(), c.get_dir_mirrored_landmarks(), c.get_dir_vis_pre()]:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+        tasks = [(i, model, seed, methods) for i in c.get_trainingSamples_range()]
+        if nb_processes == 1:
+            map(write_sample, tasks)
+        else:
+            pool = multiprocessing.Pool(nb_processes)
+            try:
+                pool.map(write_sample, tasks)
+            finally:
+                pool.close()
+                pool.join()
+    finally:
+        c.dir_prefix, c.nb_trainingSamples = settings
+    # The manifest is written last, so a dataset with a manifest is complete
+    with open(get_fname_manifest(name), 'w') as manifest_file:
+        json.dump({'version' : version, 'nb_trainingSamples' : nb_samples, 'seed' : seed, 'methods' : methods}, manifest_file, indent=1, sort_keys=True)
+
+################################################################################
+# TESTS
+################################################################################
+def test(nb_samples=20):
+    import hashlib
+    import time
+    import sweep as sw
+
+    start = time.time()
+    generate('test', nb_samples, seed=1)
+    print 'Generate ' + str(nb_samples) + ' samples: ' + str(time.time() - start) + 's'
+
+    def get_hashes(name):
+        use_dataset(name)
+        fnames = [c.get_fname_radiograph(i) for i in [1, 2]] + [c.get_fname_vis_pre(i, 'SCD') for i in [1, 2]] + lst.get_fnames()[0]
+        hashes = []
+        for fname in fnames:
+            with open(fname, 'rb') as f:
+                hashes.append(hashlib.sha1(f.read()).hexdigest())
+        use_original()
+        return hashes
+    generate('test-copy', 2, seed=1, nb_processes=1)
+    print 'Deterministic: ' + str(get_hashes('test') == get_hashes('test-copy'))
+
+    use_dataset('test')
+    try:
+        start = time.time()
+        sw.print_table(sw.run(sw.get_grid()))
+        print 'Cross validation of ' + str(nb_samples) + ' samples: ' + str(time.time() - start) + 's'
+    finally:
+        use_original()
+
+if __name__ == "__main__":
+    test()
@@ -0,0 +1,164 @@
+'''
+Detection of the upper and lower jaw with mean appearance templates.
+For each jaw, the template is the mean of the jaw regions of the training
+samples at a coarse level of the gaussian pyramid. The template is matched
+(normalized cross-correlation, see cv2.matchTemplate) within a region of interest
+derived from the jaw positions in the training samples. The poses of the teeth
+relative to the center of their jaw are learned from the training samples, so the
+detection results in an initial pose (tx, ty, s, theta) for each tooth.
+The templates are trained in-process from the preprocessed training images and
+landmarks, without the external tools needed to train the cascade classifiers.
+@author     Matthias Moulin & Milan Samyn
+@version    1.0
+'''
+
+import cv2
+import numpy as np
+
+import configuration as c
+import fitting_utils as fu
+import gaussian_image_piramid as gip
+import image_cache as ic
+import loader as l
+import math_utils as mu
+import procrustes_analysis as pa
+
+level = 2                       # The level of the gaussian pyramid at which the templates are matched
+margin = 0.25                   # The margin around the jaw positions in the training samples (relative to the jaw size)
+                                # used for the regions of interest
+prior_weight = 0.05             # The weight of the (Gaussian) prior of the jaw centers relative to the normalized cross-correlation
+nb_jaws = 2                     # The number of jaws (the upper jaw and the lower jaw)
+
+class TemplateDetector(object):
+
+    def __init__(self, trainingSamples, method=''):
+        '''
+        Trains a template detector for both jaws on the given training samples.
+        @param trainingSamples:     the training samples
+        @param method:              the method used for preprocessing
+        '''
+        XS = l.create_partial_XS(trainingSamples)
+        nb_teeth = c.get_nb_teeth() / nb_jaws
+        # For each training sample, for each tooth, the landmarks in the cropped images
+        XS = XS - np.tile([fu.offsetX, fu.offsetY], c.get_nb_landmarks())
+
+        # For each jaw, for each training sample, the box (x_min, x_max, y_min, y_max) of the jaw
+        BS = np.zeros((nb_jaws, len(trainingSamples), 4))
+        for j in range(nb_jaws):
+            X = XS[j*nb_teeth:(j+1)*nb_teeth,:,:]
+            BS[j,:,0] = X[:,:,0::2].min(axis=(0,2))
+            BS[j,:,1] = X[:,:,0::2].max(axis=(0,2))
+            BS[j,:,2] = X[:,:,1::2].min(axis=(0,2))
+            BS[j,:,3] = X[:,:,1::2].max(axis=(0,2))
+        centers = np.dstack(((BS[:,:,0] + BS[:,:,1]) / 2.0, (BS[:,:,2] + BS[:,:,3]) / 2.0))
+        sizes = np.dstack(((BS[:,:,1] - BS[:,:,0]), (BS[:,:,3] - BS[:,:,2]))).mean(axis=1)
+
+        # For each jaw, the mean appearance of the jaw region (at the given level)
+        self.template_sizes = np.around(sizes / 2**level).astype(int)
+        self.templates = [np.zeros((self.template_sizes[j,1], self.template_sizes[j,0]), dtype=np.float32) for j in range(nb_jaws)]
+        for i in range(len(trainingSamples)):
+            pyramid = gip.first_channel(ic.get_pyramid(trainingSamples[i], method, level)).astype(np.float32)
+            for j in range(nb_jaws):
+                center = tuple(centers[j,i,:] / 2**level)
+                self.templates[j] += cv2.getRectSubPix(pyramid, tuple(self.template_sizes[j]), center)
+        for j in range(nb_jaws):
+            self.templates[j] /= len(trainingSamples)
+
+        # For each jaw, the mean and the standard deviation of the center of the jaw
+        self.center_means = centers.mean(axis=1)
+        self.center_stds = np.maximum(centers.std(axis=1), 1)
+        # For each jaw, the region of interest (x_min, x_max, y_min, y_max) of the center of the jaw
+        self.rois = np.zeros((nb_jaws, 4))
+        self.rois[:,0] = centers[:,:,0].min(axis=1) - margin * sizes[:,0]
+        self.rois[:,1] = centers[:,:,0].max(axis=1) + margin * sizes[:,0]
+        self.rois[:,2] = centers[:,:,1].min(axis=1) - margin * sizes[:,1]
+        self.rois[:,3] = centers[:,:,1].max(axis=1) + margin * sizes[:,1]
+
+        # For each tooth, the mean pose (tx, ty, s, theta) relative to the center of its jaw
+        self.MS = np.zeros((c.get_nb_teeth(), c.get_nb_dim()))
+        self.poses = np.zeros((c.get_nb_teeth(), 4))
+        for t in range(c.get_nb_teeth()):
+            M, Y = pa.PA(XS[t,:,:])
+            self.MS[t,:] = M
+            for i in range(len(trainingSamples)):
+                tx, ty, s, theta = mu.full_align_params(M, XS[t,i,:])
+                self.poses[t,:] += (tx - centers[t/nb_teeth,i,0], ty - centers[t/nb_teeth,i,1], s, theta)
+        self.poses /= len(trainingSamples)
+
+    def detect(self, img):
+        '''
+        Detects both jaws in the given image.
+        @param img:                 the (preprocessed) image
+        @return For each jaw, the center (shape = (nb jaws, 2)) and the matching score
+                (normalized cross-correlation).
+        '''
+        pyramid = gip.get_gaussian_pyramid_at(gip.first_channel(img), level).astype(np.float32)
+        centers = np.zeros((nb_jaws, 2))
+        scores = np.zeros(nb_jaws)
+        for j in range(nb_jaws):
+            w, h = self.template_sizes[j]
+            # The part of the image covered by the template for all centers in the region of interest
+            x_min = int(max(0, np.floor(self.rois[j,0] / 2**level - w / 2.0)))
+            x_max = int(min(pyramid.shape[1], np.ceil(self.rois[j,1] / 2**level + w / 2.0)))
+            y_min = int(max(0, np.floor(self.rois[j,2] / 2**level - h / 2.0)))
+            y_max = int(min(pyramid.shape[0], np.ceil(self.rois[j,3] / 2**level + h / 2.0)))
+            if (x_max - x_min < w or y_max - y_min < h):
+                # The region of interest is too small: the mean center is used
+                centers[j,:] = self.center_means[j,:]
+                continue
+            R = cv2.matchTemplate(pyramid[y_min:y_max, x_min:x_max], self.templates[j], cv2.TM_CCOEFF_NORMED)
+            # A row of incisors is almost periodic, so the correlation is combined with the prior of the jaw centers
+            xs = ((x_min + np.arange(R.shape[1]) + w / 2.0) * 2**level - self.center_means[j,0]) / self.center_stds[j,0]
+            ys = ((y_min + np.arange(R.shape[0]) + h / 2.0) * 2**level - self.center_means[j,1]) / self.center_stds[j,1]
+            S = R - prior_weight * 0.5 * (xs[np.newaxis,:] ** 2 + ys[:,np.newaxis] ** 2)
+            y, x = np.unravel_index(np.argmax(S), S.shape)
+            centers[j,:] = ((x_min + x + w / 2.0) * 2**level, (y_min + y + h / 2.0) * 2**level)
+            scores[j] = R[y, x]
+        return centers, scores
+
+    def get_poses(self, img):
+        '''
+        Returns the initial pose of each tooth in the given image.
+        @param img:                 the (preprocessed) image
+        @return For each tooth, the initial pose (tx, ty, s, theta) (shape = (nb teeth, 4)).
+        '''
+        centers, scores = self.detect(img)
+        poses = np.copy(self.poses)
+        nb_teeth = c.get_nb_teeth() / nb_jaws
+        for j in range(nb_jaws):
+            poses[j*nb_teeth:(j+1)*nb_teeth,0:2] += centers[j,:]
+        return poses
+
+    def get_initial_shapes(self, img):
+        '''
+        Returns the initial points of each tooth in the given image.
+        @param img:                 the (preprocessed) image
+        @return For each tooth, the initial points (shape = (nb teeth, nb dimensions)).
+        '''
+        poses = self.get_poses(img)
+        return np.array([mu.full_align(self.MS[t,:], *poses[t,:]) for t in range(c.get_nb_teeth())])
+
+################################################################################
+# TESTS
+################################################################################
+def test(method='SCD'):
+    import time
+    for i in c.get_trainingSamples_range():
+        trainingSamples = c.get_trainingSamples_range()
+        trainingSamples.remove(i)
+        start = time.time()
+        detector = TemplateDetector(trainingSamples, method)
+        print 'Training: ' + str(time.time() - start) + 's'
+
+        fname = c.get_fname_vis_pre(i, method)
+        img = cv2.imread(fname)
+
+        start = time.time()
+        PS = detector.get_initial_shapes(img)
+        print 'Detection: ' + str(time.time() - start) + 's'
+
+        fname = str(i) + 'td.png'
+        cv2.imwrite(fname, fu.mark_results(np.copy(img), PS, np.array([np.array([0,255,0])] * c.get_nb_teeth())))
+
+if __name__ == '__main__':
+    test()
@@ -8,6 +8,7 @@ while constructing the fitting functions (for each tooth, for each landmark).
 import numpy as np
 import cv2
 import configuration as c
+import image_cache as ic
 import loader as l
 import math_utils as mu
 import procrustes_analysis as pa
@@ -39,8 +40,7 @@ def create_landmarks_images(color_init=np.array([0,255,255]), color_mid=np.array
     @param method:      the method used for preproccesing
     '''
     for i in c.get_trainingSamples_range():
-        fname = c.get_fname_vis_pre(i, method)
-        img = cv2.imread(fname)
+        img = np.copy(ic.get_image(i, method))
         for j in range(c.get_nb_teeth()):
             xs, ys = mu.extract_coordinates(XS[j,(i-1),:])
             
@@ -90,8 +90,7 @@ def create_landmarks_and_models_images(color_init=np.array([0,255,255]), color_m
     @param method:      the method used for preproccesing
     '''
     for i in c.get_trainingSamples_range():
-        fname = c.get_fname_vis_pre(i, method)
-        img = cv2.imread(fname)
+        img = np.copy(ic.get_image(i, method))
         for j in range(c.get_nb_teeth()):
             xs, ys = mu.extract_coordinates(XS[j,(i-1),:])
             mxs, mys = mu.extract_coordinates(mu.full_align_with(MS[j], XS[j,(i-1),:]))
@@ -153,8 +152,7 @@ def create_models_images(color_init=np.array([0,255,255]), color_mid=np.array([2
     @param method:      the method used for preproccesing
     '''
     for i in c.get_trainingSamples_range():
-        fname = c.get_fname_vis_pre(i, method)
-        img = cv2.imread(fname)
+        img = np.copy(ic.get_image(i, method))
         for j in range(c.get_nb_teeth()):
             xs, ys = mu.extract_coordinates(mu.full_align_with(MS[j], XS[j,(i-1),:]))
             
@@ -208,8 +206,7 @@ def create_profile_normals_images(k=5, color_init=np.array([0,255,255]), color_m
     @param method:                  the method used for preproccesing
     '''
     for i in c.get_trainingSamples_range():
-        fname = c.get_fname_vis_pre(i, method)
-        img = cv2.imread(fname)
+        img = np.copy(ic.get_image(i, method))
         for j in range(c.get_nb_teeth()):
             xs, ys = mu.extract_coordinates(mu.full_align_with(MS[j], XS[j,(i-1),:]))
             
@@ -2,6 +2,7 @@ import cv2
 import numpy as np
 import loader as l
 import configuration as c
+import image_cache as ic
 import procrustes_analysis as pa
 import fitting_utils as fu
 import math_utils as mu
@@ -42,8 +43,7 @@ def test():
         trainingSamples.remove(i)
         preprocess(trainingSamples)
         
-        fname = c.get_fname_vis_pre(i, method)
-        img = cv2.imread(fname)
+        img = ic.get_image(i, method)
         
         for j in range(c.get_nb_teeth()):
             fname = c.get_fname_original_landmark(i, (j+1))
@@ -0,0 +1,134 @@
+'''
+Multi-Resolution Active Shape Models' fitting procedure started from a previous fit.
+When the same patient is imaged again or the same radiograph is submitted again
+(e.g. with a slightly different preprocessing), the previous fit (optionally moved
+with an estimated transformation) is already close to the target. The warm started
+fitting procedure therefore starts at a finer level of the gaussian pyramid and
+searches a smaller range along the profiles. If the profile cost of the shape found
+at the start level indicates that the warm start is bad, the fitting procedure falls
+back to the full resolution schedule (see fitting.multi_resolution_search).
+The fitting procedure uses the models created by fitting.preprocess.
+@author     Matthias Moulin & Milan Samyn
+@version    1.0
+'''
+
+import numpy as np
+
+import batch_fitting as bf
+import configuration as c
+import convergence as cv
+import fitting as f
+import fitting_utils as fu
+import gaussian_image_piramid as gip
+import math_utils as mu
+
+start_level = 1                 # The level of the gaussian pyramid at which a warm started fitting procedure starts
+m = 6                           # The number of pixels to sample either side for each of the model points along the profile normal
+                                # (used while iterating from a warm start)
+max_cost = 8.0                  # The largest median profile cost (Mahalanobis distance) of the landmarks at the start level
+                                # for which the warm start is accepted
+
+def transform(P, transformation):
+    '''
+    Transforms the given points with the given transformation about their center of gravity.
+    @pre    The coordinates are stored as successive xi, yi, xj, yj, ...
+    @param P:                   the points in the image coordinate frame
+    @param transformation:      the transformation (tx, ty, s, theta) to apply
+                                (translation, scaling and rotation about the center of gravity of P)
+    @return The transformed points in the image coordinate frame.
+    '''
+    tx, ty, s, theta = transformation
+    xm, ym = mu.get_center_of_gravity(P)
+    return mu.full_align(P, xm + tx, ym + ty, s, theta)
+
+def multi_resolution_search_warm(img, P_previous, tooth_index, transformation=None, fitting_function=1):
+    '''
+    Fits the tooth corresponding to the given tooth index in the given image
+    starting from the given previous fit.
+    @param img:                 the image
+    @param P_previous:          the previously fitted points for the target tooth
+    @param tooth_index:         the index of the the target tooth (used in MS, EWS, pns, pts)
+    @param transformation:      the estimated transformation (tx, ty, s, theta) from the previous image to the given image
+                                (see transform) (default: no transformation)
+    @param fitting_function:    the fitting function used
+                                * 0: fitting function along profile normal through landmark +
+                                     fitting function along profile gradient through landmark
+                                * 1: fitting function along profile normal through landmark
+                                * 2: fitting function along profile gradient through landmark
+    @return The fitted points for the tooth corresponding to the given tooth index,
+            the total number of iterations used (including the iterations of the full resolution schedule
+            after a rejected warm start) and whether the warm start was accepted
+            (otherwise the full resolution schedule is used).
+    '''
+    P_start = np.array(P_previous, dtype=float)
+    if transformation is not None:
+        P_start = transform(P_start, transformation)
+
+    level = min(start_level, f.max_level)
+    stacks = gip.get_stacked_gaussian_pyramids([img], level)
+    bs = np.zeros(1, dtype=int)
+    tooth_indices = np.array([tooth_index])
+
+    # Compute model point positions in image at start level
+    P = np.around(np.divide(P_start, 2**level))
+    nb_it = 0
+    nb_its = 0
+
+    while (level >= 0):
+        nb_it += 1
+        nb_its += 1
+        P_found = bf.search_batch(stacks[level], P[np.newaxis,:], bs, tooth_indices, level, fitting_function, m=m)
+        P_new = f.validate(None, tooth_index, P_found[0,:], nb_it)
+        nb_close_points = bf.nb_closest_points(P, P_new)
+        P = P_new
+
+        # Repeat unless more than pclose of the points are found close to the current position
+        # or nmax iterations have been applied at this resolution
+        print 'Level:' + str(level) + ', Iteration: ' + str(nb_it) + ', Ratio: ' + str((2 * nb_close_points / float(P.shape[0])))
+
+        converged = (2 * nb_close_points / float(P.shape[0]) >= f.pclose)
+        if (converged or nb_it >= f.max_it):
+            if (level == min(start_level, f.max_level)):
+                cost = np.median(bf.evaluate_batch(stacks[level], P[np.newaxis,:], bs, tooth_indices, level, fitting_function))
+                if (cost > max_cost):
+                    print 'Warm start rejected: ' + str(cost)
+                    # Fall back to the full resolution schedule (the controller only counts its iterations)
+                    controller = cv.ConvergenceController(early_exit=False)
+                    P = f.multi_resolution_search(img, P_start, tooth_index, fitting_function, controller=controller)
+                    return P, nb_its + controller.get_nb_iterations(), False
+            if (level > 0):
+                level -= 1
+                nb_it = 0
+                P = P * 2
+            else:
+                break
+
+    return P, nb_its, True
+
+################################################################################
+# TESTS
+################################################################################
+def test():
+    import cv2
+    import time
+    for i in c.get_trainingSamples_range():
+        trainingSamples = c.get_trainingSamples_range()
+        trainingSamples.remove(i)
+        f.preprocess(trainingSamples)
+
+        fname = c.get_fname_vis_pre(i, f.method)
+        img = cv2.imread(fname)
+
+        for j in range(c.get_nb_teeth()):
+            fname = c.get_fname_original_landmark(i, (j+1))
+            P = fu.original_to_cropped(np.fromfile(fname, dtype=float, count=-1, sep=' '))
+            R = f.multi_resolution_search(img, P, j)
+            # Submit the same radiograph again, starting from the previous fit
+            start = time.time()
+            R_warm, nb_its, accepted = multi_resolution_search_warm(img, R, j)
+            print 'Fitting: ' + str(time.time() - start) + 's, Iterations: ' + str(nb_its) + ', Accepted: ' + str(accepted)
+            fname = str(i) + '-' + str((j+1)) + 'w.png'
+            cv2.imwrite(fname, fu.mark_results(np.copy(img), np.array([R, R_warm])))
+
+if __name__ == "__main__":
+    test()